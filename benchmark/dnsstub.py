@@ -0,0 +1,115 @@
+import argparse
+import ipaddress
+import socketserver
+import threading
+import time
+
+from utils.dns import RCODE_NXDOMAIN, TYPE_A, TYPE_AAAA, TYPE_CNAME, build_response, parse_message
+
+# 本地测试 DNS 服务，用于离线测试解析器的缓存、TTL 和预取：
+# python -m benchmark.dnsstub --port 5300 --ttl 30 --delay-ms 50 "a.test=127.0.0.1" "www.test=>a.test" "*=127.0.0.2"
+
+
+class StubDNSServer:
+    """
+    在后台线程中运行的 UDP DNS 服务。records 为 {名称: 值}，值为 IP 地址列表，
+    或以 "=>" 开头的 CNAME 目标；"*" 匹配其他所有名称，未匹配的名称返回 NXDOMAIN。
+    delay_ms 模拟上游解析延迟，queries 记录收到的每个查询 (名称, 类型)。
+    """
+
+    def __init__(self, records, host="127.0.0.1", port=0, ttl=60, delay_ms=0):
+        self.records = {name.lower(): value for name, value in records.items()}
+        self.ttl = ttl
+        self.delay_ms = delay_ms
+        self.queries = []
+        self.server = socketserver.ThreadingUDPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    @property
+    def nameserver(self):
+        host, port = self.address
+        return f"{host}:{port}"
+
+    def _answers(self, name, rtype):
+        answers = []
+        for _ in range(8):  # CNAME 链最长 8 层
+            value = self.records.get(name, self.records.get("*"))
+            if value is None:
+                return answers, not answers
+            if isinstance(value, str) and value.startswith("=>"):
+                target = value[2:].lower()
+                answers.append((name, TYPE_CNAME, self.ttl, target))
+                name = target
+                continue
+            for ip in [value] if isinstance(value, str) else value:
+                version = ipaddress.ip_address(ip).version
+                if (rtype, version) in ((TYPE_A, 4), (TYPE_AAAA, 6)):
+                    answers.append((name, rtype, self.ttl, ip))
+            return answers, False
+        return answers, False
+
+    def _handler(self):
+        stub = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                try:
+                    query = parse_message(data)
+                except Exception:
+                    return
+                name, rtype = query.questions[0]
+                stub.queries.append((name, rtype))
+                answers, nxdomain = stub._answers(name, rtype)
+                if stub.delay_ms:
+                    time.sleep(stub.delay_ms / 1000)
+                sock.sendto(build_response(query, answers, RCODE_NXDOMAIN if nxdomain else 0), self.client_address)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_records(items):
+    """解析命令行记录，例如 "a.test=127.0.0.1,::1"、"www.test=>a.test" """
+    records = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        records[name] = "=" + value if value.startswith(">") else value.split(",")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地测试 DNS 服务")
+    parser.add_argument("records", nargs="+", help='名称=IP[,IP]、名称=>CNAME 目标，"*" 匹配其他名称')
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5300)
+    parser.add_argument("--ttl", type=int, default=60)
+    parser.add_argument("--delay-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    with StubDNSServer(parse_records(args.records), args.host, args.port, args.ttl, args.delay_ms) as server:
+        print(f"DNS stub on {server.nameserver}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(f"{len(server.queries)} queries")
@@ -0,0 +1,285 @@
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import socket
+import tempfile
+import threading
+import time
+
+import psutil
+
+from benchmark.fixture import FixtureSite, add_arguments, spec_from_args
+from config.config import config
+
+# 离线端到端基准：本地合成站点 + 本地 S3 模拟服务，不访问公网
+# python -m benchmark.e2e --modes local minio --repeat 3 --save-baseline benchmark/baseline.json
+# python -m benchmark.e2e --modes local minio --repeat 3 --baseline benchmark/baseline.json
+#
+# 需要 Playwright/Chromium 和 tshark（或 capture_backend=afpacket），抓包网卡默认为 lo；
+# 使用 veth 时传 --interface veth0 --host <veth 上的地址>。
+
+# 与基线比较的指标：名称 -> 数值越大越好
+COMPARED = {"tasks_per_minute": True, "task_seconds.p50": False, "task_seconds.p90": False,
+            "rss_peak_mb": False}
+PHASE_KEYS = ("p50", "p90")
+
+
+def _free_port(host):
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values):
+    """最近秩法计算百分位数"""
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def rank(p):
+        return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+    return {"p50": rank(50), "p90": rank(90), "p99": rank(99), "max": values[-1],
+            "mean": round(sum(values) / len(values), 3), "count": len(values)}
+
+
+class MemorySampler:
+    """定期采样本进程及全部子进程（Playwright 驱动、Chromium、tshark）的 RSS 总和，记录峰值"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        process = psutil.Process()
+        total = 0
+        for proc in [process] + process.children(recursive=True):
+            try:
+                total += proc.memory_info().rss
+            except psutil.Error:
+                continue
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self._sample()
+
+
+def configure(args, workdir):
+    """在导入采集模块前改写配置，采集模块的默认参数在导入时读取配置"""
+    config["spider"]["interface"] = args.interface
+    config["spider"]["output_dir"] = workdir
+    if args.backend:
+        config["spider"]["capture_backend"] = args.backend
+    if args.profile:
+        config["spider"]["capture_profile"] = args.profile
+    for section in ("metrics", "capture"):
+        if not config.has_section(section):
+            config.add_section(section)
+    config["metrics"]["enabled"] = "true"
+    config["metrics"]["dir"] = os.path.join(workdir, "metrics")
+    config["metrics"]["spider_http_port"] = "0"
+    config["capture"]["filter_mode"] = "exclude"
+
+
+def start_s3(args):
+    """使用 --endpoint 指定的 S3 服务，否则在本地启动 moto 服务，返回需要停止的服务"""
+    server = None
+    if args.endpoint:
+        endpoint = args.endpoint
+    else:
+        from moto.server import ThreadedMotoServer  # 仅基准测试需要
+
+        port = _free_port("127.0.0.1")
+        server = ThreadedMotoServer(ip_address="127.0.0.1", port=port, verbose=False)
+        server.start()
+        endpoint = f"http://127.0.0.1:{port}"
+        config["minio"]["access_key"] = "testing"
+        config["minio"]["secret_key"] = "testing"
+    config["minio"]["endpoint_url"] = endpoint
+    config["minio"]["bucket_name"] = args.bucket
+
+    from spider.coordinator import create_s3_client
+
+    try:
+        create_s3_client().create_bucket(Bucket=args.bucket)
+    except Exception:
+        pass  # 存储桶已存在
+    return server
+
+
+def read_records(path, mode):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [record for record in map(json.loads, f) if record.get("mode") == mode]
+
+
+def summarize(records, wall_seconds, rss_peak):
+    phases = {}
+    for record in records:
+        for name, seconds in record.get("phases", {}).items():
+            phases.setdefault(name, []).append(seconds)
+    ok = [record for record in records if record["result"] == "ok"]
+    summary = {
+        "tasks": len(records),
+        "ok": len(ok),
+        "wall_seconds": round(wall_seconds, 3),
+        "tasks_per_minute": round(len(ok) / wall_seconds * 60, 2) if wall_seconds else 0,
+        "task_seconds": percentiles([record["duration"] for record in records]),
+        "phases": {name: percentiles(values) for name, values in sorted(phases.items())},
+        "pcap_bytes": percentiles([record.get("bytes", 0) for record in ok]),
+        "drops": sum(record.get("drops", 0) for record in records),
+        "page_timeouts": sum(record.get("timeouts", 0) for record in records),
+        "page_errors": sum(record.get("errors", 0) for record in records),
+        "rss_peak_mb": round(rss_peak / (1024 * 1024), 1),
+    }
+    upload_seconds = sum(record.get("upload_seconds", 0) for record in records)
+    if upload_seconds:
+        upload_bytes = sum(record.get("upload_bytes", 0) for record in records)
+        summary["upload_mbps"] = round(upload_bytes * 8 / upload_seconds / 1e6, 1)
+    return summary
+
+
+def run_mode(mode, urls, repeat, metrics_dir):
+    """按采集模式运行全部任务，返回汇总结果"""
+    if mode == "local":
+        from spider.capture_local import main
+    else:
+        from spider.capture_minio import main
+    from spider.spider import get_browser_pool
+
+    path = os.path.join(metrics_dir, "spider_tasks.jsonl")
+    skip = len(read_records(path, mode))  # 输出目录复用时跳过之前运行的记录
+    with MemorySampler() as sampler:
+        begin = time.perf_counter()
+        for r in range(repeat):
+            for i, url in enumerate(urls):
+                main([url], f"bench-{mode}-p{i}", r * len(urls) + i)
+        wall_seconds = time.perf_counter() - begin
+        # 下一个模式重新启动浏览器，内存峰值互不影响
+        get_browser_pool().close()
+    records = read_records(path, mode)[skip:]
+    return summarize(records, wall_seconds, sampler.peak)
+
+
+def _lookup(summary, key):
+    value = summary
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(result, baseline, tolerance):
+    """与基线比较，返回 (指标, 基线值, 当前值, 变化比例, 是否退化) 列表"""
+    rows = []
+    for mode, summary in result["modes"].items():
+        base = baseline.get("modes", {}).get(mode)
+        if base is None:
+            continue
+        keys = dict(COMPARED)
+        for name in summary["phases"]:
+            for p in PHASE_KEYS:
+                keys[f"phases.{name}.{p}"] = False
+        for key, higher_is_better in keys.items():
+            old, new = _lookup(base, key), _lookup(summary, key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            rows.append((f"{mode}.{key}", old, new, change, regressed))
+    return rows
+
+
+def print_summary(result):
+    for mode, summary in result["modes"].items():
+        print(f"[{mode}] {summary['ok']}/{summary['tasks']} ok, {summary['tasks_per_minute']} tasks/min, "
+              f"peak RSS {summary['rss_peak_mb']} MB, drops {summary['drops']}")
+        pcap = summary["pcap_bytes"]
+        if pcap:
+            print(f"  pcap bytes: p50 {pcap['p50']}  max {pcap['max']}")
+        if "upload_mbps" in summary:
+            print(f"  upload: {summary['upload_mbps']} Mbit/s")
+        print(f"  {'phase':<16}{'p50':>9}{'p90':>9}{'p99':>9}")
+        rows = [("task", summary["task_seconds"])] + list(summary["phases"].items())
+        for name, stats in rows:
+            if stats:
+                print(f"  {name:<16}{stats['p50']:>9.3f}{stats['p90']:>9.3f}{stats['p99']:>9.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线端到端采集基准")
+    add_arguments(parser)
+    parser.add_argument("--modes", nargs="+", choices=["local", "minio"], default=["local", "minio"])
+    parser.add_argument("--repeat", type=int, default=1, help="每个页面采集的次数")
+    parser.add_argument("--interface", default="lo")
+    parser.add_argument("--backend", choices=["tshark", "afpacket"], help="覆盖 [spider] capture_backend")
+    parser.add_argument("--profile", help="覆盖 [spider] capture_profile")
+    parser.add_argument("--endpoint", help="使用已有的 S3/MinIO 服务，默认启动本地 moto 服务")
+    parser.add_argument("--bucket", default="traffic")
+    parser.add_argument("--output", help="pcap 和指标的输出目录，默认使用临时目录")
+    parser.add_argument("--save-baseline", metavar="PATH", help="把结果保存为基线")
+    parser.add_argument("--baseline", metavar="PATH", help="与基线比较，有退化时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对变化，默认 20%%")
+    args = parser.parse_args()
+
+    workdir = args.output or tempfile.mkdtemp(prefix="traffic-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    configure(args, workdir)
+
+    from spider.supervisor import get_supervisor
+
+    get_supervisor()  # 在主线程中注册 SIGCHLD
+    s3_server = start_s3(args) if "minio" in args.modes else None
+    spec = spec_from_args(args)
+    result = {"created": time.time(), "host": platform.node(), "interface": args.interface,
+              "backend": config.get("spider", "capture_backend", fallback="tshark"),
+              "profile": config.get("spider", "capture_profile", fallback="full"),
+              "repeat": args.repeat, "site": spec.as_dict(), "modes": {}}
+    try:
+        with FixtureSite(spec, args.host, args.port, args.tls) as site:
+            for mode in args.modes:
+                result["modes"][mode] = run_mode(mode, site.urls(), args.repeat, config["metrics"]["dir"])
+            result["fixture_requests"] = site.requests
+    finally:
+        if s3_server is not None:
+            s3_server.stop()
+    # ru_maxrss 在 Linux 上单位为 KB，只包含已回收的子进程
+    result["maxrss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result["children_maxrss_mb"] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+
+    print(f"output: {workdir}")
+    print_summary(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("site") != result["site"] or baseline.get("interface") != result["interface"]:
+            print("warning: baseline was recorded with a different site spec or interface")
+        rows = compare(result, baseline, args.tolerance)
+        for key, old, new, change, regressed in rows:
+            print(f"{'REGRESSION' if regressed else 'ok':<11}{key:<40}{old:>12}{new:>12}{change:>+9.1%}")
+        if any(row[4] for row in rows):
+            raise SystemExit(1)
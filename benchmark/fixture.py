@@ -0,0 +1,177 @@
+import argparse
+import os
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 本地合成站点，用于离线基准测试：
+# python -m benchmark.fixture --pages 20 --assets 30 --asset-kb 50 --slow 2 --slow-ms 1500 --tls
+
+CONTENT_TYPES = {"js": "application/javascript", "css": "text/css", "png": "image/png"}
+ASSET_PATTERN = re.compile(r"^/a/(\d+)/(\d+)\.(js|css|png)$")
+SLOW_PATTERN = re.compile(r"^/slow/(\d+)/(\d+)$")
+PAGE_PATTERN = re.compile(r"^/p/(\d+)$")
+
+
+class SiteSpec:
+    """合成站点的参数：页面数、每页资源数和大小、每页慢接口数和延迟"""
+
+    def __init__(self, pages=10, assets=20, asset_kb=32, slow=1, slow_ms=1000, page_kb=16):
+        self.pages = pages
+        self.assets = assets
+        self.asset_kb = asset_kb
+        self.slow = slow
+        self.slow_ms = slow_ms
+        self.page_kb = page_kb
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+def _render_page(spec, number):
+    kinds = list(CONTENT_TYPES)
+    tags = []
+    for i in range(spec.assets):
+        kind = kinds[i % len(kinds)]
+        src = f"/a/{number}/{i}.{kind}"
+        if kind == "js":
+            tags.append(f'<script src="{src}"></script>')
+        elif kind == "css":
+            tags.append(f'<link rel="stylesheet" href="{src}">')
+        else:
+            tags.append(f'<img src="{src}">')
+    # 慢接口在页面加载后由脚本请求，模拟统计和长尾 XHR
+    fetches = "".join(f'fetch("/slow/{number}/{i}");' for i in range(spec.slow))
+    filler = "x" * (spec.page_kb * 1024)
+    links = "".join(f'<a href="/p/{i}">{i}</a>' for i in range(spec.pages))
+    return (f"<!doctype html><html><head><title>page {number}</title>{''.join(tags)}</head>"
+            f"<body>{links}<p>{filler}</p><script>{fetches}</script></body></html>").encode()
+
+
+class FixtureSite:
+    """
+    在后台线程中运行的合成站点。资源内容为随机字节（不可压缩），
+    所有响应禁止缓存，每次采集的流量量级稳定。
+    """
+
+    def __init__(self, spec=None, host="127.0.0.1", port=0, tls=False):
+        self.spec = spec or SiteSpec()
+        self.host = host
+        self.tls = tls
+        self.payload = os.urandom(self.spec.asset_kb * 1024)
+        self.pages = [_render_page(self.spec, i) for i in range(self.spec.pages)]
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.cert_dir = None
+        if tls:
+            self.cert_dir = tempfile.TemporaryDirectory()
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*self._self_signed_cert(self.cert_dir.name, host))
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        self.thread = None
+
+    @staticmethod
+    def _self_signed_cert(directory, host):
+        cert = os.path.join(directory, "cert.pem")
+        key = os.path.join(directory, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-subj", f"/CN={host}", "-keyout", key, "-out", cert],
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return cert, key
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    @property
+    def base_url(self):
+        return f"{'https' if self.tls else 'http'}://{self.host}:{self.port}"
+
+    def urls(self):
+        return [f"{self.base_url}/p/{i}" for i in range(self.spec.pages)]
+
+    def _handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, body, content_type):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                site.requests += 1
+                path = self.path.split("?")[0]
+                match = PAGE_PATTERN.match(path)
+                if match and int(match.group(1)) < len(site.pages):
+                    return self._send(site.pages[int(match.group(1))], "text/html; charset=utf-8")
+                match = ASSET_PATTERN.match(path)
+                if match:
+                    return self._send(site.payload, CONTENT_TYPES[match.group(3)])
+                match = SLOW_PATTERN.match(path)
+                if match:
+                    time.sleep(site.spec.slow_ms / 1000)
+                    return self._send(b'{"ok": true}', "application/json")
+                if path == "/":
+                    return self._send(site.pages[0], "text/html; charset=utf-8")
+                self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.cert_dir is not None:
+            self.cert_dir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def add_arguments(parser):
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--assets", type=int, default=20, help="每页的资源数")
+    parser.add_argument("--asset-kb", type=int, default=32)
+    parser.add_argument("--page-kb", type=int, default=16)
+    parser.add_argument("--slow", type=int, default=1, help="每页的慢接口数")
+    parser.add_argument("--slow-ms", type=int, default=1000)
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，veth 测试时使用 veth 上的地址")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--tls", action="store_true", help="使用自签名证书提供 HTTPS（需要 openssl）")
+
+
+def spec_from_args(args):
+    return SiteSpec(args.pages, args.assets, args.asset_kb, args.slow, args.slow_ms, args.page_kb)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线基准测试用的合成站点")
+    add_arguments(parser)
+    args = parser.parse_args()
+    with FixtureSite(spec_from_args(args), args.host, args.port, args.tls) as site:
+        print(f"serving {site.spec.pages} pages at {site.base_url}/p/0 .. /p/{site.spec.pages - 1}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,59 @@
+import argparse
+import multiprocessing
+import resource
+import time
+
+from utils.report import analyze_pcap, analyze_pcap_scapy
+
+# 对比 scapy.rdpcap 与流式解析的耗时和内存峰值：
+# python -m benchmark.parser capture1.pcap capture2.pcapng
+
+# 流式解析按 5 元组（含协议）划分流，原始 scapy 实现按 4 元组，TCP 与 UDP 使用相同地址和端口时
+# 流数量本来就不同，只单独打印，不参与一致性比较
+FLOW_FIELDS = ("total_flows", "total_bidirectional_flows")
+
+
+def compare_stats(stream_stats, scapy_stats):
+    """返回两种实现不一致的字段（流数量除外）"""
+    return [key for key in stream_stats if key not in FLOW_FIELDS and stream_stats[key] != scapy_stats.get(key)]
+
+
+def _run(func, path, results):
+    start = time.perf_counter()
+    stats = func(path)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss 在 Linux 上单位为 KB
+    results.put((stats, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def measure(func, path):
+    """在独立进程中运行，保证内存峰值互不影响"""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run, args=(func, path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="pcap 解析基准：scapy vs 流式解析")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--skip-scapy", action="store_true", help="文件过大时只测流式解析")
+    args = parser.parse_args()
+
+    for path in args.files:
+        stream_stats, stream_time, stream_rss = measure(analyze_pcap, path)
+        print(f"{path}: {stream_stats['total_packets']} packets")
+        print(f"  stream: {stream_time:8.2f}s  {stream_rss:8.1f}MB  "
+              f"{stream_stats['total_packets'] / stream_time:10.0f} pkt/s")
+        if args.skip_scapy:
+            continue
+        scapy_stats, scapy_time, scapy_rss = measure(analyze_pcap_scapy, path)
+        print(f"  scapy:  {scapy_time:8.2f}s  {scapy_rss:8.1f}MB  "
+              f"{scapy_stats['total_packets'] / scapy_time:10.0f} pkt/s")
+        differ = compare_stats(stream_stats, scapy_stats)
+        print(f"  speedup: {scapy_time / stream_time:.1f}x, "
+              f"stats {'DIFFER: ' + ', '.join(differ) if differ else 'match'}")
+        print("  flows (5-tuple vs 4-tuple): " + ", ".join(
+            f"{key} {stream_stats[key]} vs {scapy_stats[key]}" for key in FLOW_FIELDS))
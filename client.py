@@ -1,25 +1,85 @@
+import hashlib
+import json
 import os
 import threading
+import time
 from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus, urlparse
 
 import boto3
 from botocore.exceptions import BotoCoreError, ClientError
 
 from config.config import config
 from config.logger import logger
+from spider.coordinator import COORD_PREFIX
+from spider.metrics import get_metrics
+from utils.compress import decompress_file, strip_compression
+
+try:
+    from minio import Minio  # 可选依赖，用于监听存储桶事件
+except ImportError:
+    Minio = None
+
+DELETE_BATCH_LIMIT = 1000  # delete_objects 单次最多删除 1000 个对象
+
+
+def _md5_etag(path, size, etag, part_size=None):
+    """
+    按 S3 规则计算 ETag：普通对象为 MD5，分片对象为各分片 MD5 拼接后的 MD5 加 -N。
+    分片大小由采集端决定，part_size 为 None 或与分片数不符时无法校验，返回 None。
+    """
+    if "-" not in etag:
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    parts = int(etag.split("-")[1])
+    if not part_size or parts != max(1, -(-size // part_size)):
+        return None  # 分片大小未知，无法校验
+    digests = b""
+    with open(path, "rb") as f:
+        for _ in range(parts):
+            md5 = hashlib.md5()
+            remaining = part_size
+            while remaining:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                md5.update(chunk)
+                remaining -= len(chunk)
+            digests += md5.digest()
+    return f"{hashlib.md5(digests).hexdigest()}-{parts}"
 
 
 class MinioFileWatcher:
-    def __init__(self, endpoint_url, access_key, secret_key, bucket_name, local_download_path, max_workers=4, batch_size=10):
+    def __init__(self, endpoint_url, access_key, secret_key, bucket_name, local_download_path, max_workers=4,
+                 batch_size=DELETE_BATCH_LIMIT, min_interval=1.0, max_interval=30.0, flush_interval=5.0,
+                 use_notifications=True, s3_client=None, range_size=8 * 1024 * 1024, range_workers=4,
+                 decompress=config.getboolean("capture", "decompress_downloads", fallback=False)):
         self.endpoint_url = endpoint_url
         self.access_key = access_key
         self.secret_key = secret_key
         self.bucket_name = bucket_name
         self.local_download_path = local_download_path
-        self.s3_client = self._create_s3_client()
+        self.s3_client = s3_client or self._create_s3_client()
         self.lock = threading.Lock()
         self.max_workers = max_workers
-        self.batch_size = batch_size
+        self.batch_size = min(batch_size, DELETE_BATCH_LIMIT)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.flush_interval = flush_interval
+        self.use_notifications = use_notifications
+        self.range_size = range_size
+        self.range_workers = range_workers
+        self.decompress = decompress  # 下载后解压 .gz/.zst；默认保留压缩文件，分析脚本可直接读取
+
+        self.in_flight = set()  # 已提交下载、尚未删除的对象
+        self.pending_deletes = []  # 已下载完成、等待批量删除的对象
+        # 限制排队中的下载任务数，避免一次列出大量对象时占满内存
+        self.slots = threading.BoundedSemaphore(max_workers * 4)
+        self.metrics = get_metrics("client")
 
     def _create_s3_client(self):
         return boto3.client(
@@ -30,46 +90,226 @@ class MinioFileWatcher:
             region_name="us-east-1",
         )
 
+    def _download_range(self, object_name, etag, part_path, start, end):
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=object_name,
+                                             Range=f"bytes={start}-{end}", IfMatch=etag)
+        with open(part_path, "r+b") as f:
+            f.seek(start)
+            for chunk in response["Body"].iter_chunks(1024 * 1024):
+                f.write(chunk)
+
+    def _download_ranges(self, object_name, etag, size, part_path, journal_path):
+        """并发按字节范围下载到临时文件，已完成的范围记录在日志中，中断后可续传"""
+        ranges = [(start, min(start + self.range_size, size) - 1) for start in range(0, size, self.range_size)]
+        done = set()
+        if os.path.exists(journal_path) and os.path.exists(part_path):
+            with open(journal_path, encoding="utf-8") as f:
+                journal = json.load(f)
+            if journal.get("etag") == etag and journal.get("size") == size:
+                done = set(journal["done"])
+                logger.info(f"续传 {object_name}：已完成 {len(done)}/{len(ranges)} 个分段")
+        if not done:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+
+        journal_lock = threading.Lock()
+
+        def fetch(i):
+            self._download_range(object_name, etag, part_path, *ranges[i])
+            with journal_lock:
+                done.add(i)
+                tmp = journal_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"etag": etag, "size": size, "done": sorted(done)}, f)
+                os.replace(tmp, journal_path)
+
+        todo = [i for i in range(len(ranges)) if i not in done]
+        with ThreadPoolExecutor(max_workers=self.range_workers) as executor:
+            for future in [executor.submit(fetch, i) for i in todo]:
+                future.result()
+
+    def _part_size(self, object_name, etag):
+        """分片上传对象第一个分片的大小（即采集端使用的分片大小），普通对象或查询失败时返回 None"""
+        if "-" not in etag:
+            return None
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket_name, Key=object_name, PartNumber=1)
+            return head["ContentLength"]
+        except (BotoCoreError, ClientError) as e:
+            logger.debug(f"读取 {object_name} 的分片大小失败，只校验文件大小: {e}")
+            return None
+
     def _download_file(self, object_name):
+        """
+        下载到 .part 临时文件，校验大小和 ETag 后原子重命名；
+        校验失败返回 None，对象不会被删除。
+        """
         local_path = os.path.join(self.local_download_path, object_name)
+        part_path = local_path + ".part"
+        journal_path = part_path + ".json"
         try:
-            with open(local_path, "wb") as f:
-                self.s3_client.download_fileobj(self.bucket_name, object_name, f)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            head = self.s3_client.head_object(Bucket=self.bucket_name, Key=object_name)
+            size = head["ContentLength"]
+            etag = head["ETag"].strip('"')
+
+            started = time.perf_counter()
+            with self.metrics.phase("download"):
+                if size > self.range_size:
+                    self._download_ranges(object_name, head["ETag"], size, part_path, journal_path)
+                else:
+                    with open(part_path, "wb") as f:
+                        self.s3_client.download_fileobj(self.bucket_name, object_name, f)
+            self.metrics.count("traffic_download_bytes_total", "bytes", size)
+            self.metrics.count("traffic_download_seconds_total", "download_seconds",
+                               round(time.perf_counter() - started, 3))
+
+            if os.path.getsize(part_path) != size:
+                logger.warning(f"文件 {object_name} 大小校验失败")
+                os.remove(part_path)
+                return None
+            with self.metrics.phase("verify"):
+                actual = _md5_etag(part_path, size, etag, self._part_size(object_name, etag))
+            if actual is not None and actual != etag:
+                logger.warning(f"文件 {object_name} ETag 校验失败: {actual} != {etag}")
+                os.remove(part_path)
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+                return None
+
+            os.replace(part_path, local_path)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            if self.decompress and strip_compression(local_path) != local_path:
+                try:
+                    with self.metrics.phase("decompress"):
+                        compressed, local_path = local_path, decompress_file(local_path)
+                    os.remove(compressed)
+                except Exception as e:
+                    logger.warning(f"解压 {local_path} 失败，保留压缩文件: {e}")
             logger.info(f"文件 {object_name} 已下载到 {local_path}")
             return local_path
-        except (BotoCoreError, ClientError) as e:
+        except (BotoCoreError, ClientError, OSError) as e:
             logger.warning(f"下载文件 {object_name} 失败: {e}")
         return None
 
-    def _delete_file(self, object_name):
-        try:
-            self.s3_client.delete_object(Bucket=self.bucket_name, Key=object_name)
-            logger.info(f"文件 {object_name} 已从 MinIO 删除")
-        except (BotoCoreError, ClientError) as e:
-            logger.warning(f"删除文件 {object_name} 失败: {e}")
+    def _delete_files(self, object_names):
+        """批量删除对象，每次请求最多 1000 个"""
+        for i in range(0, len(object_names), self.batch_size):
+            batch = object_names[i:i + self.batch_size]
+            try:
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+                failed = {error["Key"] for error in response.get("Errors", [])}
+                for error in response.get("Errors", []):
+                    logger.warning(f"删除文件 {error['Key']} 失败: {error.get('Message')}")
+                logger.info(f"已从 MinIO 删除 {len(batch) - len(failed)} 个文件")
+                self.metrics.inc("traffic_deleted_objects_total", len(batch) - len(failed))
+            except (BotoCoreError, ClientError) as e:
+                logger.warning(f"批量删除 {len(batch)} 个文件失败: {e}")
+            finally:
+                with self.lock:
+                    self.in_flight.difference_update(batch)
+
+    def _flush_deletes(self, force=False):
+        with self.lock:
+            if not self.pending_deletes or (not force and len(self.pending_deletes) < self.batch_size):
+                return
+            batch, self.pending_deletes = self.pending_deletes, []
+        self._delete_files(batch)
+
+    def _flush_loop(self):
+        """定期提交不足一批的删除，下载与删除之间没有按批次的等待"""
+        while True:
+            time.sleep(self.flush_interval)
+            self._flush_deletes(force=True)
+            self.metrics.write_textfile()
 
     def _process_file(self, object_name):
-        local_path = self._download_file(object_name)
-        if local_path:
-            self._delete_file(object_name)
+        task = self.metrics.start_task(object_name)
+        local_path = None
+        try:
+            local_path = self._download_file(object_name)
+            self.metrics.inc("traffic_downloads_total", result="ok" if local_path else "failed")
+            with self.lock:
+                if local_path:
+                    self.pending_deletes.append(object_name)
+                else:
+                    self.in_flight.discard(object_name)  # 下载失败，下一轮重试
+        finally:
+            task.finish("ok" if local_path else "failed")
+            self.slots.release()
+        self._flush_deletes()
+
+    def _submit(self, executor, object_name):
+        """提交下载任务，已在处理中的对象会被跳过；返回是否为新对象"""
+        with self.lock:
+            if object_name in self.in_flight:
+                return False
+            self.in_flight.add(object_name)
+        self.slots.acquire()
+        executor.submit(self._process_file, object_name)
+        return True
+
+    def _list_objects(self):
+        """分页列出存储桶中的全部对象"""
+        kwargs = {"Bucket": self.bucket_name}
+        while True:
+            response = self.s3_client.list_objects_v2(**kwargs)
+            for obj in response.get("Contents", []):
+                if not obj["Key"].startswith(COORD_PREFIX):  # 跳过多节点协调使用的租约对象
+                    yield obj["Key"]
+            if not response.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def _poll(self, executor):
+        """轮询模式：没有新对象时指数退避，有新对象时恢复到最短间隔"""
+        interval = self.min_interval
+        while True:
+            try:
+                submitted = sum(self._submit(executor, key) for key in self._list_objects())
+            except (BotoCoreError, ClientError) as e:
+                logger.error(f"监控存储桶时出错: {e}")
+                submitted = 0
+            if submitted:
+                logger.info(f"发现 {submitted} 个新文件")
+                interval = self.min_interval
+            else:
+                interval = min(interval * 2, self.max_interval)
+            time.sleep(interval)
+
+    def _listen(self, executor):
+        """事件模式：订阅 MinIO 的 s3:ObjectCreated 通知"""
+        parsed = urlparse(self.endpoint_url)
+        client = Minio(parsed.netloc, access_key=self.access_key, secret_key=self.secret_key,
+                       secure=parsed.scheme == "https")
+        while True:
+            # 先处理订阅前（或断线期间）已存在的对象
+            for key in self._list_objects():
+                self._submit(executor, key)
+            with client.listen_bucket_notification(self.bucket_name, events=["s3:ObjectCreated:*"]) as events:
+                for event in events:
+                    for record in event.get("Records", []):
+                        key = unquote_plus(record["s3"]["object"]["key"])
+                        if not key.startswith(COORD_PREFIX):
+                            self._submit(executor, key)
 
     def watch_and_download(self):
         """
-        监听 MinIO 存储桶，批量下载文件并删除。
+        监听 MinIO 存储桶，下载新文件并批量删除。
+        优先使用存储桶事件通知，不可用时退化为自适应退避轮询。
         """
+        threading.Thread(target=self._flush_loop, daemon=True).start()
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            while True:
+            if self.use_notifications and Minio is not None:
                 try:
-                    response = self.s3_client.list_objects_v2(Bucket=self.bucket_name)
-                    if "Contents" in response:
-                        object_list = [obj["Key"] for obj in response["Contents"]]
-                        for i in range(0, len(object_list), self.batch_size):
-                            batch = object_list[i:i + self.batch_size]
-                            tasks = [executor.submit(self._process_file, obj) for obj in batch]
-                            for task in tasks:
-                                task.result()  # 确保任务执行完毕
-                except (BotoCoreError, ClientError) as e:
-                    logger.error(f"监控存储桶时出错: {e}")
+                    self._listen(executor)
+                except Exception as e:
+                    logger.warning(f"存储桶事件通知不可用，改为轮询: {e}")
+            self._poll(executor)
 
 
 # 示例调用
@@ -80,5 +320,5 @@ if __name__ == "__main__":
     bucket_name = config["minio"]["bucket_name"]
     local_download_path = r"E:\dataset\new"  # 本地下载路径
 
-    watcher = MinioFileWatcher(endpoint_url, access_key, secret_key, bucket_name, local_download_path, max_workers=4, batch_size=10)
+    watcher = MinioFileWatcher(endpoint_url, access_key, secret_key, bucket_name, local_download_path, max_workers=4)
     watcher.watch_and_download()
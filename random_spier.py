@@ -1,8 +1,14 @@
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
-import time
+import argparse
+import asyncio
 import random
+import time
 import logging
 
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+
+from config.config import config
+from spider.frontier import Frontier
+
 
 # 配置日志记录器（你可替换为自己的 logger）
 logging.basicConfig(
@@ -21,68 +27,114 @@ def get_raw_urls(path):
     return urls
 
 
-class SequentialSpider:
-    def __init__(self, start_urls, timeout=10000):
+class FrontierSpider:
+    """
+    从起始 URL 出发广度优先地访问站内链接：链接由 Frontier 去重、规范化并按预算入队，
+    同一个浏览器上下文中最多 workers 个页面同时加载。
+    """
+
+    def __init__(self, start_urls, timeout=10000,
+                 workers=config.getint("frontier", "workers", fallback=4),
+                 report_interval=config.getfloat("frontier", "report_interval", fallback=10),
+                 frontier=None):
         self.start_urls = start_urls
         self.timeout = timeout
-        self.visited = set()
+        self.workers = workers
+        self.report_interval = report_interval
+        self.frontier = frontier if frontier is not None else Frontier()
+        self.frontier.seed(start_urls)
+        self.active = 0  # 正在加载的页面数
+        self.pages = 0  # 成功访问的页面数
+        self.errors = 0
+
+    async def _visit(self, context, url, depth):
+        page = None
+        try:
+            logger.info(f"[+] 访问: {url}（深度 {depth}）")
+            page = await context.new_page()
+            await page.set_extra_http_headers({
+                "Cache-Control": "no-cache, no-store, must-revalidate",
+                "Pragma": "no-cache",
+                "Expires": "0",
+            })
+            await page.goto(url, timeout=self.timeout, wait_until='networkidle')
+            await asyncio.sleep(random.uniform(1, 2))  # 模拟用户停留
+
+            # 抓取链接并入队
+            links = await page.eval_on_selector_all("a[href]", "elements => elements.map(e => e.href)")
+            added = self.frontier.extend(links, depth + 1)
+            self.pages += 1
+            logger.info(f"[✓] 成功访问: {url}，新增 {added} 个链接")
+        except PlaywrightTimeoutError:
+            self.errors += 1
+            logger.warning(f"[!] 超时跳过: {url}")
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"[✗] 错误访问 {url}: {e}", exc_info=True)
+        finally:
+            if page:
+                await page.close()
+
+    async def _worker(self, context):
+        while True:
+            item = self.frontier.pop()
+            if item is None:
+                if self.active == 0:
+                    return  # 队列为空且没有页面在加载，不会再有新链接
+                await asyncio.sleep(0.2)
+                continue
+            self.active += 1
+            try:
+                await self._visit(context, *item)
+            finally:
+                self.active -= 1
+
+    async def _report(self, begin):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self._log_progress(begin)
+
+    def _log_progress(self, begin):
+        elapsed = time.monotonic() - begin
+        logger.info(f"frontier {len(self.frontier)} 待访问，已访问 {self.pages} 页（失败 {self.errors}），"
+                    f"{self.pages / elapsed if elapsed else 0:.2f} 页/秒，并发 {self.active}，"
+                    f"已见 {len(self.frontier.seen)} 个 URL")
+
+    async def _scrape(self):
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=True)
+            context = await browser.new_context(ignore_https_errors=True)
+            context.set_default_navigation_timeout(self.timeout)
+
+            begin = time.monotonic()
+            reporter = asyncio.create_task(self._report(begin))
+            try:
+                await asyncio.gather(*(self._worker(context) for _ in range(self.workers)))
+            finally:
+                reporter.cancel()
+                await context.close()
+                await browser.close()
+            self._log_progress(begin)
+            logger.info(f"🎯 所有链接访问完毕: {self.frontier.stats()}")
 
     def scrape(self):
         """
-        For each starting URL, recursively visit all reachable links without repetition.
+        For each starting URL, visit reachable links within the frontier budgets, several pages at a time.
         """
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context(ignore_https_errors=True)
-            context.set_default_navigation_timeout(self.timeout)
-
-            queue = list(self.start_urls)
-
-            while queue:
-                url = queue.pop(0)
-                if url in self.visited:
-                    continue
-                page = None
-                try:
-                    logger.info(f"[+] 访问: {url}")
-                    self.visited.add(url)
-                    page = context.new_page()
-                    page.set_extra_http_headers({
-                        "Cache-Control": "no-cache, no-store, must-revalidate",
-                        "Pragma": "no-cache",
-                        "Expires": "0",
-                    })
-                    page.goto(url, timeout=self.timeout, wait_until='networkidle')
-                    time.sleep(random.uniform(1, 2))  # 模拟用户停留
-
-                    # 抓取链接并入队
-                    links = page.eval_on_selector_all("a", "elements => elements.map(e => e.href)")
-                    for link in links:
-                        if link.startswith("http") and link not in self.visited:
-                            queue.append(link)
-
-                    logger.info(f"[✓] 成功访问: {url}")
-                except PlaywrightTimeoutError:
-                    logger.warning(f"[!] 超时跳过: {url}")
-                except Exception as e:
-                    logger.error(f"[✗] 错误访问 {url}: {e}", exc_info=True)
-                finally:
-                    if page:
-                        page.close()
-
-            context.close()
-            browser.close()
-            logger.info("🎯 所有链接访问完毕")
+        asyncio.run(self._scrape())
 
 
 if __name__ == "__main__":
-    # 配置你的起始 URL 文件路径
-    urls = get_raw_urls('./config/urls.txt')  # 一行一个裸域名，如 example.com
-    index = 0
-    end = 1000
+    parser = argparse.ArgumentParser(description="从起始 URL 出发并发访问站内链接")
+    parser.add_argument("urls", nargs="?", default="./config/urls.txt", help="一行一个裸域名，如 example.com")
+    parser.add_argument("--start", type=int, default=0)
+    parser.add_argument("--end", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=config.getint("frontier", "workers", fallback=4))
+    args = parser.parse_args()
 
-    for url in urls[index:end]:
+    urls = get_raw_urls(args.urls)
+    for url in urls[args.start:args.end]:
         logger.info(f"\n🚀 开始爬取起始 URL: {url}")
-        spider = SequentialSpider([url])
+        spider = FrontierSpider([url], workers=args.workers)
         spider.scrape()
         logger.info(f"✅ 完成: {url}\n")
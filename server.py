@@ -1,11 +1,14 @@
-import os
 import re
-import subprocess
 import time
 
 import pandas as pd
-import psutil
 
+from config.config import config
+from config.logger import logger
+from spider.coordinator import ShardCoordinator, run_sharded
+from spider.jobs import JobQueue, run_campaign
+from spider.spider import get_browser_pool
+from spider.supervisor import get_supervisor
 from spider.capture_minio import main
 
 
@@ -53,33 +56,10 @@ def read_urls_by_cow2(path):
     return urls, names
 
 
-def kill_dumpcap():
-    """ 终止 dumpcap 进程 """
-    try:
-        result = subprocess.run("ps aux | grep dumpcap | grep -v grep | awk '{print $2}'",
-                                shell=True, capture_output=True, text=True)
-        pids = result.stdout.strip().split("\n")
-        for pid in pids:
-            if pid:
-                os.system(f"kill -9 {pid}")
-                print(f"成功终止 dumpcap 进程 PID: {pid}")
-    except Exception as e:
-        print(f"终止 dumpcap 进程失败: {e}")
-
-
-def kill_zombie_processes():
-    for proc in psutil.process_iter(['pid', 'ppid', 'name', 'status']):
-        if proc.info['status'] == psutil.STATUS_ZOMBIE and proc.info['name'] == 'headless_shell':
-            try:
-                os.waitpid(proc.info['pid'], os.P_NOWAIT)
-                print(f"清理僵尸进程：PID {proc.info['pid']}")
-            except Exception as e:
-                print(f"清理失败：{e}")
-
-
 if __name__ == '__main__':
+    get_supervisor()  # 在主线程中注册 SIGCHLD
 
-    # 按组织采集
+    # 按组织采集：一个任务包含组织的多个 URL，设置 [spider] spider_engine = async 可并发加载
     # urls, organizations = read_urls('./config/organizations_github_urls_.csv')
     # index = 0
     # for url, organization in zip(urls, organizations):
@@ -104,23 +84,25 @@ if __name__ == '__main__':
     # for url, name in zip(urls[index:end], names[index:end]):
     #     for _ in range(10):
     #         main([url], name, index)
-    #         kill_zombie_processes()
     #         time.sleep(1.5)
     #     index += 1
-    #     # 额外检查 dumpcap 是否仍在运行
-    #     kill_dumpcap()
     
     
-    # top 1K 热门网站
+    # top 1K 热门网站，每个网站采集 10 次；任务进度保存在 SQLite 队列中，重启后自动续跑
     urls, names = read_urls_by_cow2('./config/top_1000.txt')
     index = 0
     end = 1000
-    for url, name in zip(urls[index:end], names[index:end]):
-        for _ in range(10):
-            # print(url, name)
-            main([url], name, index)
-            kill_zombie_processes()
-            # time.sleep(1.5)
-        index += 1
-        # 额外检查 dumpcap 是否仍在运行
-        kill_dumpcap()
+
+    def after_task():
+        # 抓包与浏览器进程由监督器管理，不再扫描全部进程清理僵尸和 dumpcap
+        logger.info(f"浏览器池统计: {get_browser_pool().stats()}")
+        logger.info(f"子进程统计: {get_supervisor().stats()}")
+
+    if config.getboolean('coordinator', 'enabled', fallback=False):
+        # 多节点模式：各节点通过存储桶中的租约对象领取分片，不需要手动划分 index
+        coordinator = ShardCoordinator.from_config('top_1000')
+        run_sharded(coordinator, urls[index:end], names[index:end], main, repeat=10, start=index, after=after_task)
+    else:
+        queue = JobQueue()
+        queue.add('top_1000', urls[index:end], names[index:end], repeat=10, start=index)
+        run_campaign(queue, 'top_1000', main, after=after_task)
@@ -1,11 +1,16 @@
-import os
 import re
-import subprocess
 import time
 
 import pandas as pd
 
+from config.logger import logger
+from spider.jobs import JobQueue, run_campaign
+from spider.resolver import get_resolver
+from spider.spider import get_browser_pool
+from spider.supervisor import get_supervisor
 from spider.capture_local import main
+# 常驻 dumpcap 环形缓冲模式，任务结束后再切分 pcap
+# from spider.capture_ring import main
 
 
 def extract_urls(text):
@@ -39,20 +44,6 @@ def read_urls_by_cow(path):
     return urls, names
 
 
-def kill_dumpcap():
-    """ 终止 dumpcap 进程 """
-    try:
-        result = subprocess.run("ps aux | grep dumpcap | grep -v grep | awk '{print $2}'",
-                                shell=True, capture_output=True, text=True)
-        pids = result.stdout.strip().split("\n")
-        for pid in pids:
-            if pid:
-                os.system(f"kill -9 {pid}")
-                print(f"成功终止 dumpcap 进程 PID: {pid}")
-    except Exception as e:
-        print(f"终止 dumpcap 进程失败: {e}")
-
-
 def get_raw_urls(path):
     urls = []
     names = []
@@ -67,14 +58,19 @@ def get_raw_urls(path):
 
 
 if __name__ == '__main__':
+    get_supervisor()  # 在主线程中注册 SIGCHLD
     # top 1w github仓库
+    # 任务进度保存在 SQLite 队列中，重启后从中断处继续：python -m spider.jobs status urls
     urls, names = get_raw_urls('./config/urls.txt')
     index = 0
     end = 1000
-    for url, name in zip(urls[index:end], names[index:end]):
-        for _ in range(1):
-            main([url], name, index)
-            time.sleep(3)
-        index += 1
-        # 额外检查 dumpcap 是否仍在运行
-        # kill_dumpcap()
+    queue = JobQueue()
+    queue.add('urls', urls[index:end], names[index:end], repeat=1, start=index)
+
+    def after_task():
+        time.sleep(3)
+        logger.info(f"浏览器池统计: {get_browser_pool().stats()}")
+        logger.info(f"子进程统计: {get_supervisor().stats()}")
+        logger.info(f"DNS 缓存统计: {get_resolver().stats()}")
+
+    run_campaign(queue, 'urls', main, after=after_task)
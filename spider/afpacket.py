@@ -0,0 +1,232 @@
+import argparse
+import ctypes
+import mmap
+import os
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+
+from config.config import config
+from config.logger import logger
+from utils.pcap import PcapRecord, PcapWriter, PcapngWriter, PcapReader
+
+# <linux/if_packet.h>
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+
+# struct tpacket_block_desc / tpacket_hdr_v1
+BLOCK_HEADER = struct.Struct("=IIIII")  # version, offset_to_priv, block_status, num_pkts, offset_to_first_pkt
+# struct tpacket3_hdr
+PACKET_HEADER = struct.Struct("=IIIIIIHH")  # next_offset, sec, nsec, snaplen, len, status, mac, net
+# struct sockaddr_ll 紧跟在 TPACKET_ALIGN(sizeof(tpacket3_hdr)) 之后，sll_pkttype 偏移 10
+SLL_PKTTYPE_OFFSET = 48 + 10
+PACKET_OUTGOING = 4
+
+# /sys/class/net/<iface>/type -> pcap linktype
+ARPHRD_LINKTYPES = {1: 1, 772: 1, 65534: 101}
+
+
+def _linktype(interface):
+    try:
+        with open(f"/sys/class/net/{interface}/type") as f:
+            return ARPHRD_LINKTYPES.get(int(f.read().strip()), 1)
+    except OSError:
+        return 1
+
+
+def compile_bpf(interface, expression):
+    """借助 tcpdump -ddd 把过滤表达式编译成 classic BPF 指令"""
+    output = subprocess.run(["tcpdump", "-ddd", "-i", interface, expression],
+                            check=True, capture_output=True, text=True).stdout.split("\n")
+    count = int(output[0])
+    return [tuple(int(x) for x in line.split()) for line in output[1:count + 1]]
+
+
+class AfPacketCapture:
+    """
+    基于 AF_PACKET TPACKET_V3 mmap 环形缓冲的抓包引擎，替代 tshark 子进程。
+
+    内核按块把数据包写入共享内存，用户态逐块读取后直接写成 pcap/pcapng，
+    没有额外进程和管道拷贝；丢包数通过 PACKET_STATISTICS 读取。
+    sink 可以是文件路径或任何带 write() 的二进制对象（如分片上传器）。
+    rewrite 为可选的记录改写函数（如按流截断载荷），在写入前对每条记录调用。
+    writer_factory(linktype, snaplen) 可以替代默认的 pcap/pcapng 写入器（如会话模式）。
+    """
+
+    def __init__(self, interface, sink, capture_filter=None,
+                 snaplen=config.getint("afpacket", "snaplen", fallback=262144),
+                 block_size=config.getint("afpacket", "block_size_kb", fallback=1024) * 1024,
+                 block_nr=config.getint("afpacket", "block_nr", fallback=64),
+                 output_format=config.get("afpacket", "format", fallback="pcap"),
+                 rewrite=None, writer_factory=None):
+        self.interface = interface
+        self.sink = sink
+        self.capture_filter = capture_filter
+        self.snaplen = snaplen
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.output_format = output_format
+        self.rewrite = rewrite
+        self.writer_factory = writer_factory
+        # 回环网卡上每个包会以收/发两个方向各出现一次，与 libpcap 一样丢弃发送方向
+        self.skip_outgoing = interface == "lo"
+        self.sock = None
+        self.ring = None
+        self.writer = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+        self.packets = 0
+        self.bytes = 0
+        self.kernel_packets = 0
+        self.drops = 0
+        self.freeze_count = 0
+
+    def _attach_filter(self):
+        program = compile_bpf(self.interface, self.capture_filter)
+        buffer = ctypes.create_string_buffer(b"".join(struct.pack("=HBBI", *ins) for ins in program))
+        fprog = struct.pack("@HP", len(program), ctypes.addressof(buffer))
+        self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+    def _open(self):
+        # 协议为 0 时套接字不接收任何包，环形缓冲区建好后再按协议绑定到网卡，
+        # 否则 bind 之前其他网卡的包也会进入第一个块
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+        if self.capture_filter:
+            self._attach_filter()
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        # struct tpacket_req3: block_size, block_nr, frame_size, frame_nr, retire_blk_tov(ms), sizeof_priv, feature
+        frame_size = 2048
+        req = struct.pack("=IIIIIII", self.block_size, self.block_nr, frame_size,
+                          self.block_size * self.block_nr // frame_size, 60, 0, 0)
+        self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+        self.ring = mmap.mmap(self.sock.fileno(), self.block_size * self.block_nr,
+                              mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.sock.bind((self.interface, ETH_P_ALL))
+
+    def _read_block(self, offset):
+        ring = self.ring
+        _, _, status, num_pkts, first = BLOCK_HEADER.unpack_from(ring, offset)
+        if not status & TP_STATUS_USER:
+            return False
+        pkt = offset + first
+        for _ in range(num_pkts):
+            next_offset, sec, nsec, caplen, length, _, mac, _ = PACKET_HEADER.unpack_from(ring, pkt)
+            if self.skip_outgoing and ring[pkt + SLL_PKTTYPE_OFFSET] == PACKET_OUTGOING:
+                pkt += next_offset
+                continue
+            caplen = min(caplen, self.snaplen)
+            data = ring[pkt + mac:pkt + mac + caplen]
+            record = PcapRecord(sec, nsec, caplen, length, data)
+            self.writer.write(self.rewrite(record) if self.rewrite else record)
+            self.packets += 1
+            self.bytes += length
+            pkt += next_offset
+        struct.pack_into("=I", ring, offset + 8, TP_STATUS_KERNEL)  # 归还给内核
+        return True
+
+    def _loop(self):
+        poller = select.poll()
+        poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        block = 0
+        try:
+            while True:
+                if self._read_block(block * self.block_size):
+                    block = (block + 1) % self.block_nr
+                    continue
+                if self.stop_event.is_set():
+                    break
+                poller.poll(100)
+        except Exception as e:
+            logger.error(f"AF_PACKET 抓包失败: {e}", exc_info=True)
+
+    def start(self):
+        self._open()
+        if self.writer_factory is not None:
+            self.writer = self.writer_factory(_linktype(self.interface), self.snaplen)
+        else:
+            writer_cls = PcapngWriter if self.output_format == "pcapng" else PcapWriter
+            self.writer = writer_cls(self.sink, _linktype(self.interface), self.snaplen, nanosecond=True)
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+        logger.info(f"AF_PACKET 抓包已启动: {self.interface}，过滤器: {self.capture_filter}")
+        return True
+
+    def stats(self):
+        """读取并累计内核统计（内核在每次读取后清零）"""
+        if self.sock is not None:
+            packets, drops, freeze = struct.unpack("=III", self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+            self.kernel_packets += packets
+            self.drops += drops
+            self.freeze_count += freeze
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "kernel_packets": self.kernel_packets,
+            "drops": self.drops,
+            "freeze_count": self.freeze_count,
+        }
+
+    def stop(self):
+        # 先等待 retire_blk_tov 超时，让内核把未满的块交给用户态
+        time.sleep(0.1)
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+        stats = self.stats()
+        if self.writer:
+            self.writer.close()
+        if self.ring:
+            self.ring.close()
+        if self.sock:
+            self.sock.close()
+        self.sock = self.ring = self.writer = self.thread = None
+        logger.info(f"AF_PACKET 抓包结束: {stats}")
+        return stats
+
+
+def _bench_tshark(interface, duration, capture_filter, path):
+    cmd = ["tshark", "-q", "-i", interface, "-F", "pcap", "-w", path]
+    if capture_filter:
+        cmd += ["-f", capture_filter]
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    time.sleep(duration)
+    process.terminate()
+    stderr = process.communicate(timeout=10)[1]
+    with PcapReader(path) as reader:
+        packets = sum(1 for _ in reader)
+    return {"packets": packets, "bytes": os.path.getsize(path), "stderr": stderr.strip()}
+
+
+if __name__ == "__main__":
+    # 对比吞吐和丢包：在 veth 另一端用 iperf3 / tcpreplay 打流，然后
+    # python -m spider.afpacket -i veth0 -d 10 --tshark
+    parser = argparse.ArgumentParser(description="AF_PACKET TPACKET_V3 抓包")
+    parser.add_argument("-i", "--interface", default=config["spider"]["interface"])
+    parser.add_argument("-d", "--duration", type=float, default=10)
+    parser.add_argument("-f", "--filter", default=None)
+    parser.add_argument("-w", "--output", default="afpacket.pcap")
+    parser.add_argument("--tshark", action="store_true", help="随后用 tshark 采集同样时长作为对照")
+    args = parser.parse_args()
+
+    engine = AfPacketCapture(args.interface, args.output, args.filter)
+    engine.start()
+    time.sleep(args.duration)
+    result = engine.stop()
+    print(f"afpacket: {result['packets'] / args.duration:.0f} pps, "
+          f"{result['bytes'] * 8 / args.duration / 1e6:.1f} Mbit/s, drops={result['drops']}")
+
+    if args.tshark:
+        result = _bench_tshark(args.interface, args.duration, args.filter, "tshark.pcap")
+        print(f"tshark: {result['packets'] / args.duration:.0f} pps, {result['stderr']}")
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from config.config import config
+from config.logger import logger
+from spider.resolver import get_resolver
+
+# 每个站点已学习到的服务器 IP，在重复采集时逐步扩大 target 模式的过滤范围；
+# 最多保留 MAX_LEARNED_SITES 个最近采集的站点，每个站点最多 MAX_LEARNED_IPS 个 IP（过滤器长度有限）
+_learned_hosts = OrderedDict()
+MAX_LEARNED_SITES = config.getint("capture", "max_learned_sites", fallback=1000)
+MAX_LEARNED_IPS = config.getint("capture", "max_learned_ips", fallback=256)
+
+
+def _hostname(url):
+    return url.split("://")[-1].split("/")[0].split(":")[0]
+
+
+def _resolve_all(hostname):
+    """解析主机名的全部 IPv4/IPv6 地址（经过解析器缓存）"""
+    return set(get_resolver().resolve(hostname)) if hostname else set()
+
+
+class CaptureFilter:
+    """
+    构造 tshark/dumpcap 的 BPF 捕获过滤器。
+
+    exclude 模式（默认）：捕获全部流量，但始终排除 MinIO 上传通道、
+    exclude_ports 中的管理端口（SSH 等）和解析器预取使用的 DNS 源端口。
+    target 模式：只保留 DNS 以及目标站点已知服务器的流量。BPF 过滤器在
+    抓包进程启动时固定，爬虫解析到的新主机名会在同一站点的下一次采集
+    中加入过滤器。只有 target 模式需要解析主机名。
+    """
+
+    def __init__(self, urls,
+                 mode=config.get("capture", "filter_mode", fallback="exclude"),
+                 exclude_ports=config.get("capture", "exclude_ports", fallback="22")):
+        self.mode = mode
+        self.site = _hostname(urls[0]) if urls else ""
+        self.exclude_ports = [p.strip() for p in exclude_ports.split(",") if p.strip()]
+        self.target_ips = set()
+        if mode == "target":
+            self.target_ips = _learned_hosts.setdefault(self.site, set())
+            _learned_hosts.move_to_end(self.site)
+            while len(_learned_hosts) > MAX_LEARNED_SITES:
+                _learned_hosts.popitem(last=False)
+            self._add(_hostname(url) for url in urls)
+
+    def _add(self, hostnames):
+        for hostname in hostnames:
+            for ip in sorted(_resolve_all(hostname)):
+                if len(self.target_ips) >= MAX_LEARNED_IPS:
+                    return
+                self.target_ips.add(ip)
+
+    def _control_plane(self):
+        """MinIO 端点、管理端口和解析器预取流量的排除条件"""
+        clauses = [f"port {port}" for port in self.exclude_ports]
+        resolver = get_resolver()
+        if resolver.source_port:
+            clauses.append(f"udp port {resolver.source_port}")
+        endpoint = config.get("minio", "endpoint_url", fallback=None)
+        if endpoint:
+            parsed = urlparse(endpoint)
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+            for ip in sorted(_resolve_all(parsed.hostname)):
+                clauses.append(f"(host {ip} and tcp port {port})")
+        return clauses
+
+    def learn(self, hostnames):
+        """
+        记录爬虫实际访问到的主机名，扩大后续采集的过滤范围；仅 target 模式有效。
+        需要在抓包停止后调用，解析产生的 DNS 查询不会进入本次采集。
+        """
+        if self.mode != "target":
+            return
+        before = len(self.target_ips)
+        self._add(hostnames)
+        if len(self.target_ips) > before:
+            logger.info(f"{self.site} 新增 {len(self.target_ips) - before} 个目标 IP，"
+                        f"共 {len(self.target_ips)} 个")
+
+    def build(self, base=None):
+        """返回过滤表达式，base 为额外的协议限定（如 "tcp or udp"）"""
+        parts = []
+        if base:
+            parts.append(f"({base})")
+        if self.mode == "target":
+            hosts = " or ".join(f"host {ip}" for ip in sorted(self.target_ips))
+            parts.append(f"(udp port 53 or {hosts})" if hosts else "(udp port 53)")
+        excluded = self._control_plane()
+        if excluded:
+            parts.append(f"not ({' or '.join(excluded)})")
+        return " and ".join(parts)
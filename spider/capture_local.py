@@ -1,88 +1,150 @@
 import datetime
+import json
 import os
-import socket
 import subprocess
+import tempfile
 import threading
 import time
 import signal
-import platform
 
 from config.config import config
 from config.logger import logger
-from spider.spider import SequentialSpider
+from spider.afpacket import AfPacketCapture
+from spider.capture_filter import CaptureFilter
+from spider.metrics import get_metrics, phase, tshark_drops
+from spider.profiles import load_profile, rewrite_stream
+from spider.quiescence import create_monitor
+from spider.resolver import get_resolver, hostname_of, resolve_hosts
+from spider.session import SessionCapture, crawl
+from spider.spider import create_spider
+from spider.supervisor import get_supervisor
+from utils.compress import CompressedWriter, capture_compression, compressed_name, sidecar_name
+from utils.pcap import PcapWriter
+
+# 单个任务的抓包进程最长运行时间（秒），超时由监督器结束
+TASK_DEADLINE = config.getint("supervisor", "task_deadline", fallback=300)
 
 
 class TrafficCapture:
-    def __init__(self):
-        self.interface = config["spider"]["interface"]
+    def __init__(self, interface=None):
+        self.interface = interface or config["spider"]["interface"]
         self.output_dir = config["spider"]["output_dir"]
         os.makedirs(self.output_dir, exist_ok=True)
 
         self.output_file = None
         self.tshark_process = None
+        self.backend = config.get("spider", "capture_backend", fallback="tshark")
+        self.engine = None
+        self.tshark_stderr = None
+        self.drops = 0  # 抓包引擎报告的丢包数
+        self.compression = capture_compression()
+        self.profile = load_profile()
+        self.truncator = None
+        self.writer = None  # 开启压缩时的压缩输出
+        self.copy_thread = None
         self.stop_event = threading.Event()
-        self.is_windows = platform.system().lower() == "windows"
 
     def _generate_filename(self, org, index):
         ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        return os.path.join(self.output_dir, f"{index}_{org}_{ts}.pcap")
+        return os.path.join(self.output_dir, compressed_name(f"{index}_{org}_{ts}.pcap", self.compression))
 
-    def start(self, org, index, duration=30):
+    def _copy_output(self):
+        """读取 tshark 标准输出直到 tshark 退出（EOF）：按流截断时逐条改写记录，否则直接压缩写入"""
+        try:
+            if self.truncator is not None:
+                rewrite_stream(self.tshark_process.stdout,
+                               lambda reader: PcapWriter(self.writer or self.output_file, reader.linktype,
+                                                         reader.snaplen, reader.nanosecond),
+                               self.truncator)
+                return
+            for chunk in iter(lambda: self.tshark_process.stdout.read(65536), b""):
+                self.writer.write(chunk)
+        except Exception as e:
+            logger.error(f"读取 tshark 输出失败: {e}")
+
+    def start(self, org, index, duration=30, capture_filter="tcp or udp"):
         self.output_file = self._generate_filename(org, index)
-        cmd = ["tshark", "-i", self.interface, "-w", self.output_file, "tcp or udp"]
+        if self.compression:
+            self.writer = CompressedWriter(self.output_file, self.compression)
+        if self.backend == "afpacket":
+            try:
+                self.engine = AfPacketCapture(self.interface, self.writer or self.output_file, capture_filter,
+                                              **self.profile.afpacket_options())
+                return self.engine.start()
+            except Exception as e:
+                logger.error(f"启动 AF_PACKET 抓包失败: {e}")
+                if self.writer is not None:
+                    self.writer.close()
+                return False
+
+        # 开启压缩或按流截断时 tshark 以 pcap 格式输出到标准输出，由线程边读边改写/压缩
+        self.truncator = self.profile.truncator()
+        piped = self.writer is not None or self.truncator is not None
+        cmd = ["tshark", "-i", self.interface, "-w", "-" if piped else self.output_file, "-f", capture_filter]
+        cmd += self.profile.tshark_options()
+        if self.truncator is not None:
+            cmd += ["-F", "pcap"]
 
         try:
             logger.info(f"启动 tshark 采集: {' '.join(cmd)}")
-
-            # 根据操作系统选择不同的启动方式
-            if self.is_windows:
-                self.tshark_process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.PIPE,
-                    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP  # 在 Windows 上使用新进程组
-                )
-            else:
-                self.tshark_process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.PIPE,
-                    preexec_fn=os.setsid  # 在 Unix 上创建一个新的进程组
-                )
+            # 由监督器在独立进程组中启动，任务超时后整组结束；
+            # stderr 写入临时文件，退出时从汇总信息中读取丢包数
+            self.tshark_stderr = tempfile.TemporaryFile()
+            self.tshark_process = get_supervisor().spawn(
+                cmd, "tshark", deadline=TASK_DEADLINE, stderr=self.tshark_stderr,
+                stdout=subprocess.PIPE if piped else subprocess.DEVNULL)
+            if piped:
+                self.copy_thread = threading.Thread(target=self._copy_output, daemon=True)
+                self.copy_thread.start()
             return True
         except Exception as e:
             logger.error(f"启动 tshark 失败: {e}")
+            if self.writer is not None:
+                self.writer.close()
             return False
 
 
     def stop(self):
-        if self.tshark_process and self.tshark_process.poll() is None:
-            try:
-                # 等待爬虫任务结束后发送停止信号
-                logger.info("发送 SIGINT 终止 tshark")
-                if self.is_windows:
-                    self.tshark_process.send_signal(signal.CTRL_BREAK_EVENT)  # Windows 特有的信号
-                else:
-                    os.killpg(os.getpgid(self.tshark_process.pid), signal.SIGINT)  # 发送 SIGINT 信号
-
-                # 等待 tshark 完成数据写入
-                self.tshark_process.wait(timeout=10)
-            except Exception as e:
-                logger.warning(f"优雅终止失败，尝试强杀: {e}")
-                self.tshark_process.kill()  # 强制终止进程
+        if self.engine is not None:
+            self.drops = self.engine.stop().get("drops", 0)
+            self.engine = None
+        if self.tshark_process is not None:
+            # 发送 SIGINT（Windows 上为 CTRL_BREAK）让 tshark 完成写入，超时后整组强杀
+            logger.info("发送 SIGINT 终止 tshark")
+            get_supervisor().terminate(self.tshark_process, signal.SIGINT, timeout=10)
+            if self.copy_thread is not None:
+                self.copy_thread.join(timeout=5)
+                self.copy_thread = None
+                self.tshark_process.stdout.close()
+            self.tshark_process = None
+            self.tshark_stderr.seek(0)
+            self.drops = tshark_drops(self.tshark_stderr.read().decode(errors="replace"))
+            self.tshark_stderr.close()
+            self.tshark_stderr = None
+        if self.writer is not None:
+            self.writer.close()
 
         logger.info(f"流量捕获结束，文件保存至: {self.output_file}")
 
+    def write_sidecar(self, data):
+        """在 pcap 旁写入同名 .json，记录本次采样的元数据"""
+        path = sidecar_name(self.output_file)
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            logger.warning(f"写入 {path} 失败: {e}")
+
 
 def resolve_ip(url):
-    try:
-        return socket.gethostbyname(url.split("://")[-1].split("/")[0])
-    except Exception as e:
-        logger.error(f"URL 解析失败: {e}")
+    ips = get_resolver().resolve(hostname_of(url))
+    if not ips:
+        logger.error(f"URL 解析失败: {url}")
         return None
+    return ips[0]
 
 
-def run_task(urls, org, index, duration=30):
+def run_task(urls, org, index, duration=30, interface=None):
     if not urls:
         logger.error("URL 列表为空")
         return False
@@ -92,25 +154,131 @@ def run_task(urls, org, index, duration=30):
         return False
     logger.info(f"目标 IP: {ip}")
 
-    capture = TrafficCapture()
-    if not capture.start(org, index, duration):
+    capture_filter = CaptureFilter(urls)
+    capture = TrafficCapture(interface)
+    monitor = create_monitor(capture.interface)
+    with phase("capture_start"):
+        started = capture.start(org, index, duration, capture_filter.build("tcp or udp"))
+    if not started:
         return False
 
+    start = time.time()
+    spider = None
     try:
         # 启动爬虫任务
-        SequentialSpider(urls).scrape()
+        spider = create_spider(urls, stop_condition=monitor)
+        with phase("spider"):
+            spider.scrape()
         logger.info("爬虫任务完成")
     except Exception as e:
         logger.error(f"爬虫异常: {e}")
     finally:
+        end = time.time()
         # 确保捕获进程完全停止
-        capture.stop()
-        time.sleep(1)  # 额外等待，确保进程完全停止
+        with phase("capture_stop"):
+            capture.stop()
+        with phase("stop_sleep"):
+            time.sleep(1)  # 额外等待，确保进程完全停止
+
+    metrics = get_metrics()
+    if os.path.exists(capture.output_file):
+        metrics.count("traffic_captured_bytes_total", "bytes", os.path.getsize(capture.output_file))
+    if capture.writer is not None:
+        metrics.count("traffic_captured_raw_bytes_total", "raw_bytes", capture.writer.raw_bytes)
+    if capture.drops:
+        metrics.count("traffic_capture_drops_total", "drops", capture.drops)
 
-    return True
+    sidecar = {"urls": urls, "start": start, "end": end, "latency": round(end - start, 3)}
+    if monitor is not None:
+        sidecar["pages"] = monitor.pages
+        sidecar["quiescence"] = monitor.settings()
+    if capture.profile.name != "full":
+        sidecar["profile"] = capture.profile.as_dict()
+    with phase("sidecar"):
+        # 抓包结束后再解析，查询不会出现在本次采集中
+        sidecar["dns"] = resolve_hosts(urls, spider.hostnames if spider is not None else ())
+        if spider is not None and spider.requests:
+            sidecar["requests"] = spider.requests
+        capture.write_sidecar(sidecar)
+    if spider is not None:
+        capture_filter.learn(spider.hostnames)  # 主机名刚在 resolve_hosts 中解析过，命中缓存
+    return capture.output_file
 
 
-def main(urls, org, index, duration=30):
+def main(urls, org, index, duration=30, interface=None):
+    """任务入口，成功时返回输出文件路径，失败时返回 False"""
     logger.info(f"任务开始: {index}_{org}，URL 数量: {len(urls)}")
-    result = run_task(urls, org, index, duration)
+    task = get_metrics().start_task(f"{index}_{org}", mode="local", urls=len(urls))
+    result = False
+    try:
+        result = run_task(urls, org, index, duration, interface)
+    finally:
+        task.finish("ok" if result else "failed")
     logger.info(f"任务 {'成功' if result else '失败'}: {index}_{org}")
+    return result
+
+
+def run_session(urls, names, index, interface=None):
+    """会话模式：一个抓包覆盖 urls 中的全部 URL，输出带每个 URL 标记块的 pcapng"""
+    if not urls:
+        logger.error("URL 列表为空")
+        return False
+
+    capture = TrafficCapture(interface)
+    ts = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    capture.output_file = os.path.join(
+        capture.output_dir, compressed_name(f"{index}_session-{len(urls)}_{ts}.pcapng", capture.compression))
+    capture.writer = CompressedWriter(capture.output_file, capture.compression) if capture.compression else None
+    # 会话跨越多个站点，只能使用排除模式的过滤器
+    session = SessionCapture(capture.interface, capture.writer or capture.output_file,
+                             CaptureFilter(urls, mode="exclude").build("tcp or udp"), len(urls))
+    monitor = create_monitor(capture.interface)
+    with phase("capture_start"):
+        started = session.start()
+    if not started:
+        if capture.writer is not None:
+            capture.writer.close()
+        return False
+
+    start = time.time()
+    hostnames, requests = set(), []
+    try:
+        hostnames, requests = crawl(session, urls, names, index, monitor)
+    finally:
+        end = time.time()
+        with phase("capture_stop"):
+            index_data = session.stop()
+            if capture.writer is not None:
+                capture.writer.close()
+
+    metrics = get_metrics()
+    metrics.count("traffic_captured_bytes_total", "bytes", os.path.getsize(capture.output_file))
+    if session.drops:
+        metrics.count("traffic_capture_drops_total", "drops", session.drops)
+
+    sidecar = {"urls": urls, "names": names, "start": start, "end": end, "latency": round(end - start, 3),
+               "session": True, **index_data}
+    if monitor is not None:
+        sidecar["pages"] = monitor.pages
+        sidecar["quiescence"] = monitor.settings()
+    if session.profile.name != "full":
+        sidecar["profile"] = session.profile.as_dict()
+    with phase("sidecar"):
+        sidecar["dns"] = resolve_hosts(urls, hostnames)
+        if requests:
+            sidecar["requests"] = requests
+        capture.write_sidecar(sidecar)
+    return capture.output_file
+
+
+def main_session(urls, names, index, interface=None):
+    """会话模式入口，成功时返回输出文件路径，失败时返回 False"""
+    logger.info(f"会话开始: {index}，URL 数量: {len(urls)}")
+    task = get_metrics().start_task(f"{index}_session", mode="local-session", urls=len(urls))
+    result = False
+    try:
+        result = run_session(urls, names, index, interface)
+    finally:
+        task.finish("ok" if result else "failed")
+    logger.info(f"会话 {'成功' if result else '失败'}: {index}")
+    return result
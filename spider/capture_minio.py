@@ -1,38 +1,166 @@
 import datetime
-import io
-import socket
+import json
+import queue
 import subprocess
+import tempfile
 import threading
+import time
 
 import boto3
-import psutil
 
 from config.config import config
 from config.logger import logger
-from spider.spider import SequentialSpider
+from spider.afpacket import AfPacketCapture
+from spider.capture_filter import CaptureFilter
+from spider.metrics import get_metrics, phase, tshark_drops
+from spider.profiles import load_profile, rewrite_stream
+from spider.quiescence import create_monitor
+from spider.resolver import get_resolver, hostname_of, resolve_hosts
+from spider.session import SessionCapture, crawl
+from spider.spider import create_spider
+from spider.supervisor import get_supervisor
+from utils.compress import StreamCompressor, capture_compression, compressed_name, sidecar_name
+from utils.pcap import PcapWriter
 
+# 单个任务的抓包进程最长运行时间（秒），超时由监督器结束
+TASK_DEADLINE = config.getint("supervisor", "task_deadline", fallback=300)
 
-def kill_process_and_children(parent_pid):
-    """确保杀掉 tshark 及其子进程"""
-    try:
-        parent = psutil.Process(parent_pid)
-        children = parent.children(recursive=True)
-        for child in children:
-            child.terminate()
-        gone, still_alive = psutil.wait_procs(children, timeout=2)
-        for child in still_alive:
-            child.kill()
-        parent.terminate()
-        parent.wait(timeout=2)  # 等待父进程结束
-    except psutil.NoSuchProcess:
-        pass
-    except psutil.TimeoutExpired:
-        parent.kill()  # 如果超时未结束，强制杀掉
+
+class MultipartUploader:
+    """
+    边采集边上传：数据按 part_size 切片后由后台线程写入 S3 分片上传。
+    待上传分片数不超过 max_pending，内存占用有上限；不足一个分片的
+    小文件在结束时直接 put_object。指定 compression 时先流式压缩再切片。
+    """
+
+    def __init__(self, s3_client, bucket, key,
+                 part_size=config.getint("minio", "part_size_mb", fallback=8) * 1024 * 1024,
+                 max_pending=config.getint("minio", "max_pending_parts", fallback=2),
+                 compression=None):
+        if part_size < 5 * 1024 * 1024:
+            raise ValueError("S3 分片大小不能小于 5MB")
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.size = 0  # 写入的原始字节数
+        self.compressor = StreamCompressor(compression) if compression else None
+        self.upload_id = None
+        self.parts = []
+        self.next_part = 1
+        self.uploaded = 0  # 已上传的字节数和耗时，用于统计上传吞吐
+        self.upload_seconds = 0.0
+        self.error = None
+        self.dropped = 0  # 出错后丢弃的字节数
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.upload_thread = None
+
+    def _upload_parts(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            part_number, body = item
+            if self.error is not None:
+                continue  # 已失败，丢弃剩余分片
+            try:
+                started = time.perf_counter()
+                response = self.s3_client.upload_part(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=body,
+                )
+                self.upload_seconds += time.perf_counter() - started
+                self.uploaded += len(body)
+                self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+            except Exception as e:
+                logger.error(f"上传分片 {part_number} 失败: {e}")
+                self.error = e
+
+    def _submit(self, body):
+        if self.upload_id is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+            self.upload_id = response["UploadId"]
+            self.upload_thread = threading.Thread(target=self._upload_parts, daemon=True)
+            self.upload_thread.start()
+            logger.info(f"开始分片上传 {self.key}")
+        self.pending.put((self.next_part, body))  # 队列满时阻塞，形成背压
+        self.next_part += 1
+
+    def _join_upload_thread(self):
+        if self.upload_thread is not None:
+            self.pending.put(None)
+            self.upload_thread.join()
+            self.upload_thread = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.error is not None:
+            # 上传已失败：继续读取抓包输出（避免抓包进程阻塞），但不再缓存
+            self.dropped += len(data)
+            return
+        self.buffer += self.compressor.compress(data) if self.compressor else data
+        self._cut_parts()
+
+    def _cut_parts(self):
+        while len(self.buffer) >= self.part_size and self.error is None:
+            try:
+                self._submit(bytes(self.buffer[:self.part_size]))
+            except Exception as e:
+                logger.error(f"提交分片 {self.next_part} 失败: {e}")
+                self.error = e
+                return
+            del self.buffer[:self.part_size]
+
+    def abort(self):
+        if self.upload_id is not None:
+            self._join_upload_thread()
+            try:
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception as e:
+                logger.warning(f"取消分片上传 {self.key} 失败: {e}")
+            self.upload_id = None
+        self.buffer = bytearray()
+
+    def complete(self):
+        """上传剩余数据并完成上传，返回是否成功；采集过程中出错或丢弃过数据时返回 False"""
+        if self.size == 0:
+            logger.warning("捕获数据为空")
+            return False
+        if self.error is not None:
+            logger.error(f"上传 {self.key} 失败（丢弃 {self.dropped} 字节）: {self.error}")
+            self.abort()
+            return False
+        if self.compressor is not None:
+            self.buffer += self.compressor.flush()
+            self.compressor = None
+            self._cut_parts()
+        if self.upload_id is None:
+            started = time.perf_counter()
+            self.s3_client.put_object(Body=bytes(self.buffer), Bucket=self.bucket, Key=self.key)
+            self.upload_seconds += time.perf_counter() - started
+            self.uploaded += len(self.buffer)
+            self.buffer = bytearray()
+            return True
+
+        if self.buffer:
+            self._submit(bytes(self.buffer))  # 最后一个分片允许小于 5MB
+            self.buffer = bytearray()
+        self._join_upload_thread()
+        if self.error is not None:
+            self.abort()
+            return False
+        self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": sorted(self.parts, key=lambda p: p["PartNumber"])},
+        )
+        self.upload_id = None
+        return True
 
 
 class TrafficCapture:
-    def __init__(self, interface="WLAN"):
-        self.interface = config["spider"]["interface"]
+    def __init__(self, interface=None):
+        self.interface = interface or config["spider"]["interface"]
         self.s3_client = boto3.client(
             "s3",
             endpoint_url=config["minio"]["endpoint_url"],  # MinIO 地址
@@ -43,45 +171,57 @@ class TrafficCapture:
         )
         self.bucket = config["minio"]["bucket_name"]
         self.tshark_process = None
-        self.pcap_data = io.BytesIO()
+        self.backend = config.get("spider", "capture_backend", fallback="tshark")
+        self.engine = None
+        self.uploader = None
         self.capture_thread = None
-        self.stop_event = threading.Event()
-        self.lock = threading.Lock()  # 添加线程锁保护共享资源
+        self.tshark_stderr = None
+        self.drops = 0  # 抓包引擎报告的丢包数
+        self.compression = capture_compression()
+        self.profile = load_profile()
+        self.truncator = None
 
     def _get_target_ip(self, url):
         """解析 URL 获取目标 IP 地址"""
-        try:
-            hostname = url.split("://")[-1].split("/")[0]
-            return socket.gethostbyname(hostname)
-        except Exception as e:
-            logger.error(f"解析 URL {url} 失败: {e}")
+        ips = get_resolver().resolve(hostname_of(url))
+        if not ips:
+            logger.error(f"解析 URL {url} 失败")
             return None
+        return ips[0]
 
     def _capture_output(self):
-        """持续读取 tshark 输出到 pcap_data"""
+        """持续读取 tshark 输出，按分片流式上传，直到 tshark 退出（EOF）；按流截断时逐条改写记录"""
         try:
-            while not self.stop_event.is_set():
-                data = self.tshark_process.stdout.read(4096)
-                if not data:
-                    break
-                with self.lock:  # 使用锁保护 pcap_data 的写入
-                    self.pcap_data.write(data)
-            # 捕获结束后，确保读取所有剩余数据
+            if self.truncator is not None:
+                rewrite_stream(self.tshark_process.stdout,
+                               lambda reader: PcapWriter(self.uploader, reader.linktype,
+                                                         reader.snaplen, reader.nanosecond),
+                               self.truncator)
+                return
             while True:
-                data = self.tshark_process.stdout.read(4096)
+                data = self.tshark_process.stdout.read(65536)
                 if not data:
                     break
-                with self.lock:
-                    self.pcap_data.write(data)
+                self.uploader.write(data)
         except Exception as e:
             logger.error(f"读取 tshark 输出失败: {e}")
 
-    def start_capture(self, target_ip):
+    def start_capture(self, target_ip, output_name, capture_filter=None):
         """使用 tshark 启动流量捕获"""
         if not target_ip:
             logger.error("无目标 IP，无法启动捕获")
             return False
 
+        if self.backend == "afpacket":
+            try:
+                self.uploader = MultipartUploader(self.s3_client, self.bucket, output_name, compression=self.compression)
+                self.engine = AfPacketCapture(self.interface, self.uploader, capture_filter,
+                                              **self.profile.afpacket_options())
+                return self.engine.start()
+            except Exception as e:
+                logger.error(f"启动 AF_PACKET 抓包失败: {e}")
+                return False
+
         try:
             logger.info(f"开始捕获流量，目标 IP: {target_ip}")
             command = [
@@ -93,12 +233,19 @@ class TrafficCapture:
                 "-F",
                 "pcap",  # 明确指定 PCAP 格式
             ]
+            if capture_filter:
+                command += ["-f", capture_filter]
+            command += self.profile.tshark_options()
+            self.truncator = self.profile.truncator()
 
-            self.tshark_process = subprocess.Popen(
-                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0  # 无缓冲
+            # stderr 写入临时文件，退出时从汇总信息中读取丢包数
+            self.tshark_stderr = tempfile.TemporaryFile()
+            self.tshark_process = get_supervisor().spawn(
+                command, "tshark", deadline=TASK_DEADLINE,
+                stdout=subprocess.PIPE, stderr=self.tshark_stderr, bufsize=0  # 无缓冲
             )
 
-            self.stop_event.clear()  # 重置停止事件
+            self.uploader = MultipartUploader(self.s3_client, self.bucket, output_name, compression=self.compression)
             self.capture_thread = threading.Thread(
                 target=self._capture_output, daemon=True
             )
@@ -112,93 +259,206 @@ class TrafficCapture:
 
     def stop_capture_and_upload(self, output_name):
         """停止捕获并上传数据"""
+        if self.engine is not None:
+            self.drops = self.engine.stop().get("drops", 0)
+            self.engine = None
+            return self._finish_upload(output_name)
         if not self.tshark_process:
             logger.warning("未启动 tshark 进程，无需停止")
             return False
 
         logger.info("准备停止 tshark 捕获")
-        self.stop_event.set()  # 设置停止标志
 
-        # 等待捕获线程完成，确保所有数据被读取
+        # 先终止 tshark，它会刷新缓冲并关闭 stdout，捕获线程随之读到 EOF；超时后整组强杀
+        get_supervisor().terminate(self.tshark_process, timeout=3)
+
+        # 等待捕获线程读完剩余数据
         if self.capture_thread:
             self.capture_thread.join(timeout=5)
             if self.capture_thread.is_alive():
                 logger.warning("捕获线程未及时结束")
 
-        # 优雅地终止 tshark 进程
+        # 确保关闭管道
+        self.tshark_process.stdout.close()
+        self.tshark_process = None
+        self.drops = self._read_drops()
+        return self._finish_upload(output_name)
+
+    def _read_drops(self):
+        if self.tshark_stderr is None:
+            return 0
         try:
-            self.tshark_process.terminate()  # 尝试正常终止
-            self.tshark_process.wait(timeout=3)  # 等待进程结束
-        except subprocess.TimeoutExpired:
-            logger.warning("tshark 未正常终止，强制杀掉")
-            kill_process_and_children(self.tshark_process.pid)
+            self.tshark_stderr.seek(0)
+            return tshark_drops(self.tshark_stderr.read().decode(errors="replace"))
         finally:
-            # 确保关闭管道
-            self.tshark_process.stdout.close()
-            self.tshark_process.stderr.close()
-            self.tshark_process = None
+            self.tshark_stderr.close()
+            self.tshark_stderr = None
 
-        # 上传捕获的数据
+    def write_sidecar(self, output_name, data):
+        """上传与 pcap 同名的 .json，记录本次采样的元数据"""
+        key = sidecar_name(output_name)
         try:
-            with self.lock:  # 确保线程安全地读取 pcap_data
-                pcap_content = self.pcap_data.getvalue()
-                if not pcap_content:
-                    logger.warning("捕获数据为空")
-                    return False
+            self.s3_client.put_object(Bucket=self.bucket, Key=key, ContentType="application/json",
+                                      Body=json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        except Exception as e:
+            logger.warning(f"上传 {key} 失败: {e}")
 
-                logger.info(f"开始上传 {output_name} 到 MinIO")
-                self.s3_client.put_object(
-                    Body=self.pcap_data.getvalue(), Bucket=self.bucket, Key=output_name
-                )
-                logger.info(f"上传 {output_name} 到 MinIO 成功")
-                return True
+    def _finish_upload(self, output_name):
+        # 大部分分片已在采集过程中上传，这里只需提交剩余数据
+        metrics = get_metrics()
+        try:
+            with phase("upload_complete"):
+                if not self.uploader.complete():
+                    return False
+            logger.info(f"上传 {output_name} 到 MinIO 成功（{self.uploader.size} 字节，上传 {self.uploader.uploaded} 字节）")
+            metrics.count("traffic_captured_bytes_total", "bytes", self.uploader.uploaded)
+            if self.compression:
+                metrics.count("traffic_captured_raw_bytes_total", "raw_bytes", self.uploader.size)
+            return True
         except Exception as e:
             logger.error(f"上传失败: {e}")
+            self.uploader.abort()
             return False
         finally:
-            with self.lock:
-                self.pcap_data.seek(0)
-                self.pcap_data.truncate()
+            # 分片在后台线程上传，耗时在这里汇总到当前任务
+            metrics.count("traffic_upload_bytes_total", "upload_bytes", self.uploader.uploaded)
+            metrics.count("traffic_upload_seconds_total", "upload_seconds", round(self.uploader.upload_seconds, 3))
+            if self.drops:
+                metrics.count("traffic_capture_drops_total", "drops", self.drops)
+            self.uploader = None
             self.capture_thread = None
 
 
-def run_task(urls, organization, index):
+def run_task(urls, organization, index, interface=None):
     """执行爬取任务并捕获流量"""
     if not urls:
         logger.error("没有提供 URL")
         return False
 
-    capture = TrafficCapture()
+    capture = TrafficCapture(interface)
     target_ip = capture._get_target_ip(urls[0])
     if not target_ip:
         logger.error("无法解析目标 IP")
         return False
 
-    output_name = f"{index}_{organization}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pcap"
+    output_name = compressed_name(f"{index}_{organization}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pcap",
+                                  capture.compression)
 
-    if not capture.start_capture(target_ip):
+    capture_filter = CaptureFilter(urls)
+    monitor = create_monitor(capture.interface)
+    with phase("capture_start"):
+        started = capture.start_capture(target_ip, output_name, capture_filter.build())
+    if not started:
         logger.error("启动流量捕获失败")
         return False
 
+    start = time.time()
+    spider = None
     try:
         logger.info(f"开始爬取 URLs: {urls}")
-        spider = SequentialSpider(urls)
-        spider.scrape()
+        spider = create_spider(urls, stop_condition=monitor)
+        with phase("spider"):
+            spider.scrape()
         logger.info("爬虫任务完成")
     except Exception as e:
         logger.error(f"爬虫出错: {e}")
     finally:
-        capture.stop_capture_and_upload(output_name)
+        end = time.time()
+        with phase("capture_stop"):
+            uploaded = capture.stop_capture_and_upload(output_name)
 
-    return True
+    if not uploaded:
+        return False
+    sidecar = {"urls": urls, "start": start, "end": end, "latency": round(end - start, 3)}
+    if monitor is not None:
+        sidecar["pages"] = monitor.pages
+        sidecar["quiescence"] = monitor.settings()
+    if capture.profile.name != "full":
+        sidecar["profile"] = capture.profile.as_dict()
+    with phase("sidecar"):
+        # 抓包结束后再解析，查询不会出现在本次采集中
+        sidecar["dns"] = resolve_hosts(urls, spider.hostnames if spider is not None else ())
+        if spider is not None and spider.requests:
+            sidecar["requests"] = spider.requests
+        capture.write_sidecar(output_name, sidecar)
+    if spider is not None:
+        capture_filter.learn(spider.hostnames)  # 主机名刚在 resolve_hosts 中解析过，命中缓存
+    return output_name
 
 
-def main(urls, organization, index):
-    """任务入口"""
+def main(urls, organization, index, interface=None):
+    """任务入口，成功时返回上传的对象名，失败时返回 False"""
     logger.info(f"开始任务 {index}_{organization}, URL 数量: {len(urls)}")
-    success = run_task(urls, organization, index)
+    task = get_metrics().start_task(f"{index}_{organization}", mode="minio", urls=len(urls))
+    success = False
+    try:
+        success = run_task(urls, organization, index, interface)
+    finally:
+        task.finish("ok" if success else "failed")
     if success:
         logger.info(f"任务 {index}_{organization} 成功")
     else:
         logger.error(f"任务 {index}_{organization} 失败")
     logger.info(f"任务 {index}_{organization} 结束")
+    return success
+
+
+def run_session(urls, names, index, interface=None):
+    """会话模式：一个抓包覆盖 urls 中的全部 URL，边采集边上传带每个 URL 标记块的 pcapng"""
+    if not urls:
+        logger.error("没有提供 URL")
+        return False
+
+    capture = TrafficCapture(interface)
+    output_name = compressed_name(
+        f"{index}_session-{len(urls)}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pcapng", capture.compression)
+    capture.uploader = MultipartUploader(capture.s3_client, capture.bucket, output_name, compression=capture.compression)
+    # 会话跨越多个站点，只能使用排除模式的过滤器
+    session = SessionCapture(capture.interface, capture.uploader, CaptureFilter(urls, mode="exclude").build(), len(urls))
+    monitor = create_monitor(capture.interface)
+    with phase("capture_start"):
+        started = session.start()
+    if not started:
+        logger.error("启动流量捕获失败")
+        capture.uploader.abort()
+        return False
+
+    start = time.time()
+    hostnames, requests = set(), []
+    try:
+        hostnames, requests = crawl(session, urls, names, index, monitor)
+    finally:
+        end = time.time()
+        with phase("capture_stop"):
+            index_data = session.stop()
+            capture.drops = session.drops
+            uploaded = capture._finish_upload(output_name)
+
+    if not uploaded:
+        return False
+    sidecar = {"urls": urls, "names": names, "start": start, "end": end, "latency": round(end - start, 3),
+               "session": True, **index_data}
+    if monitor is not None:
+        sidecar["pages"] = monitor.pages
+        sidecar["quiescence"] = monitor.settings()
+    if session.profile.name != "full":
+        sidecar["profile"] = session.profile.as_dict()
+    with phase("sidecar"):
+        sidecar["dns"] = resolve_hosts(urls, hostnames)
+        if requests:
+            sidecar["requests"] = requests
+        capture.write_sidecar(output_name, sidecar)
+    return output_name
+
+
+def main_session(urls, names, index, interface=None):
+    """会话模式入口，成功时返回上传的对象名，失败时返回 False"""
+    logger.info(f"开始会话 {index}, URL 数量: {len(urls)}")
+    task = get_metrics().start_task(f"{index}_session", mode="minio-session", urls=len(urls))
+    success = False
+    try:
+        success = run_session(urls, names, index, interface)
+    finally:
+        task.finish("ok" if success else "failed")
+    logger.info(f"会话 {index} {'成功' if success else '失败'}")
+    return success
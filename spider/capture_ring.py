@@ -0,0 +1,208 @@
+import atexit
+import glob
+import json
+import os
+import re
+import signal
+import subprocess
+import time
+from datetime import datetime
+
+from config.config import config
+from config.logger import logger
+from spider.capture_filter import CaptureFilter
+from spider.profiles import load_profile
+from spider.spider import create_spider
+from spider.supervisor import get_supervisor
+from utils.compress import CompressedWriter, capture_compression, compressed_name
+from utils.pcap import PcapReader, PcapWriter
+
+# dumpcap 环形缓冲文件名: ring_00001_20250110125021.pcap
+RING_FILE_PATTERN = re.compile(r"_(\d{5,})_(\d{14})\.pcap$")
+
+
+class RingCapture:
+    """
+    每个网卡一个常驻的 dumpcap 环形缓冲采集进程。
+
+    任务只记录开始/结束时间，不再为每个 URL 启动抓包进程；
+    之后由 split_pending 按时间窗口从环形缓冲中切出每个任务的 pcap。
+    """
+
+    def __init__(self, interface=None,
+                 ring_dir=config.get("ring", "ring_dir", fallback=os.path.join(config["spider"]["output_dir"], "ring")),
+                 filesize_kb=config.getint("ring", "filesize_kb", fallback=102400),
+                 files=config.getint("ring", "files", fallback=20)):
+        self.interface = interface or config["spider"]["interface"]
+        self.ring_dir = ring_dir
+        self.filesize_kb = filesize_kb
+        self.files = files
+        self.process = None
+        os.makedirs(self.ring_dir, exist_ok=True)
+        self.index_path = os.path.join(self.ring_dir, "index.jsonl")
+        self.done_path = os.path.join(self.ring_dir, "index.done")
+
+    def start(self, capture_filter="tcp or udp"):
+        cmd = [
+            "dumpcap", "-q", "-i", self.interface,
+            "-P",  # 经典 pcap 格式，便于切分
+            "-b", f"filesize:{self.filesize_kb}",
+            "-b", f"files:{self.files}",
+            "-w", os.path.join(self.ring_dir, "ring.pcap"),
+            "-f", capture_filter,
+        ] + load_profile().tshark_options()
+        logger.info(f"启动 dumpcap 环形缓冲采集: {' '.join(cmd)}")
+        # 常驻进程，不设截止时间；由监督器在独立进程组中启动
+        self.process = get_supervisor().spawn(cmd, "dumpcap", stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if not self.is_running():
+            return
+        logger.info("停止 dumpcap 环形缓冲采集")
+        get_supervisor().terminate(self.process, signal.SIGINT, timeout=10)
+        self.process = None
+
+    def record(self, name, urls, start, end):
+        """把任务边界追加到索引"""
+        entry = {"name": name, "urls": urls, "start": start, "end": end}
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _load_entries(self):
+        if not os.path.exists(self.index_path):
+            return []
+        done = set()
+        if os.path.exists(self.done_path):
+            with open(self.done_path, encoding="utf-8") as f:
+                done = {line.strip() for line in f if line.strip()}
+        with open(self.index_path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return [e for e in entries if e["name"] not in done]
+
+    def ring_files(self):
+        """按序号排序的环形缓冲文件及其起始时间"""
+        files = []
+        for path in glob.glob(os.path.join(self.ring_dir, "ring_*.pcap")):
+            match = RING_FILE_PATTERN.search(path)
+            if match:
+                start = datetime.strptime(match.group(2), "%Y%m%d%H%M%S").timestamp()
+                files.append((int(match.group(1)), start, path))
+        return [(start, path) for _, start, path in sorted(files)]
+
+    def split_pending(self, output_dir, margin=config.getfloat("ring", "split_margin", fallback=0.5)):
+        """把尚未切分的任务从环形缓冲中切出，返回生成的文件列表"""
+        # dumpcap 周期性刷盘，刚结束的任务留到下一轮再切分
+        settle = 2 if self.is_running() else 0
+        entries = sorted((e for e in self._load_entries() if e["end"] + margin + settle < time.time()),
+                         key=lambda e: e["start"])
+        if not entries:
+            return []
+        os.makedirs(output_dir, exist_ok=True)
+        first = entries[0]["start"] - margin
+        last = entries[-1]["end"] + margin
+
+        ring_files = self.ring_files()
+        compression = capture_compression()
+        profile = load_profile()
+        truncators = {}  # 按流截断时每个任务单独计算每个流的载荷
+        writers = {}
+        sinks = []  # 开启压缩时每个输出文件的压缩流
+        outputs = []
+        try:
+            for i, (file_start, path) in enumerate(ring_files):
+                # 文件名时间精确到秒，相邻文件的起始时间即本文件的结束时间
+                file_end = ring_files[i + 1][0] + 1 if i + 1 < len(ring_files) else float("inf")
+                if file_end < first or file_start - 1 > last:
+                    continue
+                try:
+                    reader = PcapReader(path)
+                except FileNotFoundError:
+                    # 列出文件后 dumpcap 已轮转删除了它，跳过并记录受影响的任务
+                    lost = [entry["name"] for entry in entries
+                            if entry["start"] - margin <= file_end and entry["end"] + margin >= file_start - 1]
+                    logger.warning(f"环形缓冲文件 {os.path.basename(path)} 已被覆盖，"
+                                   f"{len(lost)} 个任务缺少数据: {', '.join(lost)}")
+                    continue
+                with reader:
+                    for record in reader:
+                        ts = reader.timestamp(record)
+                        for entry in entries:
+                            if entry["start"] - margin > ts:
+                                break
+                            if ts > entry["end"] + margin:
+                                continue
+                            writer = writers.get(entry["name"])
+                            if writer is None:
+                                out = compressed_name(os.path.join(output_dir, entry["name"]), compression)
+                                sink = CompressedWriter(out, compression) if compression else out
+                                if compression:
+                                    sinks.append(sink)
+                                writer = PcapWriter(sink, reader.linktype, reader.snaplen, reader.nanosecond)
+                                writers[entry["name"]] = writer
+                                truncators[entry["name"]] = profile.truncator()
+                                outputs.append(out)
+                            truncator = truncators[entry["name"]]
+                            writer.write(truncator(record) if truncator else record)
+        finally:
+            for writer in writers.values():
+                writer.close()
+            for sink in sinks:
+                sink.close()
+
+        with open(self.done_path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(entry["name"] + "\n")
+        missing = len(entries) - len(writers)
+        if missing:
+            logger.warning(f"{missing} 个任务在环形缓冲中没有数据（可能已被覆盖）")
+        logger.info(f"从环形缓冲切分出 {len(outputs)} 个 pcap")
+        return outputs
+
+
+def run_task(urls, org, index, ring):
+    if not urls:
+        logger.error("URL 列表为空")
+        return False
+
+    name = f"{index}_{org}_{datetime.now().strftime('%Y%m%d%H%M%S')}.pcap"
+    start = time.time()
+    try:
+        create_spider(urls).scrape()
+        logger.info("爬虫任务完成")
+    except Exception as e:
+        logger.error(f"爬虫异常: {e}")
+    finally:
+        ring.record(name, urls, start, time.time())
+    return name
+
+
+_ring = None
+_tasks = 0
+
+
+def _shutdown():
+    _ring.stop()
+    _ring.split_pending(config["spider"]["output_dir"])
+
+
+def main(urls, org, index, interface=None):
+    """与 capture_local.main 相同的入口，抓包进程在首次调用时启动并常驻；返回待切分的文件名"""
+    global _ring, _tasks
+    if _ring is None:
+        _ring = RingCapture(interface)
+        atexit.register(_shutdown)
+    if not _ring.is_running():
+        # 环形缓冲跨越多个站点，只能使用排除模式的过滤器
+        _ring.start(CaptureFilter(urls, mode="exclude").build("tcp or udp"))
+
+    logger.info(f"任务开始: {index}_{org}，URL 数量: {len(urls)}")
+    result = run_task(urls, org, index, _ring)
+    logger.info(f"任务 {'成功' if result else '失败'}: {index}_{org}")
+
+    _tasks += 1
+    if _tasks % config.getint("ring", "split_every", fallback=50) == 0:
+        _ring.split_pending(config["spider"]["output_dir"])
+    return result
@@ -0,0 +1,358 @@
+import argparse
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from config.config import config
+from config.logger import logger
+from spider.resolver import PREFETCH_DEPTH, prefetch_urls
+
+# 协调对象所在前缀，client.py 的下载端会跳过该前缀
+COORD_PREFIX = "_coord/"
+
+# 条件写入失败：MinIO/S3 返回 412，并发写入同一对象时 S3 可能返回 409
+CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict", "412", "409")
+
+
+def _is_conflict(error):
+    return error.response.get("Error", {}).get("Code") in CONFLICT_CODES
+
+
+def create_s3_client():
+    return boto3.client(
+        "s3",
+        endpoint_url=config["minio"]["endpoint_url"],
+        aws_access_key_id=config["minio"]["access_key"],
+        aws_secret_access_key=config["minio"]["secret_key"],
+        region_name="us-east-1",
+        verify=False,
+    )
+
+
+class Shard:
+    """一个被本节点持有的分片租约"""
+
+    def __init__(self, number, start, end, position, etag):
+        self.number = number
+        self.start = start  # URL 下标范围 [start, end)
+        self.end = end
+        self.position = position  # 已完成的 (URL × 重复) 任务数
+        self.etag = etag
+        self.failed = []  # 重试后仍失败的任务位置
+        self.lost = False
+
+    def __repr__(self):
+        return f"Shard({self.number} [{self.start}, {self.end}) @ {self.position})"
+
+
+class ShardCoordinator:
+    """
+    多节点通过同一个存储桶协调采集任务，不需要额外的服务。
+
+    URL 列表按 shard_size 切成分片，每个分片对应 _coord/{campaign}/shards/ 下的一个
+    租约对象。节点用 If-None-Match: * 创建租约领取新分片，用 If-Match: <etag>
+    续约和记录进度；租约过期（节点宕机）后其他节点可以用 If-Match 接管，
+    并从记录的进度继续。所有写入都是条件写入，同一时刻一个分片只有一个持有者。
+    """
+
+    def __init__(self, s3_client, bucket, campaign, node=None, lease_ttl=None, heartbeat_interval=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.campaign = campaign
+        self.node = node or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_ttl = lease_ttl or config.getint("coordinator", "lease_ttl", fallback=120)
+        self.heartbeat_interval = heartbeat_interval or config.getint("coordinator", "heartbeat_interval", fallback=30)
+        self.task_retries = config.getint("coordinator", "task_retries", fallback=1)
+        self.prefix = f"{COORD_PREFIX}{campaign}/"
+        self.manifest = None
+        self.shards = {}  # 本节点持有的分片
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    @classmethod
+    def from_config(cls, campaign, **kwargs):
+        return cls(create_s3_client(), config["minio"]["bucket_name"], campaign, **kwargs)
+
+    def _get(self, key):
+        """返回 (内容, etag)，对象不存在时返回 (None, None)"""
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return None, None
+            raise
+        return json.loads(response["Body"].read()), response["ETag"]
+
+    def _put(self, key, body, **condition):
+        """条件写入，成功返回新的 etag，条件不满足返回 None"""
+        try:
+            response = self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(body).encode(),
+                                                 ContentType="application/json", **condition)
+        except ClientError as e:
+            if _is_conflict(e):
+                return None
+            raise
+        return response["ETag"]
+
+    def _shard_key(self, number):
+        return f"{self.prefix}shards/{number:06d}.json"
+
+    def _list(self, prefix):
+        kwargs = {"Bucket": self.bucket, "Prefix": prefix}
+        while True:
+            response = self.s3_client.list_objects_v2(**kwargs)
+            for obj in response.get("Contents", []):
+                yield obj["Key"]
+            if not response.get("IsTruncated"):
+                return
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def init_campaign(self, urls, shard_size=None, repeat=1):
+        """
+        第一个节点写入任务清单，其他节点读取并校验 URL 列表一致，
+        保证所有节点对分片的划分相同。
+        """
+        shard_size = shard_size or config.getint("coordinator", "shard_size", fallback=10)
+        digest = hashlib.sha1("\n".join(urls).encode()).hexdigest()
+        manifest = {"total": len(urls), "shard_size": shard_size, "repeat": repeat, "digest": digest}
+        key = f"{self.prefix}manifest.json"
+        if self._put(key, manifest, IfNoneMatch="*") is None:
+            manifest, _ = self._get(key)
+            if manifest["digest"] != digest:
+                raise ValueError(f"任务 {self.campaign} 已存在且 URL 列表不同")
+        self.manifest = manifest
+        return manifest
+
+    @property
+    def shard_count(self):
+        return -(-self.manifest["total"] // self.manifest["shard_size"])
+
+    def _shard_range(self, number):
+        size = self.manifest["shard_size"]
+        return number * size, min((number + 1) * size, self.manifest["total"])
+
+    def _lease_body(self, shard, done=False):
+        return {"node": self.node, "expires": time.time() + self.lease_ttl,
+                "position": shard.position, "done": done, "failed": shard.failed}
+
+    def claim(self):
+        """领取一个分片：优先领取无人领取的分片，其次接管租约已过期的分片"""
+        count = self.shard_count
+        existing = {key for key in self._list(f"{self.prefix}shards/")}
+        # 不同节点从不同位置开始扫描，减少争用
+        offset = zlib.crc32(self.node.encode()) % count
+        order = [(offset + i) % count for i in range(count)]
+
+        for number in order:
+            key = self._shard_key(number)
+            if key in existing:
+                continue
+            start, end = self._shard_range(number)
+            shard = Shard(number, start, end, 0, None)
+            shard.etag = self._put(key, self._lease_body(shard), IfNoneMatch="*")
+            if shard.etag is not None:
+                return self._hold(shard, "领取")
+
+        now = time.time()
+        for number in order:
+            key = self._shard_key(number)
+            if key not in existing:
+                continue
+            lease, etag = self._get(key)
+            if lease is None or lease["done"] or lease["expires"] > now:
+                continue
+            start, end = self._shard_range(number)
+            shard = Shard(number, start, end, lease["position"], None)
+            shard.failed = lease.get("failed", [])
+            shard.etag = self._put(key, self._lease_body(shard), IfMatch=etag)
+            if shard.etag is not None:
+                logger.info(f"接管节点 {lease['node']} 过期的分片 {number}")
+                return self._hold(shard, "接管")
+        return None
+
+    def _hold(self, shard, action):
+        with self.lock:
+            self.shards[shard.number] = shard
+        logger.info(f"节点 {self.node} {action}{shard}")
+        return shard
+
+    def _renew(self, shard, done=False):
+        """续约并记录进度；租约已被其他节点接管时标记为 lost"""
+        with self.lock:
+            if shard.lost:
+                return False
+            etag = self._put(self._shard_key(shard.number), self._lease_body(shard, done), IfMatch=shard.etag)
+            if etag is None:
+                shard.lost = True
+                self.shards.pop(shard.number, None)
+                logger.warning(f"分片 {shard.number} 的租约已被其他节点接管")
+                return False
+            shard.etag = etag
+            if done:
+                self.shards.pop(shard.number, None)
+            return True
+
+    def advance(self, shard, position, failed=False):
+        """记录进度，failed 表示刚完成的任务重试后仍失败"""
+        if failed:
+            shard.failed.append(position - 1)
+        shard.position = position
+        return self._renew(shard)
+
+    def finish(self, shard):
+        return self._renew(shard, done=True)
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(self.heartbeat_interval):
+            for shard in list(self.shards.values()):
+                try:
+                    self._renew(shard)
+                except Exception as e:
+                    logger.warning(f"分片 {shard.number} 续约失败: {e}")
+            try:
+                self.s3_client.put_object(
+                    Bucket=self.bucket, Key=f"{self.prefix}nodes/{self.node}.json",
+                    Body=json.dumps({"node": self.node, "time": time.time(),
+                                     "shards": sorted(self.shards)}).encode())
+            except Exception as e:
+                logger.warning(f"节点心跳失败: {e}")
+
+    def start(self):
+        self.stop_event.clear()
+        self.heartbeat_thread = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self.heartbeat_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+
+    def status(self):
+        """读取所有分片租约，统计完成、进行中、过期和未领取的分片数，以及失败的任务数"""
+        now = time.time()
+        counts = {"done": 0, "active": 0, "expired": 0, "unclaimed": self.shard_count, "failed_tasks": 0}
+        keys = list(self._list(f"{self.prefix}shards/"))
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            for lease, _ in executor.map(self._get, keys):
+                if lease is None:
+                    continue
+                counts["unclaimed"] -= 1
+                counts["failed_tasks"] += len(lease.get("failed", []))
+                if lease["done"]:
+                    counts["done"] += 1
+                elif lease["expires"] > now:
+                    counts["active"] += 1
+                else:
+                    counts["expired"] += 1
+        return counts
+
+
+def _run_task(task, url, name, index, retries):
+    """执行一个任务，异常或返回 False 时重试，全部失败时返回 False"""
+    for attempt in range(retries + 1):
+        try:
+            if task([url], name, index) is not False:
+                return True
+        except Exception as e:
+            logger.error(f"任务 {index}_{name} 异常: {e}")
+        if attempt < retries:
+            logger.warning(f"任务 {index}_{name} 失败，重试（{attempt + 1}/{retries}）")
+    return False
+
+
+def run_sharded(coordinator, urls, names, task, repeat=1, start=0, after=None, shard_size=None):
+    """
+    按分片执行任务，直到所有分片都完成。没有可领取的分片但其他节点仍持有未完成的分片时，
+    每 heartbeat_interval 秒检查一次，其他节点宕机后接管它们的分片。
+    task(urls, name, index) 与 capture_*.main 的签名相同，index 为 start + URL 下标；
+    重试后仍失败的任务记录在分片租约的 failed 中。
+    """
+    coordinator.init_campaign(urls, shard_size, repeat)
+    coordinator.start()
+    try:
+        while True:
+            shard = coordinator.claim()
+            if shard is None:
+                status = coordinator.status()
+                if not status["active"] and not status["expired"] and not status["unclaimed"]:
+                    break
+                logger.info(f"节点 {coordinator.node} 等待其他节点的分片: {status}")
+                time.sleep(coordinator.heartbeat_interval)
+                continue
+            total = (shard.end - shard.start) * repeat
+            for position in range(shard.position, total):
+                i = shard.start + position // repeat
+                prefetch_urls(urls[i + 1:i + 1 + PREFETCH_DEPTH])
+                ok = _run_task(task, urls[i], names[i], start + i, coordinator.task_retries)
+                if after is not None:
+                    after()
+                if not coordinator.advance(shard, position + 1, failed=not ok):
+                    break  # 分片已被接管，放弃剩余任务
+            else:
+                coordinator.finish(shard)
+    finally:
+        coordinator.stop()
+    logger.info(f"节点 {coordinator.node} 所有分片已完成: {coordinator.status()}")
+
+
+if __name__ == "__main__":
+    # 本地测试：python -m moto.server -p 9000 后启动多个进程
+    # python -m spider.coordinator run config/top_1000.txt --campaign test --endpoint http://127.0.0.1:9000 --dry-run 0.2
+    parser = argparse.ArgumentParser(description="通过对象存储协调多节点分片采集")
+    parser.add_argument("command", choices=["run", "status"])
+    parser.add_argument("urls", help="每行一个域名或 URL")
+    parser.add_argument("--campaign", required=True)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--shard-size", type=int)
+    parser.add_argument("--mode", choices=["local", "minio"], default="minio")
+    parser.add_argument("--endpoint", help="覆盖 [minio] endpoint_url，例如本地 S3 模拟服务")
+    parser.add_argument("--dry-run", type=float, metavar="SECONDS", help="不采集，每个任务只等待指定秒数")
+    args = parser.parse_args()
+
+    if args.endpoint:
+        config["minio"]["endpoint_url"] = args.endpoint
+    coordinator = ShardCoordinator.from_config(args.campaign)
+    if args.endpoint:
+        # 本地 S3 模拟服务启动时没有存储桶
+        try:
+            coordinator.s3_client.create_bucket(Bucket=coordinator.bucket)
+        except ClientError:
+            pass
+
+    with open(args.urls, encoding="utf-8") as f:
+        lines = [line.split("\t")[0].strip() for line in f if line.strip()]
+    urls = [line if "://" in line else "https://" + line for line in lines]
+    names = [line.split("://")[-1].replace("/", "_") for line in lines]
+
+    if args.command == "status":
+        coordinator.init_campaign(urls, args.shard_size, args.repeat)
+        print(coordinator.status())
+    else:
+        if args.dry_run is not None:
+            def main(urls, name, index):
+                time.sleep(args.dry_run)
+                return name
+        elif args.mode == "local":
+            from spider.capture_local import main
+        else:
+            from spider.capture_minio import main
+
+        begin = time.time()
+        completed = [0]
+
+        def count():
+            completed[0] += 1
+
+        run_sharded(coordinator, urls, names, main, args.repeat, after=count, shard_size=args.shard_size)
+        elapsed = time.time() - begin
+        print(f"{coordinator.node}: {completed[0]} tasks in {elapsed:.1f}s")
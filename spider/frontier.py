@@ -0,0 +1,185 @@
+import hashlib
+import math
+import posixpath
+import time
+from collections import deque
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
+
+from config.config import config
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# 不影响页面内容的跟踪参数，规范化时去掉
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "msclkid", "spm")
+
+
+def canonicalize(url):
+    """
+    规范化 URL，便于去重：协议和主机名小写、去掉默认端口和片段、
+    解析路径中的 . 和 ..、查询参数排序并去掉跟踪参数。非 http(s) URL 返回 None。
+    """
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS or not parts.hostname:
+            return None
+        host = parts.hostname.rstrip(".")
+        port = parts.port
+    except ValueError:
+        return None
+    netloc = f"[{host}]" if ":" in host else host
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc += f":{port}"
+    path = parts.path or "/"
+    if "." in path:
+        normalized = posixpath.normpath(path)
+        path = normalized + "/" if path.endswith("/") and normalized != "/" else normalized
+        path = "/" + path.lstrip("/")
+    # 按原样保留每个参数（?x 与 ?x= 不是同一个 URL，也不重新编码），只排序并去掉跟踪参数
+    pairs = [pair.partition("=") for pair in parts.query.split("&") if pair]
+    query = "&".join(key + separator + value for key, separator, value in sorted(pairs)
+                     if not unquote_plus(key).lower().startswith(TRACKING_PARAMS))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+class BloomFilter:
+    """
+    固定内存的去重集合：capacity 个元素时误判率约为 error_rate。
+    误判只会让少量未访问的 URL 被当作已访问跳过，不会重复访问。
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # 双重哈希：由一个 128 位摘要生成 k 个位置
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        """加入元素，之前不存在时返回 True"""
+        added = False
+        for position in self._positions(item):
+            byte, bit = divmod(position, 8)
+            if not self.array[byte] & (1 << bit):
+                self.array[byte] |= 1 << bit
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item):
+        return all(self.array[p // 8] & (1 << (p % 8)) for p in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def memory_bytes(self):
+        return len(self.array)
+
+
+class Frontier:
+    """
+    广度优先的爬取边界：双端队列 + 布隆过滤器去重 + 每个域名的深度和页面预算。
+
+    scope 决定哪些链接会入队：host 只保留与种子相同的主机，site 还包括种子的子域名
+    （www. 前缀视为同一站点），any 不限制。每个站点（去掉 www. 的主机名）最多入队 max_pages 个页面，
+    深度超过 max_depth 的链接不入队；队列长度超过 max_queued 时丢弃新链接，内存有上限。
+    """
+
+    def __init__(self,
+                 scope=config.get("frontier", "scope", fallback="site"),
+                 max_depth=config.getint("frontier", "max_depth", fallback=3),
+                 max_pages=config.getint("frontier", "max_pages_per_domain", fallback=500),
+                 max_queued=config.getint("frontier", "max_queued", fallback=100000),
+                 capacity=config.getint("frontier", "bloom_capacity", fallback=1000000),
+                 error_rate=config.getfloat("frontier", "bloom_error_rate", fallback=0.001)):
+        self.scope = scope
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.max_queued = max_queued
+        self.queue = deque()
+        self.seen = BloomFilter(capacity, error_rate)
+        self.domains = set()  # 种子站点
+        self.budgets = {}  # 站点 -> 已入队页面数
+        self.visited = 0
+        self.dropped = {"scope": 0, "depth": 0, "budget": 0, "full": 0, "invalid": 0}
+        self.started = time.monotonic()
+
+    @staticmethod
+    def _site(host):
+        return host[4:] if host.startswith("www.") else host
+
+    def _in_scope(self, host):
+        if self.scope == "any":
+            return True
+        if self.scope == "host":
+            return host in self.domains or self._site(host) in self.domains
+        site = self._site(host)
+        return any(site == domain or site.endswith("." + domain) for domain in self.domains)
+
+    def seed(self, urls):
+        for url in urls:
+            canonical = canonicalize(url)
+            if canonical is None:
+                self.dropped["invalid"] += 1
+                continue
+            self.domains.add(self._site(urlsplit(canonical).hostname))
+            self.add(canonical, 0)
+
+    def add(self, url, depth):
+        """链接入队，被过滤或已见过时返回 False"""
+        canonical = canonicalize(url)
+        if canonical is None:
+            self.dropped["invalid"] += 1
+            return False
+        host = urlsplit(canonical).hostname
+        if not self._in_scope(host):
+            self.dropped["scope"] += 1
+            return False
+        if depth > self.max_depth:
+            self.dropped["depth"] += 1
+            return False
+        if canonical in self.seen:
+            return False
+        site = self._site(host)
+        if self.max_pages and self.budgets.get(site, 0) >= self.max_pages:
+            self.dropped["budget"] += 1
+            return False
+        if self.max_queued and len(self.queue) >= self.max_queued:
+            self.dropped["full"] += 1
+            return False
+        self.seen.add(canonical)
+        self.budgets[site] = self.budgets.get(site, 0) + 1
+        self.queue.append((canonical, depth))
+        return True
+
+    def extend(self, urls, depth):
+        return sum(self.add(url, depth) for url in urls)
+
+    def pop(self):
+        """取出下一个 (URL, 深度)，队列为空时返回 None"""
+        if not self.queue:
+            return None
+        self.visited += 1
+        return self.queue.popleft()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            "queued": len(self.queue),
+            "visited": self.visited,
+            "seen": len(self.seen),
+            "pages_per_second": round(self.visited / elapsed, 2) if elapsed else 0,
+            "bloom_kb": self.seen.memory_bytes // 1024,
+            "dropped": dict(self.dropped),
+        }
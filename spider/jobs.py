@@ -0,0 +1,245 @@
+import argparse
+import os
+import socket
+import sqlite3
+import time
+
+from config.config import config
+from config.logger import logger
+from spider.resolver import PREFETCH_DEPTH, prefetch_urls
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    campaign TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    rep INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    output TEXT,
+    error TEXT,
+    UNIQUE (campaign, idx, rep)
+);
+-- 领取任务时按 id 顺序取第一条待执行任务
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (campaign, state, id);
+-- 各状态的任务数由触发器维护，状态查询不需要扫描整张表
+CREATE TABLE IF NOT EXISTS job_counts (
+    campaign TEXT NOT NULL,
+    state TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (campaign, state)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS jobs_insert AFTER INSERT ON jobs BEGIN
+    INSERT INTO job_counts VALUES (NEW.campaign, NEW.state, 1)
+        ON CONFLICT (campaign, state) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_update AFTER UPDATE OF state ON jobs WHEN OLD.state != NEW.state BEGIN
+    UPDATE job_counts SET n = n - 1 WHERE campaign = OLD.campaign AND state = OLD.state;
+    INSERT INTO job_counts VALUES (NEW.campaign, NEW.state, 1)
+        ON CONFLICT (campaign, state) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS jobs_delete AFTER DELETE ON jobs BEGIN
+    UPDATE job_counts SET n = n - 1 WHERE campaign = OLD.campaign AND state = OLD.state;
+END;
+"""
+
+
+class Job:
+    __slots__ = ("id", "campaign", "index", "rep", "url", "name", "attempts", "worker")
+
+    def __init__(self, id, campaign, index, rep, url, name, attempts, worker=None):
+        self.id = id
+        self.campaign = campaign
+        self.index = index
+        self.rep = rep
+        self.url = url
+        self.name = name
+        self.attempts = attempts
+        self.worker = worker  # 持有租约的 worker
+
+    def __repr__(self):
+        return f"Job({self.campaign}#{self.index}.{self.rep} {self.url})"
+
+
+class JobQueue:
+    """
+    基于本地 SQLite 的持久化任务队列。每个任务是 (URL, 重复次数) 的一次采集，
+    worker 通过租约领取任务，进程崩溃后租约过期，任务会被重新领取；
+    重启后从中断处继续，不需要手动修改起始 index。
+    """
+
+    def __init__(self, path=None, lease_seconds=None, max_attempts=None):
+        self.path = path or config.get("jobs", "db_path",
+                                       fallback=os.path.join(config["spider"]["output_dir"], "jobs.sqlite"))
+        self.lease_seconds = lease_seconds or config.getint("jobs", "lease_seconds", fallback=600)
+        self.max_attempts = max_attempts or config.getint("jobs", "max_attempts", fallback=3)
+        # 自行管理事务，领取任务时使用 BEGIN IMMEDIATE 加写锁
+        self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def add(self, campaign, urls, names, repeat=1, start=0):
+        """
+        添加任务，index 从 start 开始按 URL 顺序编号。
+        已存在的任务会被忽略，因此可以在每次启动时重复调用。
+        """
+        now = time.time()
+        rows = ((campaign, start + i, rep, url, name, now)
+                for i, (url, name) in enumerate(zip(urls, names)) for rep in range(repeat))
+        self.conn.execute("BEGIN")
+        cursor = self.conn.executemany(
+            "INSERT OR IGNORE INTO jobs (campaign, idx, rep, url, name, created) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.conn.execute("COMMIT")
+        return cursor.rowcount
+
+    def lease(self, campaign, worker):
+        """原子地领取下一个待执行任务，没有任务时返回 None"""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 租约过期的任务回到待执行状态（或在超过重试次数后标记失败）
+            self.conn.execute(
+                "UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, error = 'lease expired' WHERE campaign = ? AND state = 'leased' AND lease_until < ?",
+                (self.max_attempts, campaign, now))
+            row = self.conn.execute(
+                "SELECT id, campaign, idx, rep, url, name, attempts FROM jobs "
+                "WHERE campaign = ? AND state = 'pending' ORDER BY id LIMIT 1", (campaign,)).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, started = ?, "
+                "attempts = attempts + 1 WHERE id = ?", (worker, now + self.lease_seconds, now, row[0]))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        job = Job(*row, worker=worker)
+        job.attempts += 1
+        return job
+
+    def upcoming(self, campaign, limit):
+        """接下来将被领取的任务 URL，用于预取 DNS"""
+        return [row[0] for row in self.conn.execute(
+            "SELECT url FROM jobs WHERE campaign = ? AND state = 'pending' ORDER BY id LIMIT ?", (campaign, limit))]
+
+    def renew(self, job):
+        """延长租约，用于超过 lease_seconds 的长任务"""
+        self.conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                          (time.time() + self.lease_seconds, job.id, job.worker))
+
+    def _still_leased(self, cursor, job):
+        """租约已过期并被重新分配时，结果不再写入，返回 False"""
+        if cursor.rowcount:
+            return True
+        logger.warning(f"{job} 的租约已失效（可能已被其他 worker 领取），不再记录结果")
+        return False
+
+    def complete(self, job, output=None):
+        """标记任务完成，租约已失效时返回 False"""
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = 'done', finished = ?, output = ?, error = NULL, worker = NULL "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time(), output, job.id, job.worker))
+        return self._still_leased(cursor, job)
+
+    def fail(self, job, error=None):
+        """任务失败：未超过重试次数时重新排队，否则标记为失败；租约已失效时返回 False"""
+        state = FAILED if job.attempts >= self.max_attempts else PENDING
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = ?, finished = ?, error = ?, worker = NULL "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (state, time.time(), error, job.id, job.worker))
+        return self._still_leased(cursor, job)
+
+    def release(self, campaign, worker):
+        """释放某个 worker 持有的租约，worker 重启后调用，无需等待租约过期"""
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = 'pending', worker = NULL "
+            "WHERE campaign = ? AND state = 'leased' AND worker = ?", (campaign, worker))
+        return cursor.rowcount
+
+    def retry_failed(self, campaign):
+        cursor = self.conn.execute(
+            "UPDATE jobs SET state = 'pending', attempts = 0 WHERE campaign = ? AND state = 'failed'", (campaign,))
+        return cursor.rowcount
+
+    def status(self, campaign):
+        """各状态的任务数量"""
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        counts.update(self.conn.execute(
+            "SELECT state, n FROM job_counts WHERE campaign = ?", (campaign,)))
+        return counts
+
+    def campaigns(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT campaign FROM job_counts")]
+
+    def close(self):
+        self.conn.close()
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_campaign(queue, campaign, task, after=None, worker=None):
+    """
+    循环领取并执行任务，直到队列为空。
+    task(urls, name, index) 成功时返回输出文件名，失败时返回假值；
+    after 在每个任务结束后调用，用于清理残留进程等。
+    """
+    worker = worker or worker_id()
+    # 同名 worker（例如重启后的同一容器）遗留的租约直接释放
+    released = queue.release(campaign, worker)
+    if released:
+        logger.info(f"释放 {released} 个未完成的租约")
+    logger.info(f"任务队列 {campaign}: {queue.status(campaign)}")
+
+    while True:
+        job = queue.lease(campaign, worker)
+        if job is None:
+            break
+        prefetch_urls(queue.upcoming(campaign, PREFETCH_DEPTH))
+        try:
+            output = task([job.url], job.name, job.index)
+        except Exception as e:
+            logger.error(f"{job} 异常: {e}")
+            queue.fail(job, str(e))
+        else:
+            if output:
+                queue.complete(job, output if isinstance(output, str) else None)
+            else:
+                queue.fail(job, "task returned no output")
+        if after is not None:
+            after()
+    logger.info(f"任务队列 {campaign} 已完成: {queue.status(campaign)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看或维护采集任务队列")
+    parser.add_argument("command", choices=["status", "retry-failed"])
+    parser.add_argument("campaign", nargs="?")
+    parser.add_argument("--db", help="默认为 [jobs] db_path 或 output_dir/jobs.sqlite")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db)
+    campaigns = [args.campaign] if args.campaign else queue.campaigns()
+    for campaign in campaigns:
+        if args.command == "retry-failed":
+            print(f"{campaign}: {queue.retry_failed(campaign)} failed jobs re-queued")
+        print(f"{campaign}: {queue.status(campaign)}")
+    queue.close()
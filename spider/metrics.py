@@ -0,0 +1,271 @@
+import json
+import logging
+import logging.handlers
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config.config import config
+from config.logger import logger
+
+# 阶段耗时直方图的桶（秒）
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+HELP = {
+    "traffic_phase_seconds": "Time spent in each task phase",
+    "traffic_tasks_total": "Finished tasks by result",
+    "traffic_task_seconds": "Wall time of a whole task",
+    "traffic_captured_bytes_total": "Bytes written to capture files",
+    "traffic_captured_raw_bytes_total": "Captured bytes before compression",
+    "traffic_capture_drops_total": "Packets dropped by the capture engine",
+    "traffic_page_timeouts_total": "Page navigations that timed out",
+    "traffic_page_errors_total": "Page navigations that failed",
+    "traffic_upload_bytes_total": "Bytes uploaded to the object store",
+    "traffic_upload_seconds_total": "Time spent uploading to the object store",
+    "traffic_download_bytes_total": "Bytes downloaded from the object store",
+    "traffic_download_seconds_total": "Time spent downloading from the object store",
+    "traffic_downloads_total": "Downloaded objects by result",
+    "traffic_deleted_objects_total": "Objects deleted from the object store",
+}
+
+# 并行采集时每个工作进程的编号（spider.netns 设置），用于区分输出文件和指标
+WORKER_ENV = "TRAFFIC_WORKER"
+
+DROPPED_PATTERN = re.compile(r"(\d+) packets? dropped")
+
+
+def tshark_drops(stderr):
+    """从 tshark/dumpcap 退出时的输出中解析丢包数"""
+    return sum(int(n) for n in DROPPED_PATTERN.findall(stderr or ""))
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class TaskMetrics:
+    """一个任务的各阶段耗时和计数，结束时写入 JSONL"""
+
+    def __init__(self, metrics, name, **fields):
+        self.metrics = metrics
+        self.record = {"task": name, "start": time.time(), **fields}
+        self.phases = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def add_phase(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+        self.metrics.observe("traffic_phase_seconds", seconds, phase=name)
+
+    def add(self, key, value=1):
+        self.record[key] = self.record.get(key, 0) + value
+
+    def set(self, key, value):
+        self.record[key] = value
+
+    def finish(self, result):
+        duration = time.perf_counter() - self.started
+        self.record.update({
+            "result": result,
+            "duration": round(duration, 3),
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+        })
+        self.metrics.finish_task(self, duration)
+        return self.record
+
+
+class Metrics:
+    """
+    进程内的计数器和直方图，可导出为 Prometheus 文本格式
+    （node_exporter textfile 或 HTTP 端点），每个任务另写一行 JSONL。
+    component 用于区分采集端（spider）和下载端（client）的输出文件；worker 非空时
+    （并行采集的工作进程）文件名带上 worker，所有指标加上 worker 标签，多个进程不会互相覆盖。
+    """
+
+    def __init__(self, component, worker=None,
+                 directory=config.get("metrics", "dir", fallback=os.path.join(config["spider"]["output_dir"], "metrics")),
+                 enabled=config.getboolean("metrics", "enabled", fallback=True),
+                 jsonl_max_mb=config.getint("metrics", "jsonl_max_mb", fallback=50)):
+        self.component = component
+        self.worker = os.environ.get(WORKER_ENV, "") if worker is None else worker
+        self.directory = directory
+        self.enabled = enabled
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # 多个线程同时写 textfile 时共用同一个临时文件
+        self.local = threading.local()
+        self.server = None
+        self.task_log = None
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+            suffix = f"-{self.worker}" if self.worker else ""
+            self.textfile = os.path.join(directory, f"traffic_{component}{suffix}.prom")
+            # 与 config.logger 相同，用 RotatingFileHandler 滚动 JSONL；每个进程一个文件，滚动互不影响
+            self.task_log = logging.getLogger(f"metrics.{component}{suffix}")
+            self.task_log.propagate = False
+            self.task_log.setLevel(logging.INFO)
+            handler = logging.handlers.RotatingFileHandler(
+                os.path.join(directory, f"{component}{suffix}_tasks.jsonl"),
+                maxBytes=jsonl_max_mb * 1024 * 1024, backupCount=3, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.task_log.addHandler(handler)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def count(self, name, field, value=1, **labels):
+        """累加计数器，同时累加到当前任务记录的 field 上"""
+        self.inc(name, value, **labels)
+        task = self.current_task()
+        if task is not None:
+            task.add(field, value)
+
+    def observe(self, name, value, **labels):
+        key = (name, _labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(BUCKETS), 0, 0.0]
+            buckets = histogram[0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            histogram[1] += 1
+            histogram[2] += value
+
+    def start_task(self, name, **fields):
+        """开始一个任务，同一线程中的 phase() 会记到这个任务上"""
+        task = TaskMetrics(self, name, **fields)
+        self.local.task = task
+        return task
+
+    def current_task(self):
+        return getattr(self.local, "task", None)
+
+    def bind_task(self, task):
+        """在另一个线程中继续记录同一个任务（如异步爬虫的事件循环线程），task 为 None 时解除"""
+        self.local.task = task
+
+    @contextmanager
+    def phase(self, name):
+        """记录当前任务的一个阶段；没有进行中的任务时只计入直方图"""
+        task = self.current_task()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if task is not None:
+                task.add_phase(name, seconds)
+            else:
+                self.observe("traffic_phase_seconds", seconds, phase=name)
+
+    def finish_task(self, task, duration):
+        if self.current_task() is task:
+            self.local.task = None
+        self.inc("traffic_tasks_total", result=task.record["result"])
+        self.observe("traffic_task_seconds", duration)
+        if self.task_log is not None:
+            self.task_log.info(json.dumps(task.record, ensure_ascii=False))
+        self.write_textfile()
+
+    def render(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        worker = (("worker", self.worker),) if self.worker else ()
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(worker + labels)} {value}")
+        for (name, labels), (buckets, count, total) in histograms:
+            labels = worker + labels
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+            for bound, bucket in zip(BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {bucket}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self):
+        """原子写入 textfile，供 node_exporter 的 textfile collector 读取"""
+        if not self.enabled:
+            return
+        tmp = self.textfile + ".tmp"
+        with self.write_lock:
+            try:
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(self.render())
+                os.replace(tmp, self.textfile)
+            except OSError as e:
+                logger.warning(f"写入指标文件失败: {e}")
+
+    def serve(self, port):
+        """在后台线程中提供 /metrics HTTP 端点"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"指标端点: http://0.0.0.0:{port}/metrics")
+
+
+_metrics = {}
+
+
+def get_metrics(component="spider"):
+    """返回进程内共享的指标对象；配置了 http_port 时首次调用启动 HTTP 端点"""
+    if component not in _metrics:
+        metrics = _metrics[component] = Metrics(component)
+        port = config.getint("metrics", f"{component}_http_port", fallback=0)
+        if metrics.enabled and port:
+            metrics.serve(port)
+    return _metrics[component]
+
+
+def phase(name):
+    """记录采集端当前任务的一个阶段"""
+    return get_metrics().phase(name)
@@ -0,0 +1,253 @@
+import argparse
+import ipaddress
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config.config import config
+from config.logger import logger
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# systemd-resolved 的上游服务器列表（/etc/resolv.conf 中只有 127.0.0.53）
+RESOLVED_UPSTREAM = "/run/systemd/resolve/resolv.conf"
+
+
+def _run(cmd, check=True):
+    logger.debug(f"执行: {' '.join(cmd)}")
+    return subprocess.run(cmd, check=check, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _nameservers(path):
+    servers = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    servers.append(parts[1])
+    except OSError:
+        pass
+    return servers
+
+
+def _is_loopback(server):
+    try:
+        return ipaddress.ip_address(server.split("%")[0]).is_loopback
+    except ValueError:
+        return False
+
+
+def namespace_resolv_conf(nameserver=config.get("netns", "nameserver", fallback=""),
+                          fallback=config.get("netns", "fallback_nameserver", fallback="8.8.8.8")):
+    """
+    命名空间内使用的 resolv.conf 内容。宿主机的回环地址 DNS（Docker 的 127.0.0.11、
+    systemd-resolved 的 127.0.0.53）在命名空间内不可达：指定 nameserver 时直接使用，
+    否则替换为 systemd-resolved 的上游服务器，仍没有可用服务器时使用 fallback。
+    """
+    if nameserver:
+        servers = [server.strip() for server in nameserver.split(",") if server.strip()]
+    else:
+        servers = _nameservers("/etc/resolv.conf")
+        if any(_is_loopback(server) for server in servers):
+            upstream = [server for server in _nameservers(RESOLVED_UPSTREAM) if not _is_loopback(server)]
+            servers = [server for server in servers if not _is_loopback(server)] or upstream
+            if not servers:
+                logger.warning(f"宿主机只有回环地址 DNS，命名空间内改用 {fallback}")
+                servers = [fallback]
+    lines = []
+    try:
+        with open("/etc/resolv.conf", encoding="utf-8") as f:
+            # 保留 search/options，替换 nameserver
+            lines = [line for line in f if line.split()[:1] in (["search"], ["domain"], ["options"])]
+    except OSError:
+        pass
+    return "".join(lines) + "".join(f"nameserver {server}\n" for server in servers)
+
+
+class NetNamespace:
+    """
+    独立的 Linux 网络命名空间，通过 veth 对与宿主机相连。
+
+    宿主机一侧为 tc-h{index}（10.200.{index}.1/30），命名空间一侧为
+    tc-n{index}（10.200.{index}.2/30），出口流量经 MASQUERADE 转发到
+    uplink 网卡；FORWARD 链默认丢弃时（Docker 宿主机）另外放行 veth 的转发。
+    命名空间内只有一个浏览器的流量，抓包互不干扰。
+    """
+
+    def __init__(self, index, uplink=None, prefix="tc"):
+        self.index = index
+        self.name = f"{prefix}{index}"
+        self.uplink = uplink or config["spider"]["interface"]
+        self.host_veth = f"{prefix}-h{index}"
+        self.interface = f"{prefix}-n{index}"  # 命名空间内的抓包网卡
+        self.subnet = f"10.200.{index}.0/30"
+        self.host_ip = f"10.200.{index}.1"
+        self.ns_ip = f"10.200.{index}.2"
+
+    def _nat_rule(self, action):
+        return ["iptables", "-t", "nat", action, "POSTROUTING", "-s", self.subnet,
+                "-o", self.uplink, "-j", "MASQUERADE"]
+
+    def _forward_rules(self, action):
+        return [["iptables", action, "FORWARD", "-i", self.host_veth, "-j", "ACCEPT"],
+                ["iptables", action, "FORWARD", "-o", self.host_veth, "-j", "ACCEPT"]]
+
+    def create(self):
+        self.destroy()  # 清理上次异常退出的残留
+        _run(["ip", "netns", "add", self.name])
+        _run(["ip", "link", "add", self.host_veth, "type", "veth", "peer", "name", self.interface])
+        _run(["ip", "link", "set", self.interface, "netns", self.name])
+        _run(["ip", "addr", "add", f"{self.host_ip}/30", "dev", self.host_veth])
+        _run(["ip", "link", "set", self.host_veth, "up"])
+        self.exec_run(["ip", "addr", "add", f"{self.ns_ip}/30", "dev", self.interface])
+        self.exec_run(["ip", "link", "set", self.interface, "up"])
+        self.exec_run(["ip", "link", "set", "lo", "up"])
+        self.exec_run(["ip", "route", "add", "default", "via", self.host_ip])
+
+        _run(["sysctl", "-q", "-w", "net.ipv4.ip_forward=1"])
+        _run(self._nat_rule("-A"))
+        for rule in self._forward_rules("-I"):
+            _run(rule)
+
+        # ip netns exec 会把 /etc/netns/<name>/resolv.conf 绑定到命名空间内
+        netns_etc = os.path.join("/etc/netns", self.name)
+        os.makedirs(netns_etc, exist_ok=True)
+        with open(os.path.join(netns_etc, "resolv.conf"), "w", encoding="utf-8") as f:
+            f.write(namespace_resolv_conf())
+        logger.info(f"网络命名空间 {self.name} 已创建: {self.ns_ip} -> {self.host_ip}")
+
+    def destroy(self):
+        _run(self._nat_rule("-D"), check=False)
+        for rule in self._forward_rules("-D"):
+            _run(rule, check=False)
+        _run(["ip", "link", "del", self.host_veth], check=False)
+        _run(["ip", "netns", "del", self.name], check=False)
+        shutil.rmtree(os.path.join("/etc/netns", self.name), ignore_errors=True)
+
+    def command(self, cmd):
+        return ["ip", "netns", "exec", self.name] + list(cmd)
+
+    def exec_run(self, cmd):
+        return _run(self.command(cmd))
+
+
+class NetnsWorker:
+    """在命名空间内常驻的采集进程，通过 stdin/stdout 逐行收发 JSON 任务"""
+
+    def __init__(self, namespace, mode):
+        self.namespace = namespace
+        self.mode = mode
+        self.process = None
+
+    def start(self):
+        cmd = self.namespace.command([
+            sys.executable, "-m", "spider.netns_worker",
+            "--mode", self.mode, "--interface", self.namespace.interface,
+        ])
+        # 每个工作进程写自己的指标文件（spider.metrics.WORKER_ENV）
+        env = dict(os.environ, TRAFFIC_WORKER=self.namespace.name)
+        self.process = subprocess.Popen(cmd, cwd=PROJECT_DIR, stdin=subprocess.PIPE, env=env,
+                                        stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def run(self, urls, name, index):
+        if self.process is None or self.process.poll() is not None:
+            self.start()
+        # {host} 占位符替换为宿主机一侧地址，便于访问宿主机上的本地 Web 服务
+        urls = [url.replace("{host}", self.namespace.host_ip) for url in urls]
+        self.process.stdin.write(json.dumps({"urls": urls, "name": name, "index": index}) + "\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            logger.error(f"{self.namespace.name} 工作进程异常退出")
+            self.process = None
+            return False
+        return json.loads(line).get("result", False)
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+
+
+class NetnsWorkerPool:
+    """
+    并行采集池：每个 worker 独占一个网络命名空间，N 个站点同时采集，
+    各自写入干净的 pcap。
+    """
+
+    def __init__(self, workers=os.cpu_count(), mode="local", uplink=None):
+        if os.geteuid() != 0:
+            raise PermissionError("创建网络命名空间需要 root 权限")
+        self.namespaces = [NetNamespace(i, uplink) for i in range(workers)]
+        self.workers = queue.Queue()
+        for ns in self.namespaces:
+            ns.create()
+            self.workers.put(NetnsWorker(ns, mode))
+        self.completed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def _run_one(self, task):
+        urls, name, index = task
+        worker = self.workers.get()
+        try:
+            result = worker.run(urls, name, index)
+        except Exception as e:
+            logger.error(f"任务 {index}_{name} 在 {worker.namespace.name} 中失败: {e}")
+            result = False
+        finally:
+            self.workers.put(worker)
+        with self.lock:
+            if result:
+                self.completed += 1
+            else:
+                self.failed += 1
+        return result
+
+    def run(self, tasks):
+        """tasks 为 (urls, name, index) 的可迭代对象"""
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=len(self.namespaces)) as executor:
+            results = list(executor.map(self._run_one, tasks))
+        elapsed = time.time() - start
+        rate = len(results) / elapsed * 3600 if elapsed > 0 else 0
+        logger.info(f"并行采集完成: 成功 {self.completed}，失败 {self.failed}，"
+                    f"耗时 {elapsed:.1f}s，约 {rate:.0f} 样本/小时")
+        return results
+
+    def close(self):
+        while not self.workers.empty():
+            self.workers.get().stop()
+        for ns in self.namespaces:
+            ns.destroy()
+
+
+if __name__ == "__main__":
+    # 本地测试：先在宿主机运行 python -m http.server 8080 --bind 0.0.0.0，
+    # 再执行 python -m spider.netns --workers 4 --repeat 8 http://{host}:8080/
+    parser = argparse.ArgumentParser(description="在网络命名空间中并行采集流量")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--mode", choices=["local", "minio"], default="local")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    pool = NetnsWorkerPool(args.workers, args.mode)
+    try:
+        tasks = []
+        for index, url in enumerate(args.urls):
+            name = url.split("://")[-1].split("/")[0].replace("{host}", "local").replace(":", "_")
+            tasks += [([url], name, index)] * args.repeat
+        pool.run(tasks)
+    finally:
+        pool.close()
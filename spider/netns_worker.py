@@ -0,0 +1,27 @@
+import argparse
+import json
+import sys
+
+from config.logger import logger
+
+if __name__ == "__main__":
+    # 由 spider.netns.NetnsWorker 在网络命名空间内启动，逐行读取任务
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["local", "minio"], default="local")
+    parser.add_argument("--interface", required=True)
+    args = parser.parse_args()
+
+    if args.mode == "minio":
+        from spider.capture_minio import main
+    else:
+        from spider.capture_local import main
+
+    for line in sys.stdin:
+        task = json.loads(line)
+        try:
+            result = main(task["urls"], task["name"], task["index"], interface=args.interface) or False
+        except Exception as e:
+            logger.error(f"任务 {task['index']}_{task['name']} 异常: {e}", exc_info=True)
+            result = False
+        sys.stdout.write(json.dumps({"result": result}) + "\n")
+        sys.stdout.flush()
@@ -0,0 +1,109 @@
+import io
+
+from config.config import config
+from config.logger import logger
+from utils.flowtable import flow_key
+from utils.pcap import PcapReader, PcapRecord, decode_packet
+
+PROFILE_PREFIX = "profile:"
+
+
+class CaptureProfile:
+    """
+    抓包配置档，对应 config.ini 中的 [profile:<name>] 小节：
+
+    snaplen        每个包最多保存的字节数（含链路层头），只影响 caplen，origlen 保持原值；
+                   不设置时使用抓包引擎的默认值
+    payload_bytes  每个流每个方向只保留前 N 字节的载荷，之后的包只保留到传输层头部；
+                   -1 表示不按流截断
+    """
+
+    def __init__(self, name, snaplen=None, payload_bytes=-1):
+        self.name = name
+        self.snaplen = snaplen
+        self.payload_bytes = payload_bytes
+
+    @property
+    def per_flow(self):
+        """是否需要逐包改写（tshark 只能按 snaplen 截断）"""
+        return self.payload_bytes >= 0
+
+    def truncator(self):
+        return FlowTruncator(self.payload_bytes) if self.per_flow else None
+
+    def tshark_options(self):
+        return ["-s", str(self.snaplen)] if self.snaplen else []
+
+    def afpacket_options(self):
+        options = {"rewrite": self.truncator()}
+        if self.snaplen:
+            options["snaplen"] = self.snaplen
+        return options
+
+    def as_dict(self):
+        return {"name": self.name, "snaplen": self.snaplen, "payload_bytes": self.payload_bytes}
+
+
+def load_profile(name=None):
+    """读取 [spider] capture_profile 指定的配置档，未定义时为 full（不截断）"""
+    name = name or config.get("spider", "capture_profile", fallback="full")
+    section = PROFILE_PREFIX + name
+    if not config.has_section(section):
+        if name != "full":
+            logger.warning(f"未定义抓包配置档 {name}，使用 full")
+        return CaptureProfile("full")
+    return CaptureProfile(name,
+                          snaplen=config.getint(section, "snaplen", fallback=None),
+                          payload_bytes=config.getint(section, "payload_bytes", fallback=-1))
+
+
+def profile_names():
+    return [section[len(PROFILE_PREFIX):] for section in config.sections() if section.startswith(PROFILE_PREFIX)]
+
+
+class FlowTruncator:
+    """
+    按流截断载荷：每个流每个方向只保留前 payload_bytes 字节的载荷，
+    之后的包只保留 IP/TCP/UDP 头部。只截短 data 和 caplen，origlen 不变，
+    包长度、时间等统计与完整抓包一致。非 IP 包原样保留。
+    """
+
+    def __init__(self, payload_bytes):
+        self.payload_bytes = payload_bytes
+        self.remaining = {}  # (流键, 方向) -> 剩余可保留的载荷字节数
+
+    def __call__(self, record):
+        decoded = decode_packet(record.linktype, record.data)
+        if decoded is None:
+            return record
+        version, src, dst, proto, sport, dport, _, payload_offset = decoded
+        key = flow_key(version, src, dst, proto, sport or 0, dport or 0)
+        remaining = self.remaining.get(key, self.payload_bytes)
+        payload = len(record.data) - payload_offset
+        keep = min(payload, remaining)
+        if payload > 0:
+            self.remaining[key] = remaining - keep
+        if keep < payload:
+            # 返回新记录，同一条记录可能还要写入其他输出（环形缓冲切分时任务窗口会重叠）
+            data = record.data[:payload_offset + keep]
+            return PcapRecord(record.ts_sec, record.ts_frac, len(data), record.origlen, data, record.linktype)
+        return record
+
+
+def rewrite_stream(stream, writer_factory, truncator):
+    """
+    从 tshark 输出的 pcap 流中逐条读取记录，截断后写入 writer_factory(reader) 返回的写入器，
+    直到流结束；返回写入的记录数。
+    """
+    if not isinstance(stream, io.BufferedIOBase):
+        stream = io.BufferedReader(stream, 65536)  # 无缓冲管道的 read(n) 可能返回不足 n 字节
+    reader = PcapReader(stream)
+    writer = writer_factory(reader)
+    count = 0
+    try:
+        for record in reader:
+            writer.write(truncator(record))
+            count += 1
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,91 @@
+import time
+
+import psutil
+
+from config.config import config
+from config.logger import logger
+
+
+class QuiescenceMonitor:
+    """
+    根据网卡的实时流量判断页面是否已经“安静”。
+
+    很多网站因为长轮询或统计脚本永远达不到 networkidle，只能等到 page_timeout。
+    这里改为采样网卡的字节/包计数：流量速率低于 quiet_rate 持续 quiet_window 秒
+    （且已访问至少 min_duration 秒）即认为页面加载结束，最长不超过 max_duration。
+
+    爬虫把它作为 stop_condition，每个 URL 开始前调用 reset()，之后周期性调用，
+    返回 True 时结束当前页面。
+    """
+
+    def __init__(self, interface,
+                 quiet_window=config.getfloat("quiescence", "quiet_window", fallback=3.0),
+                 min_duration=config.getfloat("quiescence", "min_duration", fallback=2.0),
+                 max_duration=config.getfloat("quiescence", "max_duration",
+                                              fallback=int(config["spider"]["page_timeout"]) / 1000),
+                 quiet_rate=config.getint("quiescence", "quiet_rate", fallback=2048)):
+        self.interface = interface
+        self.quiet_window = quiet_window
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.quiet_rate = quiet_rate  # 字节/秒，低于该速率视为安静
+        self.pages = []  # 每个 URL 的访问时长和结束原因
+        self.url = None
+        self._warned = False
+
+    def _counters(self):
+        counters = psutil.net_io_counters(pernic=True).get(self.interface)
+        if counters is None:
+            if not self._warned:
+                logger.warning(f"无法读取网卡 {self.interface} 的流量计数，只按最长时长结束页面")
+                self._warned = True
+            return None
+        return (counters.bytes_sent + counters.bytes_recv,
+                counters.packets_sent + counters.packets_recv)
+
+    def reset(self, url=None):
+        self.url = url
+        self.start = self.last_sample = self.last_active = time.monotonic()
+        self.first = self.last = self._counters()
+
+    def __call__(self):
+        now = time.monotonic()
+        current = self._counters()
+        if current is not None and self.last is not None:
+            rate = (current[0] - self.last[0]) / max(now - self.last_sample, 1e-3)
+            if rate > self.quiet_rate:
+                self.last_active = now
+        else:
+            self.last_active = now  # 没有计数时永远不判定为安静
+        self.last, self.last_sample = current, now
+
+        elapsed = now - self.start
+        if elapsed >= self.max_duration:
+            reason = "max_duration"
+        elif elapsed >= self.min_duration and now - self.last_active >= self.quiet_window:
+            reason = "quiet"
+        else:
+            return False
+
+        page = {"url": self.url, "duration": round(elapsed, 3), "reason": reason}
+        if current is not None and self.first is not None:
+            page["bytes"] = current[0] - self.first[0]
+            page["packets"] = current[1] - self.first[1]
+        self.pages.append(page)
+        logger.info(f"{self.url} 在 {elapsed:.1f}s 后结束（{reason}）")
+        return True
+
+    def settings(self):
+        return {
+            "quiet_window": self.quiet_window,
+            "min_duration": self.min_duration,
+            "max_duration": self.max_duration,
+            "quiet_rate": self.quiet_rate,
+        }
+
+
+def create_monitor(interface):
+    """配置中开启时返回监视器，否则返回 None（使用 Playwright 的 wait_until）"""
+    if config.getboolean("quiescence", "enabled", fallback=False):
+        return QuiescenceMonitor(interface)
+    return None
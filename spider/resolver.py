@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import atexit
+import concurrent.futures
+import ipaddress
+import os
+import random
+import socket
+import struct
+import threading
+import time
+
+from config.config import config
+from config.logger import logger
+from utils.dns import TYPE_A, TYPE_AAAA, build_query, parse_message
+
+HOSTS_FILES = ["/etc/hosts", r"C:\Windows\System32\drivers\etc\hosts"]
+# 每个任务开始前预取之后多少个 URL 的主机名
+PREFETCH_DEPTH = config.getint("dns", "prefetch", fallback=4)
+
+
+def hostname_of(url):
+    return url.split("://")[-1].split("/")[0].split(":")[0]
+
+
+def _parse_nameserver(value):
+    """
+    [dns] nameserver：host[:port]；为空时读取 /etc/resolv.conf 的第一个 nameserver；
+    system 表示使用系统解析（getaddrinfo，没有 TTL，也不做预取）
+    """
+    value = (value or "").strip()
+    if value == "system":
+        return None
+    if not value:
+        try:
+            with open("/etc/resolv.conf", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) >= 2 and parts[0] == "nameserver":
+                        value = parts[1]
+                        break
+        except OSError:
+            pass
+        if not value:
+            return None
+    if value.startswith("["):  # [::1]:53
+        host, _, port = value[1:].partition("]:")
+    elif value.count(":") == 1:
+        host, _, port = value.partition(":")
+    else:
+        host, port = value, ""
+    return host, int(port or 53)
+
+
+def _read_hosts():
+    """读取 hosts 文件，内置解析器不经过系统解析，localhost 等名称需要单独处理"""
+    hosts = {}
+    for path in HOSTS_FILES:
+        if not os.path.exists(path):
+            continue
+        try:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    parts = line.split("#")[0].split()
+                    for name in parts[1:]:
+                        hosts.setdefault(name.lower(), []).append(parts[0])
+        except OSError:
+            continue
+        break
+    return hosts
+
+
+def _normalize(host):
+    try:
+        return str(ipaddress.ip_address(host.split("%")[0]))  # 去掉 IPv6 的 %scope
+    except ValueError:
+        return host
+
+
+class _DnsProtocol(asyncio.DatagramProtocol):
+    """
+    所有查询共用一个 UDP 套接字，按报文 id 匹配应答。源端口固定，只接受来自 nameserver 的、
+    问题部分与查询相同的应答，伪造应答不能只靠猜测 16 位 id。
+    """
+
+    def __init__(self, nameserver):
+        self.nameserver = (_normalize(nameserver[0]), nameserver[1])
+        self.pending = {}  # id -> (Future, 查询的问题部分)
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        if (_normalize(addr[0]), addr[1]) != self.nameserver:
+            return
+        entry = self.pending.get(int.from_bytes(data[:2], "big"))
+        if entry is None:
+            return
+        future, question = entry
+        if data[12:12 + len(question)].lower() != question.lower():
+            logger.debug(f"丢弃问题不匹配的 DNS 应答（来自 {addr[0]}）")
+            return
+        if not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        logger.debug(f"DNS 套接字错误: {exc}")
+
+
+class Resolver:
+    """
+    异步 DNS 解析器：在后台线程的事件循环中运行，按 TTL 缓存结果。
+
+    prefetch() 提交即将采集的主机名，立即返回，最多 concurrency 个查询同时进行；
+    resolve()/lookup() 阻塞等待结果，缓存命中时不发查询。内置解析器固定使用
+    source_port 作为源端口，捕获过滤器会排除这个端口，预取产生的 DNS 流量
+    不会混入正在进行的采集。
+    """
+
+    def __init__(self,
+                 nameserver=config.get("dns", "nameserver", fallback=""),
+                 source_port=config.getint("dns", "source_port", fallback=53530),
+                 concurrency=config.getint("dns", "concurrency", fallback=16),
+                 timeout=config.getfloat("dns", "timeout", fallback=2.0),
+                 retries=config.getint("dns", "retries", fallback=2),
+                 min_ttl=config.getint("dns", "min_ttl", fallback=30),
+                 max_ttl=config.getint("dns", "max_ttl", fallback=3600),
+                 negative_ttl=config.getint("dns", "negative_ttl", fallback=60),
+                 ipv6=config.getboolean("dns", "ipv6", fallback=True)):
+        self.nameserver = _parse_nameserver(nameserver)
+        self.source_port = source_port if self.nameserver else 0
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.ipv6 = ipv6
+        self.hosts = _read_hosts()
+        self.cache = {}  # 主机名 -> (地址列表, 过期时间)
+        self.inflight = {}  # 主机名 -> concurrent.futures.Future
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        self.protocol = None
+        self.transport = None
+        self.semaphore = None
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.queries = 0
+        self.failures = 0
+
+    def start(self):
+        if self.loop is not None:
+            return
+        self.loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self._setup())
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name="resolver", daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    async def _setup(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.nameserver is None:
+            logger.info("DNS 使用系统解析")
+            return
+        family = socket.AF_INET6 if ":" in self.nameserver[0] else socket.AF_INET
+        local = ("::" if family == socket.AF_INET6 else "0.0.0.0", self.source_port)
+        try:
+            self.transport, self.protocol = await self.loop.create_datagram_endpoint(
+                lambda: _DnsProtocol(self.nameserver), local_addr=local, family=family)
+        except OSError as e:
+            # 端口被占用时退回随机端口，预取流量可能出现在采集中
+            logger.warning(f"DNS 源端口 {self.source_port} 不可用（{e}），改用随机端口")
+            self.source_port = 0
+            self.transport, self.protocol = await self.loop.create_datagram_endpoint(
+                lambda: _DnsProtocol(self.nameserver), local_addr=(local[0], 0), family=family)
+        logger.info(f"DNS 服务器 {self.nameserver[0]}:{self.nameserver[1]}，源端口 {self.source_port or '随机'}")
+
+    async def _query(self, hostname, rtype):
+        """发送一次查询，返回 (地址列表, TTL)；超时重试后仍失败时抛出 TimeoutError"""
+        pending = self.protocol.pending
+        for _ in range(self.retries + 1):
+            qid = random.getrandbits(16)
+            while qid in pending:
+                qid = random.getrandbits(16)
+            future = self.loop.create_future()
+            query = build_query(qid, hostname, rtype)
+            pending[qid] = (future, query[12:])
+            try:
+                self.queries += 1
+                self.transport.sendto(query, self.nameserver)
+                data = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                continue
+            finally:
+                pending.pop(qid, None)
+            try:
+                message = parse_message(data)
+            except (ValueError, IndexError, struct.error):
+                logger.debug(f"无法解析 {hostname} 的 DNS 应答")
+                continue
+            if message.truncated:
+                # 截断的应答需要改用 TCP，交给系统解析
+                raise TimeoutError("truncated")
+            ips, ttl = message.addresses(hostname)
+            return ips, ttl
+        raise TimeoutError(hostname)
+
+    async def _lookup(self, hostname):
+        """返回 (地址列表, TTL)"""
+        if self.nameserver is not None:
+            types = [TYPE_A, TYPE_AAAA] if self.ipv6 else [TYPE_A]
+            results = await asyncio.gather(*(self._query(hostname, rtype) for rtype in types),
+                                           return_exceptions=True)
+            # AAAA 超时或失败时保留 A 记录；A 查询失败才交给系统解析，
+            # 系统解析的查询不经过排除的源端口，可能出现在正在进行的采集中
+            if not isinstance(results[0], BaseException):
+                answered = [result for result in results if not isinstance(result, BaseException)]
+                ips = [ip for result in answered for ip in result[0]]
+                ttls = [result[1] for result in answered if result[1] is not None]
+                return ips, min(ttls) if ttls else self.negative_ttl
+        infos = await self.loop.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+        return list(dict.fromkeys(info[4][0] for info in infos)), self.min_ttl
+
+    async def _resolve(self, hostname):
+        async with self.semaphore:
+            try:
+                ips, ttl = await self._lookup(hostname)
+            except Exception as e:
+                logger.debug(f"解析 {hostname} 失败: {e}")
+                ips, ttl = [], self.negative_ttl
+        if not ips:
+            self.failures += 1
+            ttl = self.negative_ttl
+        ttl = max(self.min_ttl, min(ttl, self.max_ttl))
+        with self.lock:
+            self.cache[hostname] = (ips, time.monotonic() + ttl)
+            self.inflight.pop(hostname, None)
+        return ips
+
+    def _cached(self, hostname):
+        if hostname in self.hosts:
+            return self.hosts[hostname]
+        try:
+            return [str(ipaddress.ip_address(hostname))]
+        except ValueError:
+            pass
+        entry = self.cache.get(hostname)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        return None
+
+    def _submit(self, hostname):
+        """返回缓存结果，或正在进行的查询对应的 Future"""
+        with self.lock:
+            ips = self._cached(hostname)
+            if ips is not None:
+                return ips
+            future = self.inflight.get(hostname)
+            if future is None:
+                self.start()
+                future = asyncio.run_coroutine_threadsafe(self._resolve(hostname), self.loop)
+                self.inflight[hostname] = future
+            return future
+
+    def prefetch(self, hostnames):
+        """提交后台解析，不等待结果；系统解析的查询无法从采集中排除，不预取"""
+        if self.nameserver is None:
+            return
+        for hostname in hostnames:
+            hostname = hostname.lower()
+            if hostname and not isinstance(self._submit(hostname), list):
+                self.prefetched += 1
+
+    def resolve(self, hostname, timeout=None):
+        """阻塞解析一个主机名，返回地址列表（失败时为空列表）"""
+        return self.lookup([hostname], timeout).get(hostname.lower(), [])
+
+    def lookup(self, hostnames, timeout=None):
+        """解析多个主机名，返回 {主机名: 地址列表}"""
+        timeout = timeout or self.timeout * (self.retries + 2)
+        futures = {}
+        results = {}
+        for hostname in hostnames:
+            hostname = hostname.lower()
+            if not hostname or hostname in results or hostname in futures:
+                continue
+            result = self._submit(hostname)
+            if isinstance(result, list):
+                self.hits += 1
+                results[hostname] = result
+            else:
+                self.misses += 1
+                futures[hostname] = result
+        if futures:
+            done, _ = concurrent.futures.wait(futures.values(), timeout)
+            for hostname, future in futures.items():
+                results[hostname] = future.result() if future in done else []
+        return results
+
+    def stats(self):
+        return {
+            "cached": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefetched": self.prefetched,
+            "queries": self.queries,
+            "failures": self.failures,
+        }
+
+    def close(self):
+        if self.loop is None:
+            return
+        if self.transport is not None:
+            self.loop.call_soon_threadsafe(self.transport.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop = None
+
+
+_resolver = None
+
+
+def get_resolver():
+    """返回进程内共享的解析器（懒加载，进程退出时关闭）"""
+    global _resolver
+    if _resolver is None:
+        _resolver = Resolver()
+        atexit.register(_resolver.close)
+    return _resolver
+
+
+def prefetch_urls(urls):
+    get_resolver().prefetch(hostname_of(url) for url in urls)
+
+
+def resolve_hosts(urls, hostnames=()):
+    """任务 sidecar 中的 dns：URL 和浏览器实际请求过的主机名 -> 地址列表"""
+    names = {hostname_of(url).lower() for url in urls} | {hostname.lower() for hostname in hostnames}
+    results = get_resolver().lookup(sorted(names))
+    return {hostname: results.get(hostname, []) for hostname in sorted(names)}
+
+
+if __name__ == "__main__":
+    # 对本地测试 DNS 服务：python -m benchmark.dnsstub --port 5300 "*=127.0.0.1" &
+    # python -m spider.resolver --nameserver 127.0.0.1:5300 a.test b.test c.test
+    parser = argparse.ArgumentParser(description="解析主机名，比较预取前后的耗时")
+    parser.add_argument("hostnames", nargs="+")
+    parser.add_argument("--nameserver", help="覆盖 [dns] nameserver，system 表示系统解析")
+    args = parser.parse_args()
+
+    resolver = Resolver(nameserver=args.nameserver) if args.nameserver else get_resolver()
+    begin = time.perf_counter()
+    resolver.prefetch(args.hostnames)
+    results = resolver.lookup(args.hostnames)
+    cold = time.perf_counter() - begin
+    begin = time.perf_counter()
+    resolver.lookup(args.hostnames)
+    warm = time.perf_counter() - begin
+    for hostname, ips in results.items():
+        print(f"{hostname:<40} {' '.join(ips) or '-'}")
+    print(f"cold {cold * 1000:.1f} ms, cached {warm * 1000:.3f} ms, {resolver.stats()}")
+    resolver.close()
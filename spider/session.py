@@ -0,0 +1,158 @@
+import argparse
+import io
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from config.config import config
+from config.logger import logger
+from spider.afpacket import AfPacketCapture
+from spider.metrics import phase, tshark_drops
+from spider.profiles import load_profile
+from spider.resolver import prefetch_urls
+from spider.spider import SequentialSpider
+from spider.supervisor import get_supervisor
+from utils.pcap import PcapReader
+from utils.session import SessionWriter
+
+# 单个 URL 的最长抓包时间（秒），会话的截止时间按 URL 数放大
+TASK_DEADLINE = config.getint("supervisor", "task_deadline", fallback=300)
+
+
+class SessionCapture:
+    """
+    会话模式：一个抓包进程（或 AF_PACKET 引擎）覆盖一批 URL，输出一个带标记块的 pcapng。
+    tshark 以 pcap 格式输出到标准输出，由线程转写为 pcapng 并按时间插入每个 URL 的标记；
+    sink 可以是文件路径、压缩写入器或分片上传器。
+    """
+
+    def __init__(self, interface, sink, capture_filter, urls=1):
+        self.interface = interface
+        self.capture_filter = capture_filter
+        self.backend = config.get("spider", "capture_backend", fallback="tshark")
+        self.profile = load_profile()
+        self.truncator = self.profile.truncator()
+        self.session = SessionWriter(sink)
+        self.deadline = TASK_DEADLINE * max(urls, 1)
+        self.engine = None
+        self.process = None
+        self.stderr = None
+        self.thread = None
+        self.drops = 0
+
+    def _read_output(self):
+        try:
+            reader = PcapReader(io.BufferedReader(self.process.stdout, 65536))
+            self.session.open(reader.linktype, reader.snaplen, reader.nanosecond)
+            truncator = self.truncator
+            for record in reader:
+                self.session.write(truncator(record) if truncator else record)
+        except Exception as e:
+            logger.error(f"读取 tshark 输出失败: {e}")
+
+    def start(self):
+        if self.backend == "afpacket":
+            try:
+                options = self.profile.afpacket_options()
+                self.engine = AfPacketCapture(self.interface, None, self.capture_filter,
+                                              writer_factory=lambda linktype, snaplen: self.session.open(linktype, snaplen),
+                                              **options)
+                return self.engine.start()
+            except Exception as e:
+                logger.error(f"启动 AF_PACKET 抓包失败: {e}")
+                return False
+
+        cmd = ["tshark", "-i", self.interface, "-F", "pcap", "-w", "-", "-f", self.capture_filter]
+        cmd += self.profile.tshark_options()
+        try:
+            logger.info(f"启动会话抓包: {' '.join(cmd)}")
+            self.stderr = tempfile.TemporaryFile()
+            self.process = get_supervisor().spawn(cmd, "tshark", deadline=self.deadline,
+                                                  stdout=subprocess.PIPE, stderr=self.stderr, bufsize=0)
+            self.thread = threading.Thread(target=self._read_output, daemon=True)
+            self.thread.start()
+            return True
+        except Exception as e:
+            logger.error(f"启动 tshark 失败: {e}")
+            return False
+
+    def mark(self, event, **fields):
+        self.session.mark(event, time.time(), **fields)
+
+    def stop(self):
+        """停止抓包并写完所有标记，返回索引"""
+        if self.engine is not None:
+            # 引擎停止时关闭写入器，剩余标记随之写入
+            self.drops = self.engine.stop().get("drops", 0)
+            self.engine = None
+            return self.session.index()
+        if self.process is not None:
+            get_supervisor().terminate(self.process, signal.SIGINT, timeout=10)
+            self.thread.join(timeout=5)
+            if self.thread.is_alive():
+                logger.warning("会话抓包线程未及时结束")
+            self.process.stdout.close()
+            self.stderr.seek(0)
+            self.drops = tshark_drops(self.stderr.read().decode(errors="replace"))
+            self.stderr.close()
+            self.process = None
+        self.session.close()
+        return self.session.index()
+
+
+def crawl(capture, urls, names, index, monitor=None):
+    """
+    依次访问每个 URL，前后各记一个标记；每个 URL 使用独立的浏览器上下文（冷缓存）。
+    返回浏览器实际请求过的全部主机名和请求记录。
+    """
+    hostnames = set()
+    requests = []
+    for i, (url, name) in enumerate(zip(urls, names)):
+        capture.mark("start", url=url, name=name, index=index + i)
+        spider = SequentialSpider([url], stop_condition=monitor)
+        try:
+            with phase("spider"):
+                spider.scrape()
+        except Exception as e:
+            logger.error(f"爬虫异常 {url}: {e}")
+        finally:
+            hostnames.update(spider.hostnames)
+            requests.extend(spider.requests)
+            capture.mark("end", url=url, name=name, index=index + i)
+    return hostnames, requests
+
+
+def batches(urls, names, size, repeat=1, start=0):
+    """把 URL 列表切成会话，返回 (urls, names, index)；重复采集时同一 URL 出现在不同会话中"""
+    for r in range(repeat):
+        for begin in range(0, len(urls), size):
+            yield urls[begin:begin + size], names[begin:begin + size], start + r * len(urls) + begin
+
+
+if __name__ == "__main__":
+    # python -m spider.session config/top_1000.txt --mode local --size 20 --repeat 10
+    parser = argparse.ArgumentParser(description="会话模式：每个抓包覆盖一批 URL，输出带标记块的 pcapng")
+    parser.add_argument("urls", help="每行一个域名或 URL")
+    parser.add_argument("--mode", choices=["local", "minio"], default="local")
+    parser.add_argument("--size", type=int, default=config.getint("spider", "session_size", fallback=20))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--start", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.mode == "local":
+        from spider.capture_local import main_session
+    else:
+        from spider.capture_minio import main_session
+
+    get_supervisor()  # 在主线程中注册 SIGCHLD
+    with open(args.urls, encoding="utf-8") as f:
+        lines = [line.split("\t")[0].strip() for line in f if line.strip()]
+    urls = [line if "://" in line else "https://" + line for line in lines]
+    names = [line.split("://")[-1].replace("/", "_") for line in lines]
+    sessions = list(batches(urls, names, args.size, args.repeat, args.start))
+    for i, (batch_urls, batch_names, index) in enumerate(sessions):
+        if i + 1 < len(sessions):
+            prefetch_urls(sessions[i + 1][0])  # 下一个会话的过滤器需要解析全部 URL
+        main_session(batch_urls, batch_names, index)
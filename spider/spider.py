@@ -1,43 +1,501 @@
+import asyncio
+import atexit
+import threading
+from urllib.parse import urlparse
+
+import psutil
+from playwright.async_api import async_playwright
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 
 from config.config import config
 from config.logger import logger
+from spider.metrics import get_metrics, phase
+from spider.supervisor import BROWSER_PROCESS_NAMES, get_supervisor
+
+# 记录每个请求的 URL、类型、服务器地址和时间，写入 sidecar，供 utils.flowindex 把流对应到 URL
+RECORD_REQUESTS = config.getboolean('spider', 'record_requests', fallback=True)
+
+
+def request_record(request, response=None, server=None, failure=None):
+    """
+    把一个已结束的请求整理成 sidecar 中的记录；时间为 Unix 秒，
+    document 表示主框架的导航请求（页面主文档）。
+    """
+    timing = request.timing or {}
+    start = timing.get("startTime", -1)
+    record = {"url": request.url, "method": request.method, "type": request.resource_type,
+              "start": round(start / 1000, 6) if start > 0 else None, "end": None,
+              "status": response.status if response is not None else None,
+              "ip": server["ipAddress"] if server else None, "port": server["port"] if server else None}
+    if start > 0 and timing.get("responseEnd", -1) >= 0:
+        record["end"] = round((start + timing["responseEnd"]) / 1000, 6)
+    if start > 0 and timing.get("connectStart", -1) >= 0:
+        # 新建连接的时间，复用已有连接时没有
+        record["connect"] = round((start + timing["connectStart"]) / 1000, 6)
+    try:
+        record["document"] = request.is_navigation_request() and request.frame.parent_frame is None
+    except Exception:
+        record["document"] = False  # Service Worker 的请求没有所属框架
+    if failure:
+        record["failure"] = failure
+    return record
+
+
+class BrowserPool:
+    """
+    长驻 Chromium 浏览器池。
+
+    浏览器在多个任务之间复用，每个任务分配一个全新的 BrowserContext，
+    保证缓存/Cookie 隔离；浏览器处理 max_tasks 个任务或内存超过
+    max_memory_mb 后会被回收重启。sync_playwright 绑定创建它的线程，
+    因此同一个池只能在一个线程中使用。
+    """
+
+    def __init__(self,
+                 max_tasks=config.getint('spider', 'browser_max_tasks', fallback=200),
+                 max_memory_mb=config.getint('spider', 'browser_max_memory_mb', fallback=2048),
+                 headless=True):
+        self.max_tasks = max_tasks
+        self.max_memory_mb = max_memory_mb
+        self.headless = headless
+        self._playwright = None
+        self._browser = None
+        self._browser_tasks = 0
+        self._browser_pids = []  # 当前浏览器的进程，关闭后交给监督器检查是否有残留
+
+        # 统计计数
+        self.launches = 0  # 浏览器启动次数
+        self.reuses = 0  # 复用已有浏览器的任务数
+        self.recycles = 0  # 因任务数/内存阈值回收的次数
+        self.tasks = 0  # 分配的任务（上下文）总数
+
+    def _launch(self):
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+        self._browser = self._playwright.chromium.launch(headless=self.headless)
+        self._browser_tasks = 0
+        self._browser_pids = [proc.pid for proc in self._browser_processes()]
+        self.launches += 1
+        logger.info(f"启动 Chromium（第 {self.launches} 次）")
+
+    @staticmethod
+    def _browser_processes():
+        """当前进程下所有 Chromium 子进程"""
+        procs = []
+        try:
+            for proc in psutil.Process().children(recursive=True):
+                try:
+                    if proc.name().lower().startswith(BROWSER_PROCESS_NAMES):
+                        procs.append(proc)
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+        except psutil.Error as e:
+            logger.debug(f"读取浏览器进程失败: {e}")
+        return procs
+
+    def _browser_memory_mb(self):
+        """统计当前进程下所有 Chromium 子进程的 RSS 总和，顺便刷新进程列表（渲染进程是按需启动的）"""
+        total = 0
+        procs = self._browser_processes()
+        self._browser_pids = [proc.pid for proc in procs]
+        for proc in procs:
+            try:
+                total += proc.memory_info().rss
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+        return total / (1024 * 1024)
+
+    def _should_recycle(self):
+        if self.max_tasks and self._browser_tasks >= self.max_tasks:
+            logger.info(f"浏览器已处理 {self._browser_tasks} 个任务，回收重启")
+            return True
+        if self.max_memory_mb:
+            memory = self._browser_memory_mb()
+            if memory > self.max_memory_mb:
+                logger.info(f"浏览器内存 {memory:.0f}MB 超过阈值 {self.max_memory_mb}MB，回收重启")
+                return True
+        return False
+
+    def _close_browser(self):
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except Exception as e:
+                logger.warning(f"关闭浏览器失败: {e}")
+            self._browser = None
+            # 只检查这个浏览器启动时的进程，不扫描整个系统
+            get_supervisor().sweep(self._browser_pids, "Chromium")
+            self._browser_pids = []
+
+    def recycle(self):
+        """关闭当前浏览器，下一个任务会重新启动"""
+        self._close_browser()
+        self.recycles += 1
+
+    def new_context(self, **kwargs):
+        """为一个任务创建全新的 BrowserContext，必要时启动或回收浏览器"""
+        if self._browser is not None and (not self._browser.is_connected() or self._should_recycle()):
+            self.recycle()
+        if self._browser is None:
+            self._launch()
+        else:
+            self.reuses += 1
+        self._browser_tasks += 1
+        self.tasks += 1
+        return self._browser.new_context(**kwargs)
+
+    def close(self):
+        self._close_browser()
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception as e:
+                logger.warning(f"停止 playwright 失败: {e}")
+            self._playwright = None
+
+    def stats(self):
+        return {
+            "launches": self.launches,
+            "reuses": self.reuses,
+            "recycles": self.recycles,
+            "tasks": self.tasks,
+        }
+
+
+_browser_pool = None
+
+
+def get_browser_pool():
+    """返回进程内共享的浏览器池（懒加载，进程退出时关闭）"""
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = BrowserPool()
+        atexit.register(_browser_pool.close)
+    return _browser_pool
 
 
 class SequentialSpider:
-    def __init__(self, urls, timeout=int(config['spider']['page_timeout'])):
+    def __init__(self, urls, timeout=int(config['spider']['page_timeout']), pool=None, stop_condition=None,
+                 poll_interval=250):
         self.urls = urls
         self.timeout = timeout
+        if pool is None and config.getboolean('spider', 'browser_pool', fallback=True):
+            pool = get_browser_pool()
+        self.pool = pool
+        self.hostnames = set()  # 本次任务中浏览器实际请求过的主机名
+        self.requests = []  # 已结束请求的记录，见 request_record()
+        # 可选的结束条件（如 QuiescenceMonitor）：导航提交后每 poll_interval 毫秒检查一次，
+        # 返回 True 时结束当前页面，不再等待 wait_until
+        self.stop_condition = stop_condition
+        self.poll_interval = poll_interval
+
+    def _on_request(self, request):
+        hostname = urlparse(request.url).hostname
+        if hostname:
+            self.hostnames.add(hostname)
+
+    def _on_request_finished(self, request):
+        try:
+            response = request.response()
+            server = response.server_addr() if response is not None else None
+        except Exception:
+            response = server = None  # 页面已关闭
+        self.requests.append(request_record(request, response, server))
+
+    def _on_request_failed(self, request):
+        self.requests.append(request_record(request, failure=request.failure))
+
+    def _visit(self, context):
+        context.set_default_navigation_timeout(self.timeout)
+        context.on("request", self._on_request)
+        if RECORD_REQUESTS:
+            context.on("requestfinished", self._on_request_finished)
+            context.on("requestfailed", self._on_request_failed)
+        for i, url in enumerate(self.urls):
+            page = None  # 初始化 page 为 None
+            try:
+                logger.info(f"{i} - Scraping {url}...")
+                with phase("new_page"):
+                    page = context.new_page()  # 创建新页面
+                page.set_extra_http_headers(
+                    {
+                        "Cache-Control": "no-cache, no-store, must-revalidate",
+                        "Pragma": "no-cache",
+                        "Expires": "0",
+                    }
+                )
+                if self.stop_condition is None:
+                    with phase("goto"):
+                        page.goto(url, timeout=self.timeout, wait_until=config['spider']['wait_until'])
+                else:
+                    self.stop_condition.reset(url)
+                    with phase("goto"):
+                        page.goto(url, timeout=self.timeout, wait_until="commit")
+                    with phase("settle"):
+                        while not self.stop_condition():
+                            page.wait_for_timeout(self.poll_interval)
+                content = page.content()
+                logger.info(f"Success accessing: {url}")
+            except PlaywrightTimeoutError:
+                logger.warning(f"Timeout while loading {url}. Skipping...")
+                get_metrics().count("traffic_page_timeouts_total", "timeouts")
+            except Exception as e:
+                logger.error(f"Error scraping {url}: {e}", exc_info=True)  # 记录完整的异常信息
+                get_metrics().count("traffic_page_errors_total", "errors")
+            finally:
+                if page:
+                    with phase("page_close"):
+                        page.close()
+                logger.debug(f"Finished processing {url}")
 
     def scrape(self):
         """
         Perform sequential scraping of the given URLs.
         """
+        if self.pool is not None:
+            # 复用池中的浏览器，每个任务使用独立的上下文（冷缓存）；必要时包含启动/回收浏览器的时间
+            with phase("browser_context"):
+                context = self.pool.new_context(ignore_https_errors=True)
+            try:
+                self._visit(context)
+            finally:
+                with phase("context_close"):
+                    context.close()
+            return
+
         with sync_playwright() as p:
-            with p.chromium.launch(headless=True) as browser:  # 确保浏览器正确关闭
+            with phase("browser_launch"):
+                browser = p.chromium.launch(headless=True)
+            with browser:  # 确保浏览器正确关闭
                 with browser.new_context(ignore_https_errors=True) as context:  # 确保上下文正确关闭
-                    context.set_default_navigation_timeout(self.timeout)
-                    for i, url in enumerate(self.urls):
-                        page = None  # 初始化 page 为 None
-                        try:
-                            logger.info(f"{i} - Scraping {url}...")
-                            page = context.new_page()  # 创建新页面
-                            page.set_extra_http_headers(
-                                {
-                                    "Cache-Control": "no-cache, no-store, must-revalidate",
-                                    "Pragma": "no-cache",
-                                    "Expires": "0",
-                                }
-                            )
-                            page.goto(url, timeout=self.timeout, wait_until=config['spider']['wait_until'])
-                            content = page.content()
-                            page.close()
-                            logger.info(f"Success accessing: {url}")
-                        except PlaywrightTimeoutError:
-                            logger.warning(f"Timeout while loading {url}. Skipping...")
-                        except Exception as e:
-                            logger.error(f"Error scraping {url}: {e}", exc_info=True)  # 记录完整的异常信息
-                        finally:
-                            context.close()
-                            browser.close()
-                            logger.debug(f"Finished processing {url}")
+                    self._visit(context)
+
+
+class AsyncBrowserPool(BrowserPool):
+    """
+    BrowserPool 的异步版本，供 AsyncSpider 使用。
+
+    async_playwright 运行在池自己的事件循环线程中（sync_playwright 所在的线程里
+    不能再运行 asyncio 事件循环），run() 把协程提交到该线程并等待结果。
+    回收策略和统计与 BrowserPool 相同。
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.loop = None
+        self.thread = None
+
+    def run(self, coro):
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="async-browser", daemon=True)
+            self.thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _launch(self):
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=self.headless)
+        self._browser_tasks = 0
+        self._browser_pids = [proc.pid for proc in self._browser_processes()]
+        self.launches += 1
+        logger.info(f"启动 Chromium（异步，第 {self.launches} 次）")
+
+    async def _close_browser(self):
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception as e:
+                logger.warning(f"关闭浏览器失败: {e}")
+            self._browser = None
+            get_supervisor().sweep(self._browser_pids, "Chromium")
+            self._browser_pids = []
+
+    async def recycle(self):
+        await self._close_browser()
+        self.recycles += 1
+
+    async def new_context(self, **kwargs):
+        if self._browser is not None and (not self._browser.is_connected() or self._should_recycle()):
+            await self.recycle()
+        if self._browser is None:
+            await self._launch()
+        else:
+            self.reuses += 1
+        self._browser_tasks += 1
+        self.tasks += 1
+        return await self._browser.new_context(**kwargs)
+
+    async def _close(self):
+        await self._close_browser()
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception as e:
+                logger.warning(f"停止 playwright 失败: {e}")
+            self._playwright = None
+
+    def close(self):
+        if self.loop is None:
+            return
+        self.run(self._close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+        self.loop.close()
+        self.loop = None
+
+
+_async_browser_pool = None
+
+
+def get_async_browser_pool():
+    """返回进程内共享的异步浏览器池（懒加载，进程退出时关闭）"""
+    global _async_browser_pool
+    if _async_browser_pool is None:
+        _async_browser_pool = AsyncBrowserPool()
+        atexit.register(_async_browser_pool.close)
+    return _async_browser_pool
+
+
+class AsyncSpider:
+    """
+    SequentialSpider 的异步版本：同一个上下文中最多 concurrency 个页面同时加载，
+    适合同一组织的多个 URL 一起采集。每个页面最长 page_deadline 秒，超时后取消并关闭页面。
+    scrape()、hostnames 和 requests 与 SequentialSpider 相同。
+
+    使用 stop_condition（QuiescenceMonitor）时，网卡流量无法区分页面：每个页面导航提交时
+    重新计时，网卡安静后所有页面一起结束。并发页面的阶段耗时会累加，可能大于任务时长。
+    """
+
+    def __init__(self, urls, timeout=int(config['spider']['page_timeout']), pool=None, stop_condition=None,
+                 poll_interval=250, concurrency=config.getint('spider', 'async_concurrency', fallback=4),
+                 page_deadline=config.getfloat('spider', 'page_deadline', fallback=0)):
+        self.urls = urls
+        self.timeout = timeout
+        self.pool = pool
+        self.hostnames = set()
+        self.requests = []
+        self._pending = []  # 正在读取服务器地址的请求
+        self.stop_condition = stop_condition
+        self.poll_interval = poll_interval
+        self.concurrency = max(1, concurrency)
+        # 默认为导航超时的两倍，覆盖导航之后的等待
+        self.page_deadline = page_deadline or timeout / 1000 * 2
+        self._settler = None
+
+    def _on_request(self, request):
+        hostname = urlparse(request.url).hostname
+        if hostname:
+            self.hostnames.add(hostname)
+
+    async def _describe(self, request):
+        try:
+            response = await request.response()
+            server = await response.server_addr() if response is not None else None
+        except Exception:
+            response = server = None
+        self.requests.append(request_record(request, response, server))
+
+    def _on_request_finished(self, request):
+        self._pending.append(asyncio.ensure_future(self._describe(request)))
+
+    def _on_request_failed(self, request):
+        self.requests.append(request_record(request, failure=request.failure))
+
+    async def _settle(self):
+        while not self.stop_condition():
+            await asyncio.sleep(self.poll_interval / 1000)
+
+    def _wait_quiet(self):
+        """所有页面共用一个等待安静的任务，单个页面被取消时不影响其他页面"""
+        if self._settler is None or self._settler.done():
+            self._settler = asyncio.ensure_future(self._settle())
+        return asyncio.shield(self._settler)
+
+    async def _load(self, context, i, url):
+        page = None
+        try:
+            logger.info(f"{i} - Scraping {url}...")
+            with phase("new_page"):
+                page = await context.new_page()
+            await page.set_extra_http_headers(
+                {
+                    "Cache-Control": "no-cache, no-store, must-revalidate",
+                    "Pragma": "no-cache",
+                    "Expires": "0",
+                }
+            )
+            if self.stop_condition is None:
+                with phase("goto"):
+                    await page.goto(url, timeout=self.timeout, wait_until=config['spider']['wait_until'])
+            else:
+                with phase("goto"):
+                    await page.goto(url, timeout=self.timeout, wait_until="commit")
+                self.stop_condition.reset(url)
+                with phase("settle"):
+                    await self._wait_quiet()
+            await page.content()
+            logger.info(f"Success accessing: {url}")
+        finally:
+            if page:
+                with phase("page_close"):
+                    await page.close()
+            logger.debug(f"Finished processing {url}")
+
+    async def _visit_one(self, semaphore, context, i, url):
+        async with semaphore:
+            try:
+                await asyncio.wait_for(self._load(context, i, url), self.page_deadline)
+            except (PlaywrightTimeoutError, asyncio.TimeoutError):
+                logger.warning(f"Timeout while loading {url}. Skipping...")
+                get_metrics().count("traffic_page_timeouts_total", "timeouts")
+            except Exception as e:
+                logger.error(f"Error scraping {url}: {e}", exc_info=True)
+                get_metrics().count("traffic_page_errors_total", "errors")
+
+    async def _scrape(self, pool, task):
+        metrics = get_metrics()
+        metrics.bind_task(task)
+        try:
+            with phase("browser_context"):
+                context = await pool.new_context(ignore_https_errors=True)
+            try:
+                context.set_default_navigation_timeout(self.timeout)
+                context.on("request", self._on_request)
+                if RECORD_REQUESTS:
+                    context.on("requestfinished", self._on_request_finished)
+                    context.on("requestfailed", self._on_request_failed)
+                semaphore = asyncio.Semaphore(self.concurrency)
+                await asyncio.gather(*(self._visit_one(semaphore, context, i, url) for i, url in enumerate(self.urls)))
+            finally:
+                if self._settler is not None:
+                    self._settler.cancel()
+                if self._pending:
+                    await asyncio.gather(*self._pending, return_exceptions=True)
+                with phase("context_close"):
+                    await context.close()
+        finally:
+            metrics.bind_task(None)
+
+    def scrape(self):
+        """
+        Scrape the given URLs, up to `concurrency` pages at a time.
+        """
+        task = get_metrics().current_task()
+        if self.pool is not None or config.getboolean('spider', 'browser_pool', fallback=True):
+            pool = self.pool or get_async_browser_pool()
+            pool.run(self._scrape(pool, task))
+            return
+
+        pool = AsyncBrowserPool()
+        try:
+            pool.run(self._scrape(pool, task))
+        finally:
+            pool.close()
+
+
+def create_spider(urls, stop_condition=None):
+    """按 [spider] spider_engine 创建爬虫：sequential（默认）或 async"""
+    if config.get('spider', 'spider_engine', fallback='sequential') == 'async':
+        return AsyncSpider(urls, stop_condition=stop_condition)
+    return SequentialSpider(urls, stop_condition=stop_condition)
@@ -0,0 +1,293 @@
+import ctypes
+import ctypes.util
+import os
+import platform
+import signal
+import subprocess
+import threading
+import time
+
+import psutil
+
+from config.config import config
+from config.logger import logger
+
+PR_SET_CHILD_SUBREAPER = 36
+BROWSER_PROCESS_NAMES = ("chrome", "chromium", "headless_shell")
+
+
+class Child:
+    __slots__ = ("process", "name", "deadline", "memory_limit_mb", "killed")
+
+    def __init__(self, process, name, deadline, memory_limit_mb):
+        self.process = process
+        self.name = name
+        self.deadline = deadline
+        self.memory_limit_mb = memory_limit_mb
+        self.killed = None  # 被强制结束的原因
+
+
+class ProcessSupervisor:
+    """
+    统一管理采集相关的子进程（tshark、dumpcap）并跟踪 Chromium 进程。
+
+    每个子进程在独立的进程组中启动，结束时整组清理，不会误杀无关进程；
+    收到 SIGCHLD 后只检查自己登记过的子进程，另外回收被重新挂到本进程下的
+    浏览器僵尸进程（本进程为容器 PID 1 或 subreaper 时），不需要扫描全部进程。
+    后台线程负责执行每个子进程的截止时间和内存上限。
+    """
+
+    def __init__(self, interval=1.0,
+                 memory_limit_mb=config.getint("supervisor", "memory_limit_mb", fallback=0),
+                 grace=config.getfloat("supervisor", "grace", fallback=5.0)):
+        self.interval = interval
+        self.memory_limit_mb = memory_limit_mb  # 默认内存上限，0 表示不限制
+        self.grace = grace  # 发送终止信号后等待退出的秒数
+        self.is_windows = platform.system().lower() == "windows"
+        self.children = {}
+        self.groups = set()  # 启动过的进程组，组内残留进程被结束后挂到本进程下，需要回收
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+        self.spawned = 0
+        self.exited = 0
+        self.killed_deadline = 0
+        self.killed_memory = 0
+        self.forced = 0  # 终止信号无效、被 SIGKILL 的次数
+        self.leaked = 0  # 主进程结束后进程组中残留、被清理的进程数
+        self.orphans_reaped = 0  # 回收的挂到本进程下的僵尸进程数
+
+    def install(self):
+        """注册 SIGCHLD 并启动监控线程；SIGCHLD 只能在主线程注册，其他线程中退化为定时检查"""
+        if self.thread is not None:
+            return
+        if not self.is_windows:
+            self._set_subreaper()
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGCHLD, lambda signum, frame: self.wakeup.set())
+        self.thread = threading.Thread(target=self._watch, name="supervisor", daemon=True)
+        self.thread.start()
+
+    def _set_subreaper(self):
+        """成为 subreaper，Chromium 退出后遗留的孙进程会挂到本进程下，由本进程回收"""
+        if platform.system() != "Linux" or os.getpid() == 1:
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+        except (OSError, AttributeError) as e:
+            logger.debug(f"设置 subreaper 失败: {e}")
+
+    def spawn(self, cmd, name, deadline=None, memory_limit_mb=None, **kwargs):
+        """
+        在独立进程组中启动子进程并登记。
+        deadline 为最长运行秒数，超时或超过内存上限时整组结束。
+        """
+        if self.is_windows:
+            kwargs.setdefault("creationflags", subprocess.CREATE_NEW_PROCESS_GROUP)
+        else:
+            kwargs.setdefault("start_new_session", True)
+        process = subprocess.Popen(cmd, **kwargs)
+        child = Child(process, name, time.monotonic() + deadline if deadline else None,
+                      self.memory_limit_mb if memory_limit_mb is None else memory_limit_mb)
+        with self.lock:
+            self.children[process.pid] = child
+            self.groups.add(process.pid)
+            self.spawned += 1
+        logger.debug(f"启动子进程 {name}（PID {process.pid}）")
+        return process
+
+    def send_signal(self, process, sig):
+        """向子进程所在的进程组发送信号"""
+        if process.poll() is not None:
+            return
+        if self.is_windows:
+            process.send_signal(signal.CTRL_BREAK_EVENT if sig == signal.SIGINT else sig)
+            return
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self, process, sig=signal.SIGTERM, timeout=None):
+        """发送终止信号并等待退出，超时后 SIGKILL 整个进程组；返回退出码"""
+        timeout = self.grace if timeout is None else timeout
+        self.send_signal(process, sig)
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"PID {process.pid} 未在 {timeout}s 内退出，强制结束")
+            with self.lock:
+                self.forced += 1
+            self.send_signal(process, signal.SIGKILL if not self.is_windows else signal.SIGTERM)
+            process.kill()
+            process.wait()
+        self._on_exit(process.pid)
+        return process.returncode
+
+    def _kill_group(self, pid):
+        """清理主进程退出后进程组中的残留进程，返回是否有残留"""
+        if self.is_windows:
+            return False
+        try:
+            os.killpg(pid, 0)
+        except (ProcessLookupError, PermissionError):
+            return False
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def _on_exit(self, pid):
+        with self.lock:
+            child = self.children.pop(pid, None)
+            if child is None:
+                return
+            self.exited += 1
+        if self._kill_group(pid):
+            with self.lock:
+                self.leaked += 1
+            logger.warning(f"{child.name}（PID {pid}）退出后进程组仍有残留进程，已清理")
+
+    def reap(self):
+        """检查登记的子进程是否退出，并回收挂到本进程下的僵尸进程"""
+        with self.lock:
+            children = list(self.children.items())
+        for pid, child in children:
+            if hasattr(os, "waitid"):
+                try:
+                    # WNOWAIT 只查看状态，真正的回收交给 Popen，保证 returncode 正确
+                    if os.waitid(os.P_PID, pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is None:
+                        continue
+                except ChildProcessError:
+                    pass  # 已被 Popen.wait 回收
+            elif child.process.poll() is None:
+                continue
+            child.process.poll()
+            self._on_exit(pid)
+        self._reap_orphans()
+
+    def _reap_orphans(self):
+        if platform.system() != "Linux":
+            return
+        for pid in self._child_pids():
+            if pid in self.children:
+                continue
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            name = stat[stat.find("(") + 1:stat.rfind(")")]
+            state, _, pgrp = stat[stat.rfind(")") + 2:].split()[:3]
+            # 只回收浏览器和自己启动的进程组中的僵尸进程，其他子进程（如 Playwright 驱动）由各自的所有者回收
+            if state == "Z" and (name.lower().startswith(BROWSER_PROCESS_NAMES) or int(pgrp) in self.groups):
+                try:
+                    os.waitpid(pid, os.WNOHANG)
+                    with self.lock:
+                        self.orphans_reaped += 1
+                except ChildProcessError:
+                    pass
+
+    @staticmethod
+    def _child_pids():
+        """读取 /proc/self/task/*/children，只包含本进程的直接子进程"""
+        pids = []
+        try:
+            for tid in os.listdir("/proc/self/task"):
+                with open(f"/proc/self/task/{tid}/children") as f:
+                    pids.extend(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+        return pids
+
+    def _memory_mb(self, process):
+        try:
+            proc = psutil.Process(process.pid)
+            return sum(p.memory_info().rss for p in [proc] + proc.children(recursive=True)) / (1024 * 1024)
+        except psutil.Error:
+            return 0
+
+    def _enforce(self):
+        now = time.monotonic()
+        with self.lock:
+            children = [c for c in self.children.values() if c.killed is None]
+        for child in children:
+            if child.deadline is not None and now > child.deadline:
+                reason = "deadline"
+            elif child.memory_limit_mb and self._memory_mb(child.process) > child.memory_limit_mb:
+                reason = "memory"
+            else:
+                continue
+            child.killed = reason
+            with self.lock:
+                if reason == "deadline":
+                    self.killed_deadline += 1
+                else:
+                    self.killed_memory += 1
+            logger.warning(f"{child.name}（PID {child.process.pid}）超过{'截止时间' if reason == 'deadline' else '内存上限'}，结束进程组")
+            # 在线程中终止，避免阻塞监控循环
+            threading.Thread(target=self.terminate, args=(child.process,), daemon=True).start()
+
+    def _watch(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.reap()
+                self._enforce()
+            except Exception as e:
+                logger.warning(f"进程监控出错: {e}")
+
+    def sweep(self, pids, name):
+        """
+        清理本应已退出的外部进程（例如关闭后的 Chromium），
+        只检查给定的 PID，返回残留并被结束的进程数。
+        """
+        leftover = []
+        for pid in pids:
+            try:
+                proc = psutil.Process(pid)
+                if proc.status() != psutil.STATUS_ZOMBIE:
+                    leftover.append(proc)
+            except psutil.Error:
+                continue
+        for proc in leftover:
+            try:
+                proc.kill()
+            except psutil.Error:
+                pass
+        if leftover:
+            psutil.wait_procs(leftover, timeout=self.grace)
+            with self.lock:
+                self.leaked += len(leftover)
+            logger.warning(f"{name} 关闭后残留 {len(leftover)} 个进程，已清理")
+        self.wakeup.set()
+        return len(leftover)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "running": len(self.children),
+                "spawned": self.spawned,
+                "exited": self.exited,
+                "killed_deadline": self.killed_deadline,
+                "killed_memory": self.killed_memory,
+                "forced": self.forced,
+                "leaked": self.leaked,
+                "orphans_reaped": self.orphans_reaped,
+            }
+
+
+_supervisor = None
+
+
+def get_supervisor():
+    """返回进程内共享的监督器，首次调用时注册 SIGCHLD 并启动监控线程"""
+    global _supervisor
+    if _supervisor is None:
+        _supervisor = ProcessSupervisor()
+        _supervisor.install()
+    return _supervisor
@@ -0,0 +1,203 @@
+import argparse
+import gzip
+import io
+import os
+import shutil
+import zlib
+
+from config.config import config
+from config.logger import logger
+
+try:
+    import zstandard  # 可选依赖，zstd 压缩比和速度都优于 gzip
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+# 默认压缩级别：gzip 6 为 zlib 默认值，zstd 3 为 zstd 默认值，都能跟上抓包速率
+DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+_warned = False
+
+
+def capture_compression():
+    """[capture] compression 配置的压缩方式：none、gzip 或 zstd；没有安装 zstandard 时退回 gzip"""
+    global _warned
+    method = config.get("capture", "compression", fallback="none").strip().lower()
+    if method in ("", "none", "off", "false"):
+        return None
+    if method not in EXTENSIONS:
+        raise ValueError(f"不支持的压缩方式: {method}")
+    if method == "zstd" and zstandard is None:
+        if not _warned:
+            logger.warning("zstd 压缩需要安装 zstandard，改用 gzip")
+            _warned = True
+        return "gzip"
+    return method
+
+
+def _level(method, level):
+    if level is None:
+        level = config.getint("capture", "compression_level", fallback=0) or DEFAULT_LEVELS[method]
+    return level
+
+
+def compressed_name(name, method):
+    """在文件名后追加压缩扩展名，例如 x.pcap -> x.pcap.zst"""
+    return name + EXTENSIONS[method] if method else name
+
+
+def strip_compression(name):
+    """去掉压缩扩展名，例如 x.pcap.gz -> x.pcap"""
+    for extension in EXTENSIONS.values():
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def sidecar_name(name):
+    """与 pcap 同名的 .json，压缩文件 x.pcap.zst 对应 x.json"""
+    return os.path.splitext(strip_compression(name))[0] + ".json"
+
+
+def is_capture_file(name):
+    """是否为 pcap/pcapng 文件（含压缩后的文件）"""
+    return strip_compression(name).endswith((".pcap", ".pcapng"))
+
+
+class StreamCompressor:
+    """
+    分块压缩：compress() 返回已可输出的压缩数据，flush() 返回剩余数据并结束压缩流。
+    用于边采集边上传，每个分片只包含已完成压缩的字节。
+    """
+
+    def __init__(self, method, level=None):
+        self.method = method
+        level = _level(method, level)
+        if method == "gzip":
+            # wbits=31 输出带 gzip 头和 CRC 的数据，可以直接 gunzip
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        else:
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def flush(self):
+        return self.compressor.flush()
+
+
+class CompressedWriter:
+    """
+    把写入的数据压缩后写到文件路径或任意带 write() 的二进制对象。
+    实现 write()/close()，可以替代抓包引擎和 tshark 管道的输出。
+    """
+
+    def __init__(self, sink, method, level=None):
+        if hasattr(sink, "write"):
+            self.file, self._owns_file = sink, False
+        else:
+            self.file, self._owns_file = open(sink, "wb"), True
+        self.compressor = StreamCompressor(method, level)
+        self.raw_bytes = 0  # 压缩前的字节数
+        self.closed = False
+
+    def write(self, data):
+        self.raw_bytes += len(data)
+        out = self.compressor.compress(data)
+        if out:
+            self.file.write(out)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        tail = self.compressor.flush()
+        if tail:
+            self.file.write(tail)
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def detect(header):
+    """根据文件头识别压缩方式，未压缩时返回 None"""
+    if header.startswith(GZIP_MAGIC):
+        return "gzip"
+    if header.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def open_compressed(path):
+    """打开文件用于读取，gzip/zstd 压缩的文件透明解压（按文件头识别，不依赖扩展名）"""
+    with open(path, "rb") as f:
+        method = detect(f.read(4))
+    if method == "gzip":
+        return gzip.open(path, "rb")
+    if method == "zstd":
+        if zstandard is None:
+            raise ImportError(f"读取 {path} 需要安装 zstandard")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.BufferedReader(reader, 1024 * 1024)  # 解析器按记录小块读取，加一层缓冲
+    return open(path, "rb")
+
+
+def decompress_file(path, output=None):
+    """解压到 output（默认去掉压缩扩展名），返回输出路径"""
+    output = output or strip_compression(path)
+    if output == path:
+        output = path + ".raw"
+    tmp = output + ".part"
+    with open_compressed(path) as src, open(tmp, "wb") as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp, output)
+    return output
+
+
+def compress_file(path, method, level=None, output=None):
+    """压缩已有文件，返回输出路径，原文件保留"""
+    output = output or compressed_name(path, method)
+    tmp = output + ".part"
+    with open(path, "rb") as src, CompressedWriter(tmp, method, level) as dst:
+        for chunk in iter(lambda: src.read(1024 * 1024), b""):
+            dst.write(chunk)
+    os.replace(tmp, output)
+    return output
+
+
+if __name__ == "__main__":
+    # 批量压缩/解压已有文件，替代 tar -cJvf：
+    # python -m utils.compress compress /traffic/datas --method zstd --remove
+    parser = argparse.ArgumentParser(description="压缩或解压 pcap 文件")
+    parser.add_argument("command", choices=["compress", "decompress"])
+    parser.add_argument("paths", nargs="+", help="文件或目录")
+    parser.add_argument("--method", choices=list(EXTENSIONS), default="zstd" if zstandard else "gzip")
+    parser.add_argument("--level", type=int)
+    parser.add_argument("--remove", action="store_true", help="完成后删除源文件")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(entry.path for entry in os.scandir(path) if entry.is_file() and is_capture_file(entry.name))
+        else:
+            files.append(path)
+    for path in files:
+        compressed = strip_compression(path) != path
+        if args.command == "compress" and not compressed:
+            output = compress_file(path, args.method, args.level)
+        elif args.command == "decompress" and compressed:
+            output = decompress_file(path)
+        else:
+            continue
+        print(f"{path} ({os.path.getsize(path)}) -> {output} ({os.path.getsize(output)})")
+        if args.remove:
+            os.remove(path)
@@ -0,0 +1,135 @@
+import socket
+import struct
+
+# DNS 报文编解码（RFC 1035），只实现解析 A/AAAA/CNAME 所需的部分
+TYPE_A = 1
+TYPE_CNAME = 5
+TYPE_AAAA = 28
+CLASS_IN = 1
+FLAG_QR = 0x8000
+FLAG_RD = 0x0100
+FLAG_RA = 0x0080
+FLAG_TC = 0x0200
+RCODE_NXDOMAIN = 3
+
+HEADER = struct.Struct(">HHHHHH")
+RR_FIXED = struct.Struct(">HHIH")
+
+
+class DnsMessage:
+    def __init__(self, id, flags, questions, answers):
+        self.id = id
+        self.flags = flags
+        self.questions = questions  # [(name, type)]
+        self.answers = answers  # [(name, type, ttl, value)]
+
+    @property
+    def rcode(self):
+        return self.flags & 0x000F
+
+    @property
+    def truncated(self):
+        return bool(self.flags & FLAG_TC)
+
+    def addresses(self, name):
+        """沿 CNAME 链取出 name 的地址，返回 (地址列表, 链上记录的最小 TTL)"""
+        name = name.lower().rstrip(".")
+        ips, ttls = [], []
+        seen = set()
+        while name not in seen:
+            seen.add(name)
+            target = None
+            for owner, rtype, ttl, value in self.answers:
+                if owner != name:
+                    continue
+                if rtype in (TYPE_A, TYPE_AAAA):
+                    ips.append(value)
+                    ttls.append(ttl)
+                elif rtype == TYPE_CNAME:
+                    target = value
+                    ttls.append(ttl)
+            if ips or target is None:
+                break
+            name = target
+        return ips, min(ttls) if ttls else None
+
+
+def encode_name(name):
+    out = bytearray()
+    for label in name.rstrip(".").split("."):
+        encoded = label.encode("idna")
+        if not 0 < len(encoded) < 64:
+            raise ValueError(f"无效的域名: {name}")
+        out.append(len(encoded))
+        out += encoded
+    out.append(0)
+    return bytes(out)
+
+
+def _read_name(data, offset):
+    """读取（可能压缩的）域名，返回 (域名, 域名之后的偏移)"""
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 32:
+                raise ValueError("域名压缩指针循环")
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(data[offset:offset + length].decode("ascii", errors="replace").lower())
+        offset += length
+    return ".".join(labels), end if end is not None else offset
+
+
+def build_query(id, name, rtype):
+    return HEADER.pack(id, FLAG_RD, 1, 0, 0, 0) + encode_name(name) + struct.pack(">HH", rtype, CLASS_IN)
+
+
+def build_response(query, answers, rcode=0):
+    """按查询构造应答，answers 为 [(name, type, ttl, value)]，供测试用的 DNS 服务使用"""
+    out = bytearray(HEADER.pack(query.id, FLAG_QR | FLAG_RD | FLAG_RA | rcode,
+                                len(query.questions), len(answers), 0, 0))
+    for name, rtype in query.questions:
+        out += encode_name(name) + struct.pack(">HH", rtype, CLASS_IN)
+    for name, rtype, ttl, value in answers:
+        if rtype == TYPE_A:
+            rdata = socket.inet_pton(socket.AF_INET, value)
+        elif rtype == TYPE_AAAA:
+            rdata = socket.inet_pton(socket.AF_INET6, value)
+        else:
+            rdata = encode_name(value)
+        out += encode_name(name) + RR_FIXED.pack(rtype, CLASS_IN, ttl, len(rdata)) + rdata
+    return bytes(out)
+
+
+def parse_message(data):
+    id, flags, qdcount, ancount, _, _ = HEADER.unpack_from(data)
+    offset = HEADER.size
+    questions = []
+    for _ in range(qdcount):
+        name, offset = _read_name(data, offset)
+        rtype, _ = struct.unpack_from(">HH", data, offset)
+        offset += 4
+        questions.append((name, rtype))
+    answers = []
+    for _ in range(ancount):
+        name, offset = _read_name(data, offset)
+        rtype, rclass, ttl, rdlength = RR_FIXED.unpack_from(data, offset)
+        offset += RR_FIXED.size
+        rdata = data[offset:offset + rdlength]
+        if rclass == CLASS_IN and rtype == TYPE_A and rdlength == 4:
+            answers.append((name, rtype, ttl, socket.inet_ntop(socket.AF_INET, rdata)))
+        elif rclass == CLASS_IN and rtype == TYPE_AAAA and rdlength == 16:
+            answers.append((name, rtype, ttl, socket.inet_ntop(socket.AF_INET6, rdata)))
+        elif rtype == TYPE_CNAME:
+            answers.append((name, rtype, ttl, _read_name(data, offset)[0]))
+        offset += rdlength
+    return DnsMessage(id, flags, questions, answers)
@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import re
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from tqdm import tqdm
+
+from utils.flowtable import FlowTable, unpack_key
+from utils.pcap import IPPROTO_TCP, IPPROTO_UDP, decode_packet, open_pcap
+from utils.report import _scan
+
+DEFAULT_PACKETS = 20  # 每个流保留的前 N 个包
+DEFAULT_SHARD_FLOWS = 100000  # 每个分片最多的流数量
+
+# 采集端输出文件名：{index}_{org}_{ts}.pcap
+FILE_NAME_PATTERN = re.compile(r"^(\d+)_(.+)_(\d{14})\.pcap(?:ng)?(?:\.gz|\.zst)?$")
+
+# 矩阵列：形状为 (流数量, N)
+MATRIX_COLUMNS = ("sizes", "directions", "iats")
+# 标量列：形状为 (流数量,)
+SCALAR_COLUMNS = (
+    "file", "index", "label", "src", "sport", "dst", "dport", "proto", "sni",
+    "length", "packets", "bytes", "duration",
+)
+
+
+def parse_label(file_name):
+    """从文件名中解析 (index, org, ts)，不符合命名规则时返回 (-1, "", "")"""
+    match = FILE_NAME_PATTERN.match(os.path.basename(file_name))
+    if not match:
+        return -1, "", ""
+    return int(match.group(1)), match.group(2), match.group(3)
+
+
+def tls_sni(data, offset):
+    """从 TLS ClientHello 中取出 SNI，不是 ClientHello 或没有 SNI 时返回 None"""
+    # 记录头 5 字节（类型 0x16 = handshake），握手头 4 字节（类型 1 = ClientHello）
+    if len(data) < offset + 44 or data[offset] != 0x16 or data[offset + 5] != 0x01:
+        return None
+    try:
+        p = offset + 9 + 2 + 32  # 跳过 client_version 和 random
+        p += 1 + data[p]  # session_id
+        p += 2 + struct.unpack_from("!H", data, p)[0]  # cipher_suites
+        p += 1 + data[p]  # compression_methods
+        end = min(p + 2 + struct.unpack_from("!H", data, p)[0], len(data))
+        p += 2
+        while p + 4 <= end:
+            ext_type, ext_len = struct.unpack_from("!HH", data, p)
+            p += 4
+            if ext_type == 0:  # server_name：列表长度(2) + 类型(1) + 名称长度(2) + 名称
+                if data[p + 2] != 0:
+                    return None
+                name_len = struct.unpack_from("!H", data, p + 3)[0]
+                return data[p + 5:p + 5 + name_len].decode("ascii", "replace")
+            p += ext_len
+    except (IndexError, struct.error):
+        pass
+    return None
+
+
+def extract_flows(file_path, n_packets=DEFAULT_PACKETS):
+    """
+    提取一个 pcap 中每个流的特征，返回列名到 numpy 数组的字典。
+
+    读包时只把每个流的前 N 个包追加到平铺的 array 列中，
+    读完后再一次性用 numpy 按流重排成 (流数量, N) 的矩阵。
+    方向以流的第一个包为准：发起方为 1，响应方为 -1，填充位置为 0。
+    """
+    table = FlowTable()
+    seen = array("H")  # 每个流已保留的包数
+    initiator = array("B")  # 每个流第一个包的方向
+    rows, directions, sizes, times = array("I"), array("b"), array("I"), array("d")
+    sni = {}
+
+    with open_pcap(file_path) as reader:
+        for record in reader:
+            decoded = decode_packet(record.linktype, record.data)
+            if decoded is None:
+                continue
+            version, src, dst, proto, sport, dport, tcp_flags, payload_offset = decoded
+            if sport is None or proto not in (IPPROTO_TCP, IPPROTO_UDP):
+                continue
+            ts = reader.timestamp(record)
+            row, direction = table.add(ts, record.origlen, version, src, dst, proto, sport, dport, tcp_flags)
+            if row == len(seen):
+                seen.append(0)
+                initiator.append(direction)
+            if seen[row] >= n_packets:
+                continue
+            seen[row] += 1
+            rows.append(row)
+            directions.append(1 if direction == initiator[row] else -1)
+            sizes.append(record.origlen)
+            times.append(ts)
+            if proto == IPPROTO_TCP and row not in sni and len(record.data) > payload_offset:
+                name = tls_sni(record.data, payload_offset)
+                if name:
+                    sni[row] = name
+
+    flows = len(table)
+    row_idx = np.frombuffer(rows, dtype=np.uint32)
+    # 稳定排序保证同一个流内仍按到达顺序排列
+    order = np.argsort(row_idx, kind="stable")
+    row_idx = row_idx[order]
+    times_sorted = np.frombuffer(times, dtype=np.float64)[order]
+    starts = np.searchsorted(row_idx, np.arange(flows))
+    position = np.arange(len(row_idx)) - starts[row_idx]
+    first = position == 0
+
+    iat = np.diff(times_sorted, prepend=times_sorted[:1])
+    iat[first] = 0
+
+    features = {
+        "sizes": np.zeros((flows, n_packets), dtype=np.uint32),
+        "directions": np.zeros((flows, n_packets), dtype=np.int8),
+        "iats": np.zeros((flows, n_packets), dtype=np.float32),
+    }
+    features["sizes"][row_idx, position] = np.frombuffer(sizes, dtype=np.uint32)[order]
+    features["directions"][row_idx, position] = np.frombuffer(directions, dtype=np.int8)[order]
+    features["iats"][row_idx, position] = iat
+
+    # 五元组按发起方方向输出
+    endpoints = [unpack_key(key) for key in table.keys]
+    forward = [init == 0 for init in initiator]
+    index, label, _ = parse_label(file_path)
+    packets = np.frombuffer(table.packets, dtype=np.uint64).reshape(-1, 2).sum(axis=1)
+    total_bytes = np.frombuffer(table.bytes, dtype=np.uint64).reshape(-1, 2).sum(axis=1)
+    features.update({
+        "file": np.array([os.path.basename(file_path)] * flows, dtype=str),
+        "index": np.full(flows, index, dtype=np.int64),
+        "label": np.array([label] * flows, dtype=str),
+        "src": np.array([e[0] if f else e[2] for e, f in zip(endpoints, forward)], dtype=str),
+        "sport": np.array([e[1] if f else e[3] for e, f in zip(endpoints, forward)], dtype=np.uint16),
+        "dst": np.array([e[2] if f else e[0] for e, f in zip(endpoints, forward)], dtype=str),
+        "dport": np.array([e[3] if f else e[1] for e, f in zip(endpoints, forward)], dtype=np.uint16),
+        "proto": np.array([e[4] for e in endpoints], dtype=np.uint8),
+        "sni": np.array([sni.get(row, "") for row in range(flows)], dtype=str),
+        "length": np.frombuffer(seen, dtype=np.uint16).copy(),
+        "packets": packets,
+        "bytes": total_bytes,
+        "duration": np.frombuffer(table.last_seen, dtype=np.float64) - np.frombuffer(table.first_seen, dtype=np.float64),
+    })
+    return features
+
+
+def write_shard(batches, shard_dir, parquet=False):
+    """
+    把多个文件的特征拼接后写入一个分片目录，每列一个 .npy 文件，
+    可以用 load_shard 以内存映射方式读取；parquet=True 时额外写一份 Parquet。
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    columns = {}
+    for name in MATRIX_COLUMNS + SCALAR_COLUMNS:
+        columns[name] = np.concatenate([batch[name] for batch in batches])
+        np.save(os.path.join(shard_dir, f"{name}.npy"), columns[name])
+
+    if parquet:
+        import pandas as pd
+
+        frame = pd.DataFrame({name: columns[name] for name in SCALAR_COLUMNS})
+        for name in MATRIX_COLUMNS:
+            frame[name] = list(columns[name])
+        frame.to_parquet(shard_dir + ".parquet", index=False)
+    return len(columns["label"])
+
+
+def load_shard(shard_dir, mmap_mode="r"):
+    """以内存映射方式读取分片，返回列名到数组的字典"""
+    return {
+        name: np.load(os.path.join(shard_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+        for name in MATRIX_COLUMNS + SCALAR_COLUMNS
+    }
+
+
+def extract_folder(folder_path, output_dir, n_packets=DEFAULT_PACKETS, workers=os.cpu_count(),
+                   shard_flows=DEFAULT_SHARD_FLOWS, parquet=False):
+    """
+    多进程提取目录下所有 pcap 的流特征，按流数量切分为分片。
+    已处理的文件记录在 manifest.json 中，再次运行只处理新增或变化的文件。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, "manifest.json")
+    manifest = {"n_packets": n_packets, "files": {}, "shards": []}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["n_packets"] != n_packets:
+            raise ValueError(f"{output_dir} 中已有 N={manifest['n_packets']} 的特征")
+
+    todo = [(path, size, mtime) for path, size, mtime in _scan(folder_path)
+            if manifest["files"].get(os.path.basename(path)) != [size, mtime]]
+    print(f"{len(todo)} new or changed files, {len(manifest['files'])} done")
+    if not todo:
+        return
+
+    def flush(batches, files):
+        shard = f"shard-{len(manifest['shards']):05d}"
+        count = write_shard(batches, os.path.join(output_dir, shard), parquet)
+        manifest["shards"].append({"name": shard, "flows": count})
+        manifest["files"].update(files)
+        # 分片写完后再更新清单，中断时未落盘的文件下次会重新处理
+        tmp = manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_path)
+
+    batches, files, pending = [], {}, 0
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=sum(size for _, size, _ in todo), unit="B", unit_scale=True, desc="Extracting") as bar:
+        futures = {executor.submit(extract_flows, path, n_packets): (path, size, mtime) for path, size, mtime in todo}
+        for future in as_completed(futures):
+            path, size, mtime = futures[future]
+            bar.update(size)
+            try:
+                features = future.result()
+            except Exception as e:
+                print(f"Failed to extract {path}: {e}")
+                continue
+            batches.append(features)
+            files[os.path.basename(path)] = [size, mtime]
+            pending += len(features["label"])
+            if pending >= shard_flows:
+                flush(batches, files)
+                batches, files, pending = [], {}, 0
+    if batches:
+        flush(batches, files)
+    print(f"Extraction complete. {len(manifest['shards'])} shards in {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="提取每个流的前 N 个包特征，写入可内存映射的分片")
+    parser.add_argument("folder")
+    parser.add_argument("output")
+    parser.add_argument("-n", "--packets", type=int, default=DEFAULT_PACKETS)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--shard-flows", type=int, default=DEFAULT_SHARD_FLOWS)
+    parser.add_argument("--parquet", action="store_true", help="同时写入 Parquet（需要 pandas 和 pyarrow）")
+    args = parser.parse_args()
+    extract_folder(args.folder, args.output, args.packets, args.workers, args.shard_flows, args.parquet)
@@ -0,0 +1,217 @@
+import argparse
+import csv
+import ipaddress
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from utils.compress import sidecar_name, strip_compression
+from utils.flowtable import FlowTable
+from utils.pcap import IPPROTO_TCP, IPPROTO_UDP, decode_packet, open_pcap
+from utils.report import _scan
+
+# 流索引：pcap 中每个 TCP/UDP 流（客户端 -> 服务器方向）对应的请求 URL 和资源类型
+INDEX_COLUMNS = (
+    "proto", "src", "sport", "dst", "dport", "first_seen", "last_seen", "packets", "bytes",
+    "category", "host", "url", "type", "status", "requests", "types",
+)
+# 请求开始时间与流的时间范围比较时允许的误差（秒），浏览器与抓包的时钟来源不同
+SLACK = 1.0
+# 二级域名为这些时，注册域名取后三段（example.co.uk）
+SECOND_LEVEL = {"co", "com", "net", "org", "gov", "edu", "ac"}
+
+
+def index_name(path):
+    """与 pcap 同名的 .flows.csv，压缩文件 x.pcap.zst 对应 x.flows.csv"""
+    return os.path.splitext(strip_compression(path))[0] + ".flows.csv"
+
+
+def _site(host):
+    """近似的注册域名，用于区分第一方和第三方请求"""
+    labels = (host or "").lower().rstrip(".").split(".")
+    if len(labels) >= 3 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _normalize_ip(ip):
+    try:
+        return str(ipaddress.ip_address(ip.strip("[]")))
+    except (AttributeError, ValueError):
+        return None
+
+
+def _category(request, sites):
+    if request.get("document"):
+        return "document"
+    return "first-party" if _site(urlsplit(request["url"]).hostname) in sites else "third-party"
+
+
+def _pick_flow(candidates, flows, request, slack):
+    """
+    同一服务器可能有多个连接：请求新建了连接时取建立时间最接近的流，
+    复用连接时取请求开始时仍在传输的连接中最晚建立的一个。
+    """
+    connect, start = request.get("connect"), request.get("start")
+    if connect is not None:
+        row = min(candidates, key=lambda r: abs(flows[r]["first_seen"] - connect))
+        return row if abs(flows[row]["first_seen"] - connect) <= slack else None
+    if start is None:
+        return candidates[0]
+    best = None
+    for row in candidates:
+        flow = flows[row]
+        if flow["first_seen"] - slack <= start <= flow["last_seen"] + slack:
+            if best is None or flow["first_seen"] > flows[best]["first_seen"]:
+                best = row
+    return best
+
+
+def build_flow_index(path, sidecar=None, slack=SLACK):
+    """
+    把 sidecar 中的请求记录（spider.spider.request_record）按服务器 IP:端口和时间对应到
+    pcap 中的流，返回 (索引行列表, 已对应的请求数, 有服务器地址的请求数)。
+
+    category：document 为页面主文档，first-party/third-party 按注册域名区分其他请求，
+    没有对应请求的流为 dns 或 background（浏览器后台流量、缓存命中以外的其他连接），
+    host 取自请求 URL，或 sidecar 中 dns 的解析结果。
+    """
+    if sidecar is None:
+        sidecar = {}
+        if os.path.exists(sidecar_name(path)):
+            with open(sidecar_name(path), encoding="utf-8") as f:
+                sidecar = json.load(f)
+    sites = {_site(urlsplit(url).hostname) for url in sidecar.get("urls", [])}
+    names = {}  # IP -> 主机名
+    for host, ips in sidecar.get("dns", {}).items():
+        for ip in ips:
+            names.setdefault(_normalize_ip(ip), host)
+
+    table = FlowTable()
+    with open_pcap(path) as reader:
+        for record in reader:
+            decoded = decode_packet(record.linktype, record.data)
+            if decoded is None:
+                continue
+            version, src, dst, proto, sport, dport, tcp_flags, _ = decoded
+            if sport is None or proto not in (IPPROTO_TCP, IPPROTO_UDP):
+                continue
+            table.add(reader.timestamp(record), record.origlen, version, src, dst, proto, sport, dport, tcp_flags)
+    flows = list(table.iter_flows())
+
+    servers = {}  # (IP, 端口) -> 流的行号
+    for row, flow in enumerate(flows):
+        servers.setdefault((flow["dst"], flow["dport"]), []).append(row)
+        servers.setdefault((flow["src"], flow["sport"]), []).append(row)
+
+    assigned = {}  # 行号 -> [(请求, 服务器一端)]
+    total = matched = 0
+    for request in sidecar.get("requests", []):
+        server = (_normalize_ip(request.get("ip")), request.get("port"))
+        if server[0] is None:
+            continue
+        total += 1
+        names.setdefault(server[0], urlsplit(request["url"]).hostname)
+        candidates = servers.get(server)
+        if not candidates:
+            continue
+        row = _pick_flow(candidates, flows, request, slack)
+        if row is not None:
+            assigned.setdefault(row, []).append((request, server))
+            matched += 1
+
+    rows = []
+    for row, flow in enumerate(flows):
+        client, server = (flow["src"], flow["sport"]), (flow["dst"], flow["dport"])
+        requests = assigned.get(row)
+        if requests:
+            if requests[0][1] == client:
+                client, server = server, client
+            requests = [request for request, _ in requests]
+            documents = [request for request in requests if request.get("document")]
+            primary = (documents or sorted(requests, key=lambda r: r.get("start") or 0))[0]
+            info = {"category": _category(primary, sites), "host": urlsplit(primary["url"]).hostname,
+                    "url": primary["url"], "type": primary.get("type"), "status": primary.get("status"),
+                    "requests": len(requests),
+                    "types": "|".join(sorted({request.get("type") or "" for request in requests}))}
+        else:
+            if client[1] < server[1]:  # 没有请求时把端口较小的一端当作服务器
+                client, server = server, client
+            info = {"category": "dns" if server[1] == 53 else "background",
+                    "host": names.get(server[0], ""), "url": "", "type": "", "status": "",
+                    "requests": 0, "types": ""}
+        rows.append({
+            "proto": flow["proto"], "src": client[0], "sport": client[1], "dst": server[0], "dport": server[1],
+            "first_seen": flow["first_seen"], "last_seen": flow["last_seen"],
+            "packets": flow["packets_fwd"] + flow["packets_rev"], "bytes": flow["bytes_fwd"] + flow["bytes_rev"],
+            **info,
+        })
+    return rows, matched, total
+
+
+def write_flow_index(path, output=None, slack=SLACK):
+    """生成并写入流索引，返回 (流数, 已对应的请求数, 有服务器地址的请求数)"""
+    rows, matched, total = build_flow_index(path, slack=slack)
+    output = output or index_name(path)
+    tmp = output + ".part"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=INDEX_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, output)
+    return len(rows), matched, total
+
+
+def load_flow_index(path):
+    """读取流索引，返回 {(proto, src, sport, dst, dport): 行}，两个方向都可以查到"""
+    index = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            proto, sport, dport = int(row["proto"]), int(row["sport"]), int(row["dport"])
+            index[(proto, row["src"], sport, row["dst"], dport)] = row
+            index[(proto, row["dst"], dport, row["src"], sport)] = row
+    return index
+
+
+def _index_worker(path, slack):
+    return write_flow_index(path, slack=slack)
+
+
+def index_folder(folder_path, workers=os.cpu_count(), force=False, slack=SLACK):
+    """为目录下有请求记录的每个 pcap 生成流索引，已有且比 pcap 新的索引跳过"""
+    todo = []
+    for path, _, mtime in _scan(folder_path):
+        output = index_name(path)
+        if not force and os.path.exists(output) and os.path.getmtime(output) >= mtime:
+            continue
+        if os.path.exists(sidecar_name(path)):
+            todo.append(path)
+    print(f"{len(todo)} captures to index")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_index_worker, path, slack): path for path in todo}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                flows, matched, total = future.result()
+            except Exception as e:
+                print(f"Failed to index {path}: {e}")
+                continue
+            print(f"{os.path.basename(path)}: {flows} flows, {matched}/{total} requests matched")
+
+
+if __name__ == "__main__":
+    # python -m utils.flowindex /traffic/datas -w 8
+    # python -m utils.flowindex 0_github_20250110125021.pcap
+    parser = argparse.ArgumentParser(description="根据 sidecar 中的请求记录生成 5 元组 -> URL 的流索引")
+    parser.add_argument("path", help="pcap 文件或目录")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="重新生成已有的索引")
+    parser.add_argument("--slack", type=float, default=SLACK, help="时间匹配的误差（秒）")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        index_folder(args.path, args.workers, args.force, args.slack)
+    else:
+        flows, matched, total = write_flow_index(args.path, slack=args.slack)
+        print(f"{index_name(args.path)}: {flows} flows, {matched}/{total} requests matched")
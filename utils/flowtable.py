@@ -0,0 +1,129 @@
+import ipaddress
+from array import array
+
+from utils.pcap import IPPROTO_TCP
+
+# TCP 握手状态（按单向流记录）
+STATE_NONE = 0
+STATE_SYN = 1
+STATE_SYN_ACK = 2
+
+TCP_SYN = 0x02
+TCP_SYN_ACK = 0x12
+TCP_ACK = 0x10
+
+ENDPOINT_BITS = 144  # 128 位地址 + 16 位端口
+
+
+def flow_key(version, src, dst, proto, sport, dport):
+    """
+    把 5 元组打包成规范化的整数键，两个方向映射到同一个键。
+    返回 (key, direction)，direction 为 0 表示 src 是较小的一端。
+    """
+    a = (int.from_bytes(src, "big") << 16) | sport
+    b = (int.from_bytes(dst, "big") << 16) | dport
+    if a <= b:
+        lo, hi, direction = a, b, 0
+    else:
+        lo, hi, direction = b, a, 1
+    return ((((lo << ENDPOINT_BITS) | hi) << 8 | proto) << 1) | (version == 6), direction
+
+
+def unpack_key(key):
+    """把整数键还原为 (src, sport, dst, dport, proto)，src 为较小的一端"""
+    is_v6 = key & 1
+    key >>= 1
+    proto = key & 0xFF
+    key >>= 8
+    mask = (1 << ENDPOINT_BITS) - 1
+    hi, lo = key & mask, key >> ENDPOINT_BITS
+    address = ipaddress.IPv6Address if is_v6 else ipaddress.IPv4Address
+    return str(address(lo >> 16)), lo & 0xFFFF, str(address(hi >> 16)), hi & 0xFFFF, proto
+
+
+class FlowTable:
+    """
+    列式流表：每个双向流占一行，聚合值存放在定长 array 列中，
+    内存只与流的数量有关，与包数无关。
+    方向相关的列按 row * 2 + direction 索引。
+    """
+
+    def __init__(self):
+        self.rows = {}  # key -> 行号
+        self.keys = []
+        self.packets = array("Q")  # 每个方向的包数
+        self.bytes = array("Q")  # 每个方向的字节数（原始长度）
+        self.first_seen = array("d")
+        self.last_seen = array("d")
+        self.tcp_state = array("B")  # 每个方向的握手状态
+        self.handshake_done = array("B")  # 每个方向是否完成三次握手
+        self.handshake_packets = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _new_row(self, key, ts):
+        row = len(self.keys)
+        self.rows[key] = row
+        self.keys.append(key)
+        self.packets.extend((0, 0))
+        self.bytes.extend((0, 0))
+        self.first_seen.append(ts)
+        self.last_seen.append(ts)
+        self.tcp_state.extend((STATE_NONE, STATE_NONE))
+        self.handshake_done.extend((0, 0))
+        return row
+
+    def add(self, ts, length, version, src, dst, proto, sport, dport, tcp_flags=0):
+        """记录一个包，返回 (行号, 方向)"""
+        key, direction = flow_key(version, src, dst, proto, sport, dport)
+        row = self.rows.get(key)
+        if row is None:
+            row = self._new_row(key, ts)
+        i = row * 2 + direction
+        self.packets[i] += 1
+        self.bytes[i] += length
+        # 合并的或多队列的抓包中包可能乱序
+        if ts > self.last_seen[row]:
+            self.last_seen[row] = ts
+        elif ts < self.first_seen[row]:
+            self.first_seen[row] = ts
+        if proto == IPPROTO_TCP:
+            self._track_handshake(row, direction, tcp_flags)
+        return row, direction
+
+    def _track_handshake(self, row, direction, tcp_flags):
+        i = row * 2 + direction
+        reverse = row * 2 + (1 - direction)
+        if tcp_flags == TCP_SYN:
+            self.tcp_state[i] = STATE_SYN
+            self.handshake_packets += 1
+        elif tcp_flags == TCP_SYN_ACK and self.tcp_state[reverse] == STATE_SYN:
+            self.tcp_state[reverse] = STATE_SYN_ACK
+            self.handshake_packets += 1
+        elif tcp_flags == TCP_ACK and self.tcp_state[i] == STATE_SYN_ACK:
+            self.tcp_state[i] = STATE_NONE
+            self.handshake_done[i] = 1
+            self.handshake_packets += 1
+
+    def unidirectional_flows(self):
+        return sum(1 for count in self.packets if count)
+
+    def bidirectional_flows(self):
+        packets = self.packets
+        return sum(1 for row in range(len(self.keys)) if packets[row * 2] and packets[row * 2 + 1])
+
+    def completed_handshakes(self):
+        return sum(self.handshake_done)
+
+    def iter_flows(self):
+        """逐个返回流的聚合结果"""
+        for row, key in enumerate(self.keys):
+            src, sport, dst, dport, proto = unpack_key(key)
+            yield {
+                "src": src, "sport": sport, "dst": dst, "dport": dport, "proto": proto,
+                "packets_fwd": self.packets[row * 2], "packets_rev": self.packets[row * 2 + 1],
+                "bytes_fwd": self.bytes[row * 2], "bytes_rev": self.bytes[row * 2 + 1],
+                "first_seen": self.first_seen[row], "last_seen": self.last_seen[row],
+                "handshake": bool(self.handshake_done[row * 2] or self.handshake_done[row * 2 + 1]),
+            }
@@ -0,0 +1,367 @@
+import struct
+
+from utils.compress import open_compressed
+
+PCAP_MAGIC_USEC = 0xA1B2C3D4
+PCAP_MAGIC_NSEC = 0xA1B23C4D
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+
+class PcapRecord:
+    __slots__ = ("ts_sec", "ts_frac", "caplen", "origlen", "data", "linktype")
+
+    def __init__(self, ts_sec, ts_frac, caplen, origlen, data, linktype=LINKTYPE_ETHERNET):
+        self.ts_sec = ts_sec
+        self.ts_frac = ts_frac
+        self.caplen = caplen
+        self.origlen = origlen
+        self.data = data
+        self.linktype = linktype
+
+
+class PcapReader:
+    """
+    逐条读取经典 pcap 文件（可以是 gzip/zstd 压缩的），不会一次性加载整个文件。
+    文件末尾被截断的记录（例如仍在写入的文件）会被忽略。
+    path 也可以是已打开的二进制流（例如 tshark 的标准输出）。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = path if hasattr(path, "read") else open_compressed(path)
+        header = self.file.read(PCAP_GLOBAL_HEADER_LEN)
+        if len(header) < PCAP_GLOBAL_HEADER_LEN:
+            raise ValueError(f"{path} 不是有效的 pcap 文件")
+        magic = struct.unpack("<I", header[:4])[0]
+        if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            self.endian = "<"
+        else:
+            magic = struct.unpack(">I", header[:4])[0]
+            if magic not in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+                raise ValueError(f"{path} 不是有效的 pcap 文件")
+            self.endian = ">"
+        self.nanosecond = magic == PCAP_MAGIC_NSEC
+        _, _, _, _, self.snaplen, self.linktype = struct.unpack(self.endian + "HHiIII", header[4:])
+        self._record_header = struct.Struct(self.endian + "IIII")
+
+    def timestamp(self, record):
+        return record.ts_sec + record.ts_frac / (1e9 if self.nanosecond else 1e6)
+
+    def __iter__(self):
+        read = self.file.read
+        unpack = self._record_header.unpack
+        linktype = self.linktype
+        while True:
+            header = read(PCAP_RECORD_HEADER_LEN)
+            if len(header) < PCAP_RECORD_HEADER_LEN:
+                return
+            ts_sec, ts_frac, caplen, origlen = unpack(header)
+            data = read(caplen)
+            if len(data) < caplen:
+                return
+            yield PcapRecord(ts_sec, ts_frac, caplen, origlen, data, linktype)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _open_output(path):
+    """path 可以是文件路径，也可以是任意带 write() 的二进制对象"""
+    if hasattr(path, "write"):
+        return path, False
+    return open(path, "wb"), True
+
+
+class PcapWriter:
+    """写入经典 pcap 文件（小端序）"""
+
+    def __init__(self, path, linktype=LINKTYPE_ETHERNET, snaplen=262144, nanosecond=False):
+        self.file, self._owns_file = _open_output(path)
+        self.nanosecond = nanosecond
+        magic = PCAP_MAGIC_NSEC if nanosecond else PCAP_MAGIC_USEC
+        self.file.write(struct.pack("<IHHiIII", magic, 2, 4, 0, 0, snaplen, linktype))
+
+    def write(self, record):
+        self.file.write(struct.pack("<IIII", record.ts_sec, record.ts_frac, len(record.data), record.origlen)
+                        + record.data)
+
+    def close(self):
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_IDB = 0x00000001
+PCAPNG_EPB = 0x00000006
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+
+
+def _pad4(data):
+    return data + b"\x00" * (-len(data) % 4)
+
+
+def _pcapng_option(code, value):
+    return struct.pack("<HH", code, len(value)) + _pad4(value)
+
+
+class PcapngWriter:
+    """写入 pcapng 文件（小端序，单接口，纳秒时间戳）"""
+
+    def __init__(self, path, linktype=LINKTYPE_ETHERNET, snaplen=262144, nanosecond=True):
+        self.file, self._owns_file = _open_output(path)
+        self.nanosecond = nanosecond
+        self.position = 0  # 已写入的字节数，即下一个块的偏移
+        self.write_block(PCAPNG_SHB, struct.pack("<IHHq", PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1))
+        # if_tsresol = 9 表示纳秒，6 表示微秒
+        options = _pcapng_option(9, bytes([9 if nanosecond else 6])) + _pcapng_option(0, b"")
+        self.write_block(PCAPNG_IDB, struct.pack("<HHI", linktype, 0, snaplen) + options)
+
+    def write_block(self, block_type, body):
+        body = _pad4(body)
+        length = len(body) + 12
+        self.file.write(struct.pack("<II", block_type, length) + body + struct.pack("<I", length))
+        self.position += length
+
+    def write(self, record):
+        scale = 1 if self.nanosecond else 1000
+        ts = record.ts_sec * (1000000000 // scale) + record.ts_frac
+        body = struct.pack("<IIIII", 0, ts >> 32, ts & 0xFFFFFFFF, len(record.data), record.origlen) + record.data
+        self.write_block(PCAPNG_EPB, body)
+
+    def close(self):
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+PCAPNG_SPB = 0x00000003
+PCAPNG_OPB = 0x00000002
+
+
+class PcapngReader:
+    """
+    逐块读取 pcapng 文件，支持多接口和 if_tsresol；
+    所有记录的时间戳统一换算为纳秒（ts_frac 为纳秒部分）。
+    """
+
+    nanosecond = True
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open_compressed(path)
+        self.position = 0  # 下一个块在（解压后）文件中的偏移
+        self.endian = "<"
+        self.interfaces = []  # [(linktype, snaplen, ticks_per_second)]
+        self.linktype = LINKTYPE_ETHERNET
+        self.snaplen = 262144
+
+    def timestamp(self, record):
+        return record.ts_sec + record.ts_frac / 1e9
+
+    def _read_block(self):
+        header = self.file.read(8)
+        if len(header) < 8:
+            return None, None
+        if struct.unpack("<I", header[:4])[0] == PCAPNG_SHB:  # SHB 类型值前后对称，与字节序无关
+            magic = self.file.read(4)
+            if len(magic) < 4:
+                return None, None
+            self.endian = "<" if struct.unpack("<I", magic)[0] == PCAPNG_BYTE_ORDER_MAGIC else ">"
+            self.interfaces = []
+            length = struct.unpack(self.endian + "I", header[4:8])[0]
+            body = magic + self.file.read(length - 12)
+            block_type = PCAPNG_SHB
+        else:
+            block_type, length = struct.unpack(self.endian + "II", header)
+            body = self.file.read(length - 8)
+        if length < 12 or len(body) < length - 8:
+            return None, None
+        self.position += length
+        return block_type, body[:-4]
+
+    def _parse_idb(self, body):
+        linktype, _, snaplen = struct.unpack_from(self.endian + "HHI", body)
+        ticks = 1000000
+        offset = 8
+        while offset + 4 <= len(body):
+            code, length = struct.unpack_from(self.endian + "HH", body, offset)
+            if code == 0:
+                break
+            if code == 9 and length >= 1:
+                resol = body[offset + 4]
+                ticks = 2 ** (resol & 0x7F) if resol & 0x80 else 10 ** resol
+            offset += 4 + length + (-length % 4)
+        self.interfaces.append((linktype, snaplen, ticks))
+        if len(self.interfaces) == 1:
+            self.linktype, self.snaplen = linktype, snaplen
+
+    def _record(self, block_type, body):
+        """把数据包块转换为记录；接口描述块在这里登记，其他块返回 None"""
+        if block_type == PCAPNG_EPB:
+            if_id, ts_high, ts_low, caplen, origlen = struct.unpack_from(self.endian + "IIIII", body)
+            data = body[20:20 + caplen]
+        elif block_type == PCAPNG_SPB:
+            origlen = struct.unpack_from(self.endian + "I", body)[0]
+            if_id, ts_high, ts_low = 0, 0, 0
+            caplen = min(origlen, self.interfaces[0][1] or origlen)
+            data = body[4:4 + caplen]
+        elif block_type == PCAPNG_IDB:
+            self._parse_idb(body)
+            return None
+        else:
+            return None
+        linktype, _, ticks = self.interfaces[if_id]
+        ts = (ts_high << 32) | ts_low
+        ts_sec, rest = divmod(ts, ticks)
+        return PcapRecord(ts_sec, rest * 1000000000 // ticks, caplen, origlen, data, linktype)
+
+    def blocks(self):
+        """逐块返回 (偏移, 块类型, 块内容)，内容不含块头和结尾长度"""
+        while True:
+            offset = self.position
+            block_type, body = self._read_block()
+            if block_type is None:
+                return
+            yield offset, block_type, body
+
+    def __iter__(self):
+        read_block = self._read_block
+        to_record = self._record
+        while True:
+            block_type, body = read_block()
+            if block_type is None:
+                return
+            record = to_record(block_type, body)
+            if record is not None:
+                yield record
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_pcap(path):
+    """根据文件头自动选择 pcap 或 pcapng 读取器，gzip/zstd 压缩的文件透明解压"""
+    with open_compressed(path) as f:
+        magic = f.read(4)
+    if len(magic) == 4 and struct.unpack("<I", magic)[0] == PCAPNG_SHB:
+        return PcapngReader(path)
+    return PcapReader(path)
+
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+ETH_P_8021Q = 0x8100
+ETH_P_8021AD = 0x88A8
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT = 44
+
+
+def _network_offset(linktype, data):
+    """返回 (以太类型, 网络层偏移)，无法识别时返回 (None, None)"""
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None, None
+        ethertype, offset = (data[12] << 8) | data[13], 14
+        while ethertype in (ETH_P_8021Q, ETH_P_8021AD) and len(data) >= offset + 4:
+            ethertype, offset = (data[offset + 2] << 8) | data[offset + 3], offset + 4
+        return ethertype, offset
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        if not data:
+            return None, None
+        version = data[0] >> 4
+        return (ETH_P_IP if version == 4 else ETH_P_IPV6 if version == 6 else None), 0
+    if linktype == LINKTYPE_LINUX_SLL:
+        return ((data[14] << 8) | data[15], 16) if len(data) >= 16 else (None, None)
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return ((data[0] << 8) | data[1], 20) if len(data) >= 20 else (None, None)
+    if linktype == LINKTYPE_NULL:
+        if len(data) < 4:
+            return None, None
+        family = struct.unpack_from("=I", data)[0]
+        return (ETH_P_IP if family == 2 else ETH_P_IPV6 if family in (24, 28, 30) else None), 4
+    return None, None
+
+
+def decode_packet(linktype, data):
+    """
+    只解析统计需要的 IP/TCP/UDP 头部字段，不构造任何协议对象。
+
+    返回 (ip_version, src, dst, proto, sport, dport, tcp_flags, payload_offset)，
+    src/dst 为原始地址字节；未解析传输层（非 TCP/UDP 或头部不完整）时端口为 None；
+    非 IP 包返回 None。
+    分片（非首片）不解析传输层，与 scapy 行为一致。
+    """
+    ethertype, offset = _network_offset(linktype, data)
+    if ethertype == ETH_P_IP:
+        if len(data) < offset + 20:
+            return None
+        ihl = (data[offset] & 0x0F) * 4
+        proto = data[offset + 9]
+        src = data[offset + 12:offset + 16]
+        dst = data[offset + 16:offset + 20]
+        fragment = ((data[offset + 6] & 0x1F) << 8) | data[offset + 7]
+        version = 4
+        l4 = offset + ihl
+    elif ethertype == ETH_P_IPV6:
+        if len(data) < offset + 40:
+            return None
+        proto = data[offset + 6]
+        src = data[offset + 8:offset + 24]
+        dst = data[offset + 24:offset + 40]
+        fragment = 0
+        version = 6
+        l4 = offset + 40
+        while proto in IPV6_EXTENSION_HEADERS or proto == IPV6_FRAGMENT:
+            if len(data) < l4 + 8:
+                break
+            if proto == IPV6_FRAGMENT:
+                fragment = ((data[l4 + 2] << 8) | data[l4 + 3]) >> 3
+                proto, l4 = data[l4], l4 + 8
+            else:
+                proto, l4 = data[l4], l4 + (data[l4 + 1] + 1) * 8
+    else:
+        return None
+
+    if fragment == 0:
+        if proto == IPPROTO_TCP and len(data) >= l4 + 14:
+            sport, dport = struct.unpack_from("!HH", data, l4)
+            flags = ((data[l4 + 12] & 0x01) << 8) | data[l4 + 13]
+            return version, src, dst, proto, sport, dport, flags, l4 + (data[l4 + 12] >> 4) * 4
+        if proto == IPPROTO_UDP and len(data) >= l4 + 8:
+            sport, dport = struct.unpack_from("!HH", data, l4)
+            return version, src, dst, proto, sport, dport, 0, l4 + 8
+    return version, src, dst, proto, None, None, 0, l4
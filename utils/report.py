@@ -1,12 +1,82 @@
 import csv
+import io
+import json
 import os
+import sqlite3
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import scapy.all as scapy
 from tqdm import tqdm
 
+from utils.compress import is_capture_file
+from utils.flowtable import FlowTable
+from utils.pcap import IPPROTO_TCP, IPPROTO_UDP, decode_packet, open_pcap
+
+
+def analyze_pcap(file_path, progress=True):
+    """
+    流式统计 pcap/pcapng：逐条读取记录，只用 struct 解析 IP/TCP/UDP 头部，
+    流和握手状态记录在列式 FlowTable 中，内存只与流的数量有关。
+    流按 5 元组（含协议）区分，同一 4 元组上的 TCP 与 UDP 分别计为两个流。
+    """
+    total_packets = 0
+    total_length = 0
+    tcp_count = 0
+    udp_count = 0
+    flows = FlowTable()
+
+    with open_pcap(file_path) as reader, \
+            tqdm(total=os.path.getsize(file_path), unit="B", unit_scale=True, disable=not progress,
+                 desc=f"Processing {os.path.basename(file_path)}") as bar:
+        consumed = 0
+        for record in reader:
+            total_packets += 1
+            total_length += record.origlen  # 按原始长度统计，截断抓包（snaplen/抓包配置档）时结果不变
+            consumed += record.caplen + 16
+            if total_packets % 10000 == 0:
+                bar.update(consumed)
+                consumed = 0
+
+            decoded = decode_packet(record.linktype, record.data)
+            # 与 scapy.IP 一致，只统计 IPv4
+            if decoded is None or decoded[0] != 4:
+                continue
+            version, ip_src, ip_dst, proto, sport, dport, tcp_flags, _ = decoded
+            if sport is None:
+                continue
+            if proto == IPPROTO_TCP:
+                tcp_count += 1
+            elif proto == IPPROTO_UDP:
+                udp_count += 1
+            else:
+                continue
+            flows.add(reader.timestamp(record), record.origlen, version, ip_src, ip_dst, proto, sport, dport, tcp_flags)
+        bar.update(consumed)
+
+    avg_packet_length = total_length / total_packets if total_packets > 0 else 0
+    tcp_ratio = tcp_count / total_packets if total_packets > 0 else 0
+    udp_ratio = udp_count / total_packets if total_packets > 0 else 0
+
+    return {
+        "file_name": os.path.basename(file_path),
+        "total_packets": total_packets,
+        "total_flows": flows.unidirectional_flows(),
+        "total_bidirectional_flows": flows.bidirectional_flows(),
+        "avg_packet_length": avg_packet_length,
+        "tcp_count": tcp_count,
+        "tcp_ratio": f"{tcp_ratio:.2%}",
+        "udp_count": udp_count,
+        "udp_ratio": f"{udp_ratio:.2%}",
+        "tcp_handshake_packets": flows.handshake_packets,
+        "completed_tcp_handshakes": flows.completed_handshakes(),
+    }
+
+
+def analyze_pcap_scapy(file_path):
+    """原始的 scapy 实现，rdpcap 会把所有包加载进内存，仅用于对照基准"""
+    import scapy.all as scapy
 
-def analyze_pcap(file_path):
     packets = scapy.rdpcap(file_path)
 
     # 初始化统计数据
@@ -81,29 +151,143 @@ def analyze_pcap(file_path):
     }
 
 
-def analyze_folder(folder_path, output_csv):
-    # 遍历文件夹中的所有 PCAP 文件
-    pcap_files = [os.path.join(folder_path, f) for f in os.listdir(folder_path) if f.endswith(".pcap")]
+# CSV 表头
+REPORT_HEADERS = [
+    "file_name", "total_packets", "total_flows", "total_bidirectional_flows",
+    "avg_packet_length", "tcp_count", "tcp_ratio", "udp_count", "udp_ratio",
+    "tcp_handshake_packets", "completed_tcp_handshakes"
+]
+
+
+class ResultCache:
+    """按 (路径, 大小, 修改时间) 缓存每个文件的统计结果，文件未变化时不再重复分析"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, stats TEXT)"
+        )
+
+    def unchanged(self):
+        return {(path, size, mtime) for path, size, mtime in
+                self.conn.execute("SELECT path, size, mtime FROM results")}
+
+    def results(self):
+        """按路径排序的全部统计结果，每个文件只有最新的一条"""
+        return [json.loads(stats) for stats, in self.conn.execute("SELECT stats FROM results ORDER BY path")]
+
+    def prune(self, paths):
+        """删除不在 paths 中（文件已删除）的缓存，返回删除的条数"""
+        stale = [(path,) for path, in self.conn.execute("SELECT path FROM results") if path not in paths]
+        self.conn.executemany("DELETE FROM results WHERE path = ?", stale)
+        return len(stale)
+
+    def put(self, path, size, mtime, stats):
+        self.conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                          (path, size, mtime, json.dumps(stats)))
+
+    def commit(self):
+        self.conn.commit()
 
-    # CSV 表头
-    headers = [
-        "file_name", "total_packets", "total_flows", "total_bidirectional_flows",
-        "avg_packet_length", "tcp_count", "tcp_ratio", "udp_count", "udp_ratio",
-        "tcp_handshake_packets", "completed_tcp_handshakes"
-    ]
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
 
-    with open(output_csv, mode="w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=headers)
-        writer.writeheader()
 
-        for file_path in pcap_files:
-            stats = analyze_pcap(file_path)
+def _scan(folder_path):
+    """返回目录下所有 pcap 文件的 (路径, 大小, 修改时间)"""
+    entries = []
+    for entry in os.scandir(folder_path):
+        if entry.is_file() and is_capture_file(entry.name):
+            stat = entry.stat()
+            entries.append((entry.path, stat.st_size, stat.st_mtime))
+    return entries
+
+
+def _rewrite_csv(output_csv, rows):
+    """CSV 内容与 rows 不同时原子地重写（中断的运行可能留下重复或不完整的行），返回是否重写"""
+    buffer = io.StringIO(newline="")
+    writer = csv.DictWriter(buffer, fieldnames=REPORT_HEADERS)
+    writer.writeheader()
+    writer.writerows(rows)
+    content = buffer.getvalue()
+    if os.path.exists(output_csv):
+        with open(output_csv, newline="") as csvfile:
+            if csvfile.read() == content:
+                return False
+    tmp = output_csv + ".tmp"
+    with open(tmp, "w", newline="") as csvfile:
+        csvfile.write(content)
+    os.replace(tmp, output_csv)
+    return True
+
+
+def _analyze_worker(file_path):
+    return analyze_pcap(file_path, progress=False)
+
+
+def analyze_folder(folder_path, output_csv, workers=os.cpu_count(), cache_path=None, parquet_dir=None):
+    """
+    多进程增量分析：只分析新增或变化的文件，结果缓存在 SQLite 中。分析过程中结果先追加到 CSV，
+    结束后按缓存重写 CSV，变化过的文件只保留最新一行。可选同时把本次的结果写入一个 Parquet 分片
+    （分片只追加，同一文件可能出现在多个分片中，读取时按 file_name 取最新分片；需要 pandas 和 pyarrow）。
+    已删除文件的缓存和 CSV 行会被清除。
+    """
+    cache = ResultCache(cache_path or os.path.join(folder_path, ".report_cache.sqlite"))
+    entries = _scan(folder_path)
+    removed = cache.prune({path for path, _, _ in entries})
+    done = cache.unchanged()
+    todo = [entry for entry in entries if entry not in done]
+    print(f"{len(todo)} new or changed files, {len(done)} cached, {removed} removed")
+    if not todo:
+        cache.commit()
+        if _rewrite_csv(output_csv, cache.results()):
+            print(f"{output_csv} rewritten from cache")
+        cache.close()
+        return
+
+    write_header = not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0
+    rows = []
+    with open(output_csv, mode="a", newline="") as csvfile, \
+            ProcessPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=sum(size for _, size, _ in todo), unit="B", unit_scale=True, desc="Analyzing") as bar:
+        writer = csv.DictWriter(csvfile, fieldnames=REPORT_HEADERS)
+        if write_header:
+            writer.writeheader()
+
+        futures = {executor.submit(_analyze_worker, path): (path, size, mtime) for path, size, mtime in todo}
+        for future in as_completed(futures):
+            path, size, mtime = futures[future]
+            bar.update(size)
+            try:
+                stats = future.result()
+            except Exception as e:
+                print(f"Failed to analyze {path}: {e}")  # 不写缓存，下次重试
+                continue
+            # 先落盘 CSV 再写缓存，中断时最多产生重复行而不会丢行
             writer.writerow(stats)
+            csvfile.flush()
+            cache.put(path, size, mtime, stats)
+            rows.append(stats)
+            if len(rows) % 100 == 0:
+                cache.commit()
+    cache.commit()
+    _rewrite_csv(output_csv, cache.results())
+    cache.close()
+
+    if parquet_dir and rows:
+        import pandas as pd
+
+        os.makedirs(parquet_dir, exist_ok=True)
+        part = os.path.join(parquet_dir, f"part-{time.strftime('%Y%m%d%H%M%S')}.parquet")
+        pd.DataFrame(rows, columns=REPORT_HEADERS).to_parquet(part, index=False)
 
-    print(f"Analysis complete. Results saved to {output_csv}")
+    print(f"Analysis complete. {len(rows)} files analyzed, {output_csv} rewritten")
 
 
 # 示例调用
-folder_path = r"E:\dataset\pcap_files"  # 替换为你的 PCAP 文件夹路径
-output_csv = r"D:\code\Traffic\build_datas\test\pcap_report.csv"  # 替换为保存的 CSV 文件路径
-analyze_folder(folder_path, output_csv)
+if __name__ == "__main__":
+    folder_path = r"E:\dataset\pcap_files"  # 替换为你的 PCAP 文件夹路径
+    output_csv = r"D:\code\Traffic\build_datas\test\pcap_report.csv"  # 替换为保存的 CSV 文件路径
+    analyze_folder(folder_path, output_csv)
@@ -0,0 +1,236 @@
+import argparse
+import io
+import json
+import os
+import struct
+import threading
+
+from utils.compress import sidecar_name
+from utils.pcap import LINKTYPE_ETHERNET, PCAPNG_IDB, PCAPNG_SHB, PcapngReader, PcapngWriter, PcapWriter
+
+# 可复制的自定义块（Custom Block），编辑工具会原样保留
+PCAPNG_CB = 0x00000BAD
+# 自定义块需要企业号，这里使用 RFC 5612 为文档和示例保留的 32473
+SESSION_PEN = 32473
+
+
+def marker_body(marker):
+    return struct.pack("<I", SESSION_PEN) + json.dumps(marker, ensure_ascii=False).encode("utf-8")
+
+
+def parse_marker(endian, body):
+    """解析标记块，不是本项目的标记时返回 None"""
+    if len(body) < 4 or struct.unpack_from(endian + "I", body)[0] != SESSION_PEN:
+        return None
+    try:
+        return json.loads(body[4:].rstrip(b"\x00").decode("utf-8"))
+    except ValueError:
+        return None
+
+
+class SessionWriter:
+    """
+    会话模式的 pcapng 写入器：一个抓包覆盖多个 URL，每个 URL 前后各插入一个标记块
+    （Custom Block，内容为 JSON：event、ts、url、name、index）。
+
+    爬虫线程调用 mark() 登记标记，抓包线程写入数据包时按时间戳把标记插到正确位置，
+    同时记录每段在（未压缩）文件中的偏移，作为索引写入 sidecar，读取时可直接定位。
+    链路类型在收到抓包输出的文件头后才确定，因此由 open() 写入文件头。
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.writer = None
+        self.scale = 1e9
+        self.pending = []  # 尚未写入的标记，按时间排序
+        self.lock = threading.Lock()
+        self.segments = []
+        self.current = None  # 正在写入的段
+        self.data_offset = None  # 文件头（SHB/IDB）之后第一个块的偏移
+        self.packets = 0
+
+    def open(self, linktype=LINKTYPE_ETHERNET, snaplen=262144, nanosecond=True):
+        self.writer = PcapngWriter(self.sink, linktype, snaplen, nanosecond)
+        self.scale = 1e9 if nanosecond else 1e6
+        self.data_offset = self.writer.position
+        return self
+
+    def mark(self, event, ts, **fields):
+        with self.lock:
+            self.pending.append(dict(fields, event=event, ts=ts))
+
+    def _write_markers(self, until=None):
+        with self.lock:
+            if until is None:
+                ready, self.pending = self.pending, []
+            else:
+                split = 0
+                while split < len(self.pending) and self.pending[split]["ts"] <= until:
+                    split += 1
+                ready, self.pending = self.pending[:split], self.pending[split:]
+        for marker in ready:
+            offset = self.writer.position
+            self.writer.write_block(PCAPNG_CB, marker_body(marker))
+            if marker["event"] == "start":
+                fields = {key: value for key, value in marker.items() if key not in ("event", "ts")}
+                self.current = dict(fields, start=marker["ts"], offset=offset, packets=0)
+                self.segments.append(self.current)
+            elif marker["event"] == "end" and self.current is not None:
+                self.current["end"] = marker["ts"]
+                self.current["end_offset"] = self.writer.position
+                self.current = None
+
+    def write(self, record):
+        if self.pending:
+            self._write_markers(record.ts_sec + record.ts_frac / self.scale)
+        self.writer.write(record)
+        self.packets += 1
+        if self.current is not None:
+            self.current["packets"] += 1
+
+    def close(self):
+        if self.writer is None:
+            self.open()  # 没有抓到任何数据，仍然输出只含标记的文件
+        self._write_markers()
+        self.writer.close()
+
+    def index(self):
+        return {"data_offset": self.data_offset, "segments": self.segments}
+
+
+def build_index(path):
+    """没有 sidecar 时扫描标记块重建索引，只解析块头，不解码数据包"""
+    segments = []
+    current = None
+    data_offset = None
+    with PcapngReader(path) as reader:
+        for offset, block_type, body in reader.blocks():
+            if block_type == PCAPNG_IDB:
+                reader._parse_idb(body)
+                continue
+            if block_type == PCAPNG_SHB:
+                continue
+            if data_offset is None:
+                data_offset = offset
+            if block_type == PCAPNG_CB:
+                marker = parse_marker(reader.endian, body)
+                if marker is None:
+                    continue
+                if marker["event"] == "start":
+                    fields = {key: value for key, value in marker.items() if key not in ("event", "ts")}
+                    current = dict(fields, start=marker["ts"], offset=offset, packets=0)
+                    segments.append(current)
+                elif marker["event"] == "end" and current is not None:
+                    current["end"] = marker["ts"]
+                    current["end_offset"] = reader.position
+                    current = None
+            elif current is not None:
+                current["packets"] += 1
+    return {"data_offset": data_offset, "segments": segments}
+
+
+def load_index(path):
+    """优先读取 sidecar 中的索引"""
+    sidecar = sidecar_name(path)
+    if os.path.exists(sidecar):
+        with open(sidecar, encoding="utf-8") as f:
+            data = json.load(f)
+        if "segments" in data:
+            return data
+    return build_index(path)
+
+
+def _seek(reader, offset):
+    """定位到（解压后）文件中的 offset；压缩文件不能随机访问时顺序跳过"""
+    try:
+        reader.file.seek(offset)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        remaining = offset - reader.position
+        while remaining > 0:
+            chunk = reader.file.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+    reader.position = offset
+
+
+class SessionReader:
+    """
+    按索引读取会话 pcapng 中某个 URL 的数据段：先读文件头（SHB/IDB），
+    再直接跳到段的偏移，只解析这一段的数据包。
+    未压缩的文件直接 seek；压缩文件只解压、不解析段之前的数据。
+    """
+
+    def __init__(self, path, index=None):
+        self.path = path
+        index = index or load_index(path)
+        self.data_offset = index.get("data_offset")
+        self.segments = index["segments"]
+
+    def find(self, key):
+        """key 可以是段的序号、URL 或名称"""
+        if isinstance(key, int):
+            return self.segments[key]
+        for segment in self.segments:
+            if key in (segment.get("url"), segment.get("name")):
+                return segment
+        raise KeyError(key)
+
+    def read(self, key):
+        """返回 (读取器, 记录迭代器)，读取器提供 linktype/timestamp()"""
+        segment = self.find(key)
+        reader = PcapngReader(self.path)
+        for offset, block_type, body in reader.blocks():
+            if block_type == PCAPNG_IDB:
+                reader._parse_idb(body)
+            elif block_type != PCAPNG_SHB:
+                break
+            if self.data_offset is not None and reader.position >= self.data_offset:
+                break
+        _seek(reader, segment["offset"])
+        return reader, self._records(reader, segment.get("end_offset"))
+
+    @staticmethod
+    def _records(reader, end_offset):
+        try:
+            for offset, block_type, body in reader.blocks():
+                if end_offset is not None and offset >= end_offset:
+                    return
+                record = reader._record(block_type, body)
+                if record is not None:
+                    yield record
+        finally:
+            reader.close()
+
+    def extract(self, key, output):
+        """把一个段写成独立的 pcap 文件，返回数据包数"""
+        reader, records = self.read(key)
+        count = 0
+        with PcapWriter(output, reader.linktype, reader.snaplen, nanosecond=True) as writer:
+            for record in records:
+                writer.write(record)
+                count += 1
+        return count
+
+
+if __name__ == "__main__":
+    # python -m utils.session list 0_session_20250110125021.pcapng
+    # python -m utils.session extract 0_session_20250110125021.pcapng --url https://github.com -o github.pcap
+    parser = argparse.ArgumentParser(description="读取会话模式的 pcapng")
+    parser.add_argument("command", choices=["list", "extract", "reindex"])
+    parser.add_argument("path")
+    parser.add_argument("--url", help="URL、名称或段序号")
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args()
+
+    if args.command == "reindex":
+        print(json.dumps(build_index(args.path), ensure_ascii=False, indent=2))
+    elif args.command == "list":
+        for i, segment in enumerate(SessionReader(args.path).segments):
+            duration = segment.get("end", segment["start"]) - segment["start"]
+            print(f"{i:4d}  {segment.get('packets', 0):8d} pkts  {duration:7.1f}s  {segment.get('url')}")
+    else:
+        session = SessionReader(args.path)
+        key = int(args.url) if args.url.isdigit() else args.url
+        output = args.output or f"{session.find(key).get('name', key)}.pcap"
+        print(f"{session.extract(key, output)} packets -> {output}")